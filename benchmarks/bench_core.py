@@ -0,0 +1,123 @@
+"""
+Benchmarks of decoding, validating, dispatching and encoding, in process.
+
+    python benchmarks/bench_core.py
+"""
+
+import json
+
+from harness import new_event_loop, time_async, time_sync
+
+from json_rpc.codec import CODECS, get_codec
+from json_rpc.dispacher import Dispatcher
+from json_rpc.jsonrpc import JSONRPCResponse, decode, encode, process_request
+from json_rpc.processor import BasicJSONRPCProcessor
+
+BATCH_SIZES = (1, 10, 100, 1000)
+
+CALL = {"jsonrpc": "2.0", "method": "add", "params": [42, 23], "id": 1}
+RESULT = {"name": "sensor-7", "values": list(range(20)), "ok": True, "ratio": 0.25}
+
+
+def add(a, b):
+    return a + b
+
+
+async def add_async(a, b):
+    return a + b
+
+
+def make_batch(size):
+    return json.dumps([dict(CALL, id=id) for id in range(size)]).encode()
+
+
+def make_dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.register_method(add, name="add")
+    dispatcher.register_method(add_async, name="add_async")
+    dispatcher.register_method(add, name="add_threads", executor="threads")
+    return dispatcher
+
+
+class DispatchingProcessor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, dispatcher, batch_concurrency=1):
+        self.dispatcher = dispatcher
+        self.batch_concurrency = batch_concurrency
+
+    async def compute_result(self, request):
+        return await self.dispatcher.dispatch(None, request)
+
+
+def bench_codecs(number):
+    results = {}
+    single = json.dumps(CALL).encode()
+    batch = make_batch(100)
+    response = JSONRPCResponse("2.0", id=1, result=RESULT)
+    responses = [JSONRPCResponse("2.0", id=id, result=RESULT) for id in range(100)]
+
+    for name in sorted(CODECS):
+        codec = get_codec(name)
+        results["decode.%s.single" % name] = time_sync(lambda: decode(single, codec=codec), number)
+        results["decode.%s.batch100" % name] = time_sync(lambda: decode(batch, codec=codec), number // 100)
+        results["encode.%s.single" % name] = time_sync(lambda: encode(response, codec), number)
+        results["encode.%s.batch100" % name] = time_sync(lambda: encode(responses, codec), number // 100)
+    return results
+
+
+def bench_process_request(number):
+    invalid = {"jsonrpc": "2.0", "params": [1], "id": 2}
+    return {
+        "process_request.valid": time_sync(lambda: process_request(CALL), number),
+        "process_request.invalid": time_sync(lambda: process_request(invalid), number),
+    }
+
+
+def bench_dispatch(number):
+    loop = new_event_loop()
+    dispatcher = make_dispatcher()
+    results = {}
+    try:
+        for method, label in (("add", "sync"), ("add_async", "async"), ("add_threads", "threads")):
+            request = process_request(dict(CALL, method=method))
+            count = number // 10 if label == "threads" else number
+            results["dispatch.%s" % label] = time_async(
+                loop, lambda: dispatcher.dispatch(None, request), count)
+    finally:
+        dispatcher.shutdown_executors()
+        loop.close()
+    return results
+
+
+def bench_batches(number):
+    loop = new_event_loop()
+    results = {}
+    try:
+        for concurrency in (1, None):
+            processor = DispatchingProcessor(make_dispatcher(), batch_concurrency=concurrency)
+            label = "sequential" if concurrency == 1 else "concurrent"
+            for size in BATCH_SIZES:
+                body = make_batch(size)
+                metrics = time_async(loop, lambda: processor.process_jsonrpc(body),
+                                     max(1, number // size // 10), repeat=3)
+                metrics["calls_per_sec"] = metrics["ops_per_sec"] * size
+                results["batch.%s.%d" % (label, size)] = metrics
+    finally:
+        loop.close()
+    return results
+
+
+def run(quick=False):
+    number = 2000 if quick else 20000
+    results = {}
+    results.update(bench_codecs(number))
+    results.update(bench_process_request(number))
+    results.update(bench_dispatch(number))
+    results.update(bench_batches(number))
+    return results
+
+
+if __name__ == "__main__":
+    for name, metrics in sorted(run().items()):
+        print("{:<32} {:10.2f} us/op".format(name, metrics["us_per_op"]))
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of the request/response object model.
+
+Times building request objects from decoded calls, reading their
+attributes and building the responses, without any JSON work.
+
+    python benchmarks/bench_request_model.py
+"""
+
+import timeit
+
+from json_rpc.jsonrpc import JSONRPCResponse, process_request
+from json_rpc.exceptions import MethodNotFound
+
+CALLS = [
+    {"jsonrpc": "2.0", "method": "subtract", "params": [42, 23], "id": 1},
+    {"jsonrpc": "2.0", "method": "update", "params": {"a": 1, "b": 2}},
+    {"jsonrpc": "2.0", "method": "get_data", "id": "9"},
+    {"method": "echo", "params": ["hello"], "id": 7},
+]
+INVALID = [
+    {"jsonrpc": "2.0", "params": [1], "id": 2},
+    {"jsonrpc": "2.0", "method": 1, "id": 3},
+]
+
+
+def build_requests():
+    for call in CALLS:
+        request = process_request(call, None)
+        request.validate()
+        request.method, request.id, request.is_notification
+
+
+def build_invalid_requests():
+    for call in INVALID:
+        process_request(call, None)
+
+
+def build_responses():
+    for id in range(4):
+        JSONRPCResponse("2.0", id=id, result=id).toJson()
+    JSONRPCResponse("2.0", id=5, exception=MethodNotFound("nope")).toJson()
+
+
+def main(number=50000, repeat=5):
+    for name, func in [("requests", build_requests),
+                       ("invalid requests", build_invalid_requests),
+                       ("responses", build_responses)]:
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        print("{:<20} {:8.3f} us/iteration".format(name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+End to end benchmarks against a local Tornado server, and event fan-out.
+
+The server and the clients of `json_rpc.client` share one event loop, the
+numbers include the cost of both sides.
+
+    python benchmarks/bench_transports.py
+"""
+
+import asyncio
+import time
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+from harness import latency_stats, new_event_loop
+
+from json_rpc.client import HTTPClient, WebSocketClient
+from json_rpc.dispacher import Dispatcher
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS
+
+CONCURRENCY = (1, 16)
+FAN_OUT = (1, 100, 1000)
+
+
+async def add(a, b):
+    return a + b
+
+
+class Subscriber:
+    """Stands for a connection, only counts the messages."""
+
+    def __init__(self):
+        self.received = 0
+
+    def emit_message(self, data):
+        self.received += 1
+
+
+def make_app(dispatcher):
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch, "version": "2.0"}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ])
+
+
+async def load(client, total, concurrency):
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            await client.call("add", 1, 2)
+            latencies.append(time.perf_counter() - start)
+
+    await worker(10)  # warm up, opens the connections
+    latencies.clear()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(total // concurrency) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    metrics = {"requests_per_sec": len(latencies) / elapsed}
+    metrics.update(latency_stats(latencies))
+    return metrics
+
+
+async def bench_handlers(total):
+    dispatcher = Dispatcher()
+    dispatcher.register_method(add)
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = HTTPServer(make_app(dispatcher))
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+
+    results = {}
+    try:
+        for concurrency in CONCURRENCY:
+            client = HTTPClient("http://127.0.0.1:%d/jsonrpc" % port, max_connections=concurrency)
+            results["http.c%d" % concurrency] = await load(client, total, concurrency)
+            await client.close()
+
+            client = WebSocketClient("ws://127.0.0.1:%d/ws" % port)
+            results["websocket.c%d" % concurrency] = await load(client, total, concurrency)
+            await client.close()
+    finally:
+        server.stop()
+        await server.close_all_connections()
+    return results
+
+
+async def bench_fan_out(number):
+    results = {}
+    for count in FAN_OUT:
+        dispatcher = Dispatcher()
+        dispatcher.register_event("ticks.#")
+        for _ in range(count):
+            await dispatcher.method_subscribe(Subscriber(), "ticks.*")
+
+        emits = max(10, number // count)
+        await dispatcher.emit_event("ticks.eur", {"bid": 1.1})  # warm up
+        start = time.perf_counter()
+        for _ in range(emits):
+            await dispatcher.emit_event("ticks.eur", {"bid": 1.1})
+        elapsed = time.perf_counter() - start
+        results["emit_event.fan_out%d" % count] = {
+            "us_per_op": elapsed / emits * 1e6,
+            "deliveries_per_sec": emits * count / elapsed,
+        }
+    return results
+
+
+def run(quick=False):
+    loop = new_event_loop()
+    try:
+        results = loop.run_until_complete(bench_handlers(200 if quick else 2000))
+        results.update(loop.run_until_complete(bench_fan_out(2000 if quick else 20000)))
+    finally:
+        loop.close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, metrics in sorted(run().items()):
+        print(name, " ".join("%s=%.2f" % item for item in sorted(metrics.items())))
@@ -0,0 +1,85 @@
+"""
+Timing helpers shared by the benchmarks.
+
+Every benchmark returns a dict of metrics. Metrics named `*_per_sec` are
+better when higher, every other metric (times, latencies) when lower;
+`compare` relies on that to flag regressions.
+"""
+
+import asyncio
+import time
+
+__all__ = ("time_sync", "time_async", "latency_stats", "new_event_loop", "higher_is_better", "compare")
+
+
+def time_sync(func, number, repeat=5):
+    """Best of `repeat` runs of `number` calls of func."""
+    func()  # warm up
+    best = min(_run_sync(func, number) for _ in range(repeat))
+    return {"us_per_op": best / number * 1e6, "ops_per_sec": number / best}
+
+
+def _run_sync(func, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return time.perf_counter() - start
+
+
+def time_async(loop, make_coroutine, number, repeat=5):
+    """Like time_sync, awaiting `make_coroutine()` in loop."""
+
+    async def run():
+        start = time.perf_counter()
+        for _ in range(number):
+            await make_coroutine()
+        return time.perf_counter() - start
+
+    loop.run_until_complete(make_coroutine())  # warm up
+    best = min(loop.run_until_complete(run()) for _ in range(repeat))
+    return {"us_per_op": best / number * 1e6, "ops_per_sec": number / best}
+
+
+def latency_stats(samples):
+    """Percentiles of the latencies, given in seconds, in milliseconds."""
+    samples = sorted(samples)
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))] * 1e3
+
+    return {"p50_ms": percentile(50),
+            "p90_ms": percentile(90),
+            "p99_ms": percentile(99),
+            "max_ms": samples[-1] * 1e3}
+
+
+def new_event_loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_sec")
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares two result sets, returns the rows of the report.
+
+    A row is (benchmark, metric, baseline, current, change, regressed) with
+    change the relative difference, positive when the result got better.
+    Only metrics present in both sets are compared.
+    """
+    rows = []
+    for name, metrics in sorted(current.items()):
+        for metric, value in sorted(metrics.items()):
+            base = baseline.get(name, {}).get(metric)
+            if not base or not isinstance(value, (int, float)):
+                continue
+
+            change = (value - base) / base
+            if not higher_is_better(metric):
+                change = -change
+            rows.append((name, metric, base, value, change, change < -threshold))
+    return rows
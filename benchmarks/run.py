@@ -0,0 +1,96 @@
+"""
+Runs the benchmark suite and compares it to a baseline.
+
+    python benchmarks/run.py --output baseline.json
+    python benchmarks/run.py --compare baseline.json --threshold 0.1
+
+Results are written as JSON: some information about the environment under
+"meta" and the metrics of every benchmark under "results". With
+`--compare` the metrics that got worse by more than the threshold are
+reported as regressions and the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import tornado
+
+import bench_core
+import bench_transports
+from harness import compare
+
+from json_rpc.codec import CODECS, get_codec
+
+SUITES = {"core": bench_core, "transports": bench_transports}
+
+
+def environment():
+    return {"python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "tornado": tornado.version,
+            "codecs": sorted(CODECS),
+            "default_codec": get_codec().name,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def run(suites, quick=False, only=None):
+    results = {}
+    for name in suites:
+        results.update(SUITES[name].run(quick=quick))
+
+    if only:
+        results = {name: metrics for name, metrics in results.items() if only in name}
+    return results
+
+
+def print_results(results):
+    for name, metrics in sorted(results.items()):
+        print("{:<36} {}".format(name, "  ".join(
+            "{}={:.2f}".format(metric, value) for metric, value in sorted(metrics.items()))))
+
+
+def print_comparison(rows, threshold):
+    regressions = 0
+    for name, metric, base, value, change, regressed in rows:
+        if regressed:
+            regressions += 1
+        print("{:<36} {:<18} {:>12.2f} {:>12.2f} {:>+8.1%}{}".format(
+            name, metric, base, value, change, "  REGRESSION" if regressed else ""))
+    print("\n{} regression(s) over {:.0%}".format(regressions, threshold))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--suite", action="append", choices=sorted(SUITES),
+                        help="suite to run, may be repeated (default: all)")
+    parser.add_argument("--only", help="keep the benchmarks whose name contains this")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a smoke test")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON file of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change reported as a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    results = run(args.suite or sorted(SUITES), quick=args.quick, only=args.only)
+    document = {"meta": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+
+    if not args.compare:
+        print_results(results)
+        return 0
+
+    with open(args.compare) as baseline:
+        baseline = json.load(baseline)
+    rows = compare(baseline["results"], results, args.threshold)
+    return 1 if print_comparison(rows, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
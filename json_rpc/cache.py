@@ -0,0 +1,136 @@
+"""
+Result cache for idempotent methods.
+"""
+
+import json
+import time
+from collections import OrderedDict
+
+from .jsonrpc import EncodedResult
+
+__all__ = ("CachePolicy", "ResultCache", "default_cache_key")
+
+
+def default_cache_key(method, params):
+    """The method name followed by the params encoded with sorted keys."""
+    return "%s:%s" % (method, json.dumps(params, sort_keys=True, separators=(",", ":")))
+
+
+class CachePolicy:
+    """
+    How the results of a method are cached.
+
+    `ttl` is the lifetime of an entry in seconds (None keeps it until it is
+    evicted). The least recently used entries are evicted once there are
+    more than `max_entries`, or once the encoded results take more than
+    `max_bytes`. `key` builds the cache key from the method name and the
+    params, prefix invalidation works on keys that are strings.
+    """
+
+    def __init__(self, ttl=None, max_entries=1024, max_bytes=None, key=default_cache_key):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.key = key
+
+    def __repr__(self):
+        return '{}(ttl={!r}, max_entries={!r}, max_bytes={!r})'.format(
+            self.__class__.__name__, self.ttl, self.max_entries, self.max_bytes)
+
+
+class ResultCache:
+    """
+    LRU cache of the results of one method.
+
+    Results are stored as EncodedResult, a hit hands the result already
+    encoded with the codec of the response to it. With `max_bytes` the
+    size of an entry is the one of the encoding of the first caller, a
+    result that this codec can not encode is not cached.
+    """
+
+    def __init__(self, method, policy: CachePolicy):
+        self.method = method
+        self.policy = policy
+        self.entries = OrderedDict()  # key -> (expires, EncodedResult, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def make_key(self, params):
+        """Returns the key of the call, None when the params can not be keyed."""
+        try:
+            return self.policy.key(self.method, params)
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, result, codec=None):
+        """Caches result, returns the EncodedResult to answer with or result when it is not cached."""
+        encoded_result = EncodedResult(result)
+        max_entries, max_bytes = self.policy.max_entries, self.policy.max_bytes
+        size = 0
+        if max_bytes is not None:
+            # The size is only known once encoded.
+            try:
+                size = len(encoded_result.encoded(codec))
+            except (TypeError, ValueError, OverflowError):
+                return result
+            if size > max_bytes:
+                return encoded_result
+        result = encoded_result
+
+        if key in self.entries:
+            self._remove(key)
+
+        expires = None if self.policy.ttl is None else time.monotonic() + self.policy.ttl
+        self.entries[key] = (expires, result, size)
+        self.size += size
+
+        while ((max_entries is not None and len(self.entries) > max_entries) or
+               (max_bytes is not None and self.size > max_bytes)):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+        return result
+
+    def invalidate(self, prefix=None):
+        """Drops every entry, or the ones with a key starting with prefix."""
+        if prefix is None:
+            self.entries.clear()
+            self.size = 0
+            return
+
+        for key in [key for key in self.entries if isinstance(key, str) and key.startswith(prefix)]:
+            self._remove(key)
+
+    def _remove(self, key):
+        expires, result, size = self.entries.pop(key)
+        self.size -= size
+
+    def stats(self):
+        return {"entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
+
+    def __repr__(self):
+        return '{}(method={!r}, policy={!r})'.format(self.__class__.__name__, self.method, self.policy)
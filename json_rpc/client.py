@@ -0,0 +1,467 @@
+"""
+Asyncio clients of JSON-RPC servers.
+
+`HTTPClient` posts the calls over a pool of keep-alive connections and
+`WebSocketClient` multiplexes them over one connection, also receiving
+the events subscribed with `rpc.on`. Both match the responses to the calls
+by id and can merge the calls made close together into batch requests.
+"""
+
+import asyncio
+import itertools
+import logging
+import ssl
+from collections import deque
+from urllib.parse import urlsplit
+
+from tornado import httputil
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+from tornado.httpclient import HTTPClientError
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.websocket import WebSocketClosedError, websocket_connect
+
+from .codec import get_codec
+from .events import TopicTrie
+from .exceptions import (JSONRPCError, ParseError, InvalidRequest, InvalidResponse, MethodNotFound,
+                         InvalidParams, InternalError, ServerError, RateLimitExceeded,
+                         DeadlineExceeded, RequestCancelled, ServerOverloaded)
+from .jsonrpc import JSONRPC1Request, JSONRPC2Request, encode, process_response
+
+__all__ = ("JSONRPCClient", "HTTPClient", "WebSocketClient", "error_to_exception")
+
+logger = logging.getLogger("jsonrpc")
+
+_ERRORS = {error.error_code: error for error in (ParseError, InvalidRequest, MethodNotFound,
+                                                  InvalidParams, InternalError, ServerError,
+                                                  RateLimitExceeded, DeadlineExceeded,
+                                                  RequestCancelled, ServerOverloaded)}
+
+
+def error_to_exception(error) -> JSONRPCError:
+    """Returns the exception raised for the JSONRPCStyleError of a response."""
+    error_class = _ERRORS.get(error.code)
+    if error_class is None:
+        is_server_error = isinstance(error.code, int) and -32099 <= error.code <= -32000
+        error_class = ServerError if is_server_error else JSONRPCError
+    exception = error_class(error.message)
+    # Codes without a class of their own are kept on the instance.
+    exception.error_code = error.code
+    return exception
+
+
+class JSONRPCClient:
+    """
+    Base of the clients, transports implement `send`.
+
+    Calls are sent on their own unless `batch_window` is set: with 0 the
+    calls made in the same iteration of the event loop are sent as one
+    batch request, with a number of seconds the ones made within that time
+    of the first. A batch is sent as soon as it has `max_batch` calls.
+
+    `call_timeout` is sent as the "timeout" member of every call, the server
+    gives up on calls running longer and answers DeadlineExceeded.
+    """
+
+    def __init__(self, version="2.0", codec=None, batch_window=None, max_batch=100, call_timeout=None):
+        if version == "2.0":
+            self.request_class = JSONRPC2Request
+        elif version == "1.0":
+            self.request_class = JSONRPC1Request
+        else:
+            raise ValueError("Unsupported JSONRPC version: %r" % version)
+
+        self.version = version
+        self.codec = get_codec(codec)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.call_timeout = call_timeout
+        self._ids = itertools.count(1)
+        self._batch = []  # (request, future)
+        self._flush_handle = None
+        self._sending = set()
+
+    def build_request(self, method, args, kwargs, is_notification=False):
+        if args and kwargs:
+            raise ValueError("Calls take either positional or keyword params, not both")
+        if kwargs and self.version == "1.0":
+            raise ValueError("JSONRPC 1.0 calls only take positional params")
+
+        params = kwargs or list(args)
+        if not params and self.version == "2.0":
+            params = None
+        id = None if is_notification else next(self._ids)
+        return self.request_class(method, params, id, self.version, is_notification, self.call_timeout)
+
+    async def call(self, method, *args, **kwargs):
+        """Calls method and returns its result, raises the error of the response."""
+        return await self._submit(self.build_request(method, args, kwargs))
+
+    async def notify(self, method, *args, **kwargs):
+        """Sends a notification, there is no result to wait for."""
+        await self._submit(self.build_request(method, args, kwargs, is_notification=True))
+
+    def _submit(self, request) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        if self.batch_window is None:
+            self._send_later([(request, future)])
+            return future
+
+        self._batch.append((request, future))
+        if len(self._batch) >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            if self.batch_window:
+                self._flush_handle = loop.call_later(self.batch_window, self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        """Sends the calls waiting for the batch window."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        calls, self._batch = self._batch, []
+        if calls:
+            self._send_later(calls)
+
+    def _send_later(self, calls):
+        sending = asyncio.ensure_future(self._send_calls(calls))
+        self._sending.add(sending)
+        sending.add_done_callback(self._sending.discard)
+
+    async def _send_calls(self, calls):
+        try:
+            await self.send(calls)
+        except Exception as error:
+            for request, future in calls:
+                if not future.done():
+                    future.set_exception(error)
+
+    def encode_calls(self, calls) -> bytes:
+        if len(calls) == 1:
+            return encode(calls[0][0], self.codec)
+        return encode([request for request, future in calls], self.codec)
+
+    def resolve(self, future, response):
+        if future.done():
+            return
+        if response.error is not None:
+            future.set_exception(error_to_exception(response.error))
+        else:
+            future.set_result(response.result)
+
+    async def send(self, calls):
+        """Sends the (request, future) pairs and resolves the futures of the calls."""
+        raise NotImplementedError("Client does not implement send.")
+
+    async def close(self):
+        self.flush()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class _ResponseReader(httputil.HTTPMessageDelegate):
+    def __init__(self):
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+
+    def headers_received(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+    def finish(self):
+        pass
+
+    def on_connection_close(self):
+        pass
+
+
+class HTTPClient(JSONRPCClient):
+    """
+    Client posting the calls to `url`.
+
+    At most `max_connections` requests are sent at once, each over a
+    keep-alive connection taken from the pool or opened when none is idle.
+    A connection the server closed while idle is replaced and the request
+    sent again. `timeout` limits every request, in seconds.
+    """
+
+    def __init__(self, url, max_connections=10, headers=None, timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Unsupported URL scheme: %r" % url)
+
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl_options = ssl.create_default_context() if parts.scheme == "https" else None
+        self.path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self.headers = httputil.HTTPHeaders({"Host": parts.netloc,
+                                             "Content-Type": self.codec.content_type,
+                                             "Accept": self.codec.content_type})
+        if headers:
+            self.headers.update(headers)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.tcp_client = TCPClient()
+        self.idle = deque()
+        self.connections = asyncio.Semaphore(max_connections)
+        self.opened = 0
+
+    async def send(self, calls):
+        data = await self.post(self.encode_calls(calls))
+
+        futures = {request.id: future for request, future in calls if not request.is_notification}
+        if data.strip():
+            try:
+                replies = self.codec.decode(data)
+            except self.codec.decode_errors as error:
+                raise ParseError(str(error))
+
+            for reply in (replies if isinstance(replies, list) else [replies]):
+                response = process_response(reply)
+                if isinstance(response, JSONRPCError):
+                    raise response
+                future = futures.pop(response.id, None)
+                if future is not None:
+                    self.resolve(future, response)
+                elif response.id is None and response.error is not None:
+                    # The server could not tell which call failed (parse error).
+                    for future in futures.values():
+                        self.resolve(future, response)
+                    futures.clear()
+
+        for request, future in calls:
+            if not future.done():
+                if request.is_notification:
+                    future.set_result(None)
+                else:
+                    future.set_exception(InvalidResponse("No response for the call %r" % request.id))
+
+    async def post(self, body) -> bytes:
+        """Posts body over a pooled connection and returns the body of the response."""
+        async with self.connections:
+            if self.timeout is None:
+                return await self._post(body)
+            return await asyncio.wait_for(self._post(body), self.timeout)
+
+    async def _post(self, body):
+        while True:
+            reused = bool(self.idle)
+            stream = self.idle.pop() if reused else await self._connect()
+            try:
+                return await self._request(stream, body)
+            except StreamClosedError:
+                stream.close()
+                if not reused:
+                    raise
+
+    async def _connect(self):
+        stream = await self.tcp_client.connect(self.host, self.port, ssl_options=self.ssl_options)
+        self.opened += 1
+        return stream
+
+    async def _request(self, stream, body):
+        keep_alive = False
+        try:
+            connection = HTTP1Connection(stream, True, HTTP1ConnectionParameters(decompress=False))
+            headers = httputil.HTTPHeaders(self.headers)
+            headers["Content-Length"] = str(len(body))
+            connection.write_headers(httputil.RequestStartLine("POST", self.path, "HTTP/1.1"), headers)
+            connection.write(body)
+            connection.finish()
+
+            reader = _ResponseReader()
+            if not await connection.read_response(reader):
+                raise StreamClosedError()
+            if reader.start_line is None:
+                raise StreamClosedError()
+
+            stream = connection.detach()
+            keep_alive = (not stream.closed() and
+                          reader.headers.get("Connection", "").lower() != "close")
+            if reader.start_line.code != 200:
+                raise HTTPClientError(reader.start_line.code, reader.start_line.reason)
+            return b"".join(reader.chunks)
+        finally:
+            if keep_alive:
+                self.idle.append(stream)
+            else:
+                stream.close()
+
+    async def close(self):
+        await super().close()
+        while self.idle:
+            self.idle.pop().close()
+
+    def __repr__(self):
+        return '{}(url={!r}, max_connections={!r})'.format(self.__class__.__name__, self.url,
+                                                          self.max_connections)
+
+
+class WebSocketClient(JSONRPCClient):
+    """
+    Client multiplexing the calls over one WebSocket connection.
+
+    The connection is opened by the first call and opened again after it
+    is lost, the calls waiting for a response fail with a
+    WebSocketClosedError. Events are received by `subscribe`: the callback
+    is called with the topic and the params of every notification matching
+    the pattern.
+
+    With a binary codec its subprotocol is requested and the messages are
+    sent in binary frames.
+    """
+
+    def __init__(self, url, connect_timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.connection = None
+        self.subscriptions = TopicTrie()
+        self._connecting = None
+        self._waiting = {}  # id -> future
+        self._reader = None
+
+    async def connect(self):
+        if self.connection is None:
+            if self._connecting is None:
+                self._connecting = asyncio.ensure_future(self._connect())
+            await asyncio.shield(self._connecting)
+        return self.connection
+
+    async def _connect(self):
+        try:
+            subprotocols = [self.codec.subprotocol] if self.codec.subprotocol is not None else None
+            connection = await websocket_connect(self.url, connect_timeout=self.connect_timeout,
+                                                 subprotocols=subprotocols)
+        finally:
+            self._connecting = None
+
+        self.connection = connection
+        self._reader = asyncio.ensure_future(self._read(connection))
+        if self.subscriptions.patterns:
+            # Subscriptions do not survive the connection.
+            asyncio.ensure_future(self._resubscribe(list(self.subscriptions.patterns)))
+
+    async def _resubscribe(self, patterns):
+        for pattern in patterns:
+            try:
+                await self.call("rpc.on", pattern)
+            except Exception as error:
+                logger.warning("Subscribing again to %r failed: %r", pattern, error)
+
+    async def send(self, calls):
+        connection = await self.connect()
+        for request, future in calls:
+            if not request.is_notification:
+                self._waiting[request.id] = future
+
+        try:
+            await connection.write_message(self.encode_calls(calls), binary=self.codec.binary)
+        except Exception:
+            for request, future in calls:
+                self._waiting.pop(request.id, None)
+            raise
+
+        for request, future in calls:
+            if request.is_notification:
+                future.set_result(None)
+
+    async def _read(self, connection):
+        while True:
+            message = await connection.read_message()
+            if message is None:
+                break
+
+            try:
+                replies = self.codec.decode(message)
+            except self.codec.decode_errors as error:
+                logger.warning("Invalid message from %s: %r", self.url, error)
+                continue
+
+            for reply in (replies if isinstance(replies, list) else [replies]):
+                self.on_reply(reply)
+
+        if self.connection is connection:
+            self.connection = None
+        waiting, self._waiting = self._waiting, {}
+        for future in waiting.values():
+            if not future.done():
+                future.set_exception(WebSocketClosedError())
+
+    def on_reply(self, reply):
+        if isinstance(reply, dict) and 'id' not in reply:
+            topic = reply.get('notification') or reply.get('method')
+            if isinstance(topic, str):
+                self.on_event(topic, reply.get('params'))
+                return
+
+        response = process_response(reply)
+        if isinstance(response, JSONRPCError):
+            logger.warning("Invalid message from %s: %r", self.url, response)
+            return
+
+        future = self._waiting.pop(response.id, None)
+        if future is not None:
+            self.resolve(future, response)
+        else:
+            logger.warning("Response without a call from %s: %r", self.url, response)
+
+    def on_event(self, topic, params):
+        for callback in list(self.subscriptions.match(topic)):
+            try:
+                callback(topic, params)
+            except Exception:
+                logger.exception("Event callback failed: %r", callback)
+
+    async def subscribe(self, pattern, callback):
+        """Calls callback(topic, params) for every event matching pattern."""
+        # Connecting first, the patterns found by _connect are the ones to subscribe again.
+        await self.connect()
+        subscribed = pattern in self.subscriptions.patterns
+        self.subscriptions.add(pattern, callback)
+        if not subscribed:
+            try:
+                await self.call("rpc.on", pattern)
+            except Exception:
+                self.subscriptions.remove(pattern, callback)
+                raise
+
+    async def unsubscribe(self, pattern, callback=None):
+        """Removes callback, or every callback, from pattern."""
+        callbacks = self.subscriptions.patterns.get(pattern)
+        if not callbacks:
+            return
+        for subscriber in [callback] if callback is not None else list(callbacks):
+            self.subscriptions.remove(pattern, subscriber)
+
+        if pattern not in self.subscriptions.patterns and self.connection is not None:
+            await self.call("rpc.off", pattern)
+
+    async def close(self):
+        await super().close()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self._reader is not None:
+            await self._reader
+            self._reader = None
+
+    def __repr__(self):
+        return '{}(url={!r})'.format(self.__class__.__name__, self.url)
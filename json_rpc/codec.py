@@ -0,0 +1,254 @@
+"""
+Codecs used to decode requests and encode responses.
+
+Every codec works on bytes: `decode` takes the raw body (bytes or str) and
+`encode` returns the encoded bytes ready to be written to the transport.
+The faster backends are optional dependencies and are only offered when
+they can be imported.
+
+Besides the JSON codecs (`CODECS`) there are binary ones (`BINARY_CODECS`),
+MessagePack and CBOR, negotiated by the clients through the content type
+or the WebSocket subprotocol. They carry the same documents, bytes values
+included without being encoded in base64.
+"""
+
+import json
+import struct
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+__all__ = ("Codec", "StdlibCodec", "OrjsonCodec", "UjsonCodec", "MsgpackCodec", "CborCodec",
+           "CODECS", "BINARY_CODECS", "get_codec", "negotiable_codecs")
+
+
+def _default(obj):
+    # Results of the methods may still provide their own representation.
+    try:
+        return obj.toJson()
+    except AttributeError:
+        raise TypeError("Object of type %s is not JSON serializable" % obj.__class__.__name__)
+
+
+class Codec:
+    name = None
+    content_type = "application/json"
+    # Encoded values are JSON text that can be spliced into a document as is.
+    # Other codecs override join and join_map (see EncodedResult).
+    raw_json = True
+    # Exceptions raised by decode when the given document is not valid.
+    decode_errors = (ValueError,)
+    # Encoded documents are binary, sent in binary WebSocket frames.
+    binary = False
+    # WebSocket subprotocol selecting the codec, JSON is spoken without one.
+    subprotocol = None
+
+    def encode(self, value) -> bytes:
+        raise NotImplementedError("Codec does not implement encode.")
+
+    def decode(self, data):
+        raise NotImplementedError("Codec does not implement decode.")
+
+    def join(self, encoded) -> bytes:
+        """Encodes an array of values already encoded."""
+        return b"[" + b",".join(encoded) + b"]"
+
+    def join_map(self, members) -> bytes:
+        """Encodes a map of (key, value) pairs already encoded."""
+        return b"{" + b",".join([key + b":" + value for key, value in members]) + b"}"
+
+    def __repr__(self):
+        return '{}()'.format(self.__class__.__name__)
+
+
+class StdlibCodec(Codec):
+    name = "json"
+    decode_errors = (ValueError, UnicodeDecodeError)
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(default=_default, separators=(",", ":"))
+
+    def encode(self, value) -> bytes:
+        return self._encoder.encode(value).encode("utf-8")
+
+    def decode(self, data):
+        # json.loads detects the encoding of bytes by itself.
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+
+    def encode(self, value) -> bytes:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+
+class UjsonCodec(Codec):
+    name = "ujson"
+
+    def __init__(self):
+        if ujson is None:
+            raise RuntimeError("ujson is not installed")
+
+    def encode(self, value) -> bytes:
+        return ujson.dumps(value, default=_default, ensure_ascii=False,
+                           escape_forward_slashes=False).encode("utf-8")
+
+    def decode(self, data):
+        return ujson.loads(data)
+
+
+def _cbor_default(encoder, obj):
+    encoder.encode(_default(obj))
+
+
+def _msgpack_header(size, fixed, header16, header32):
+    if size < 16:
+        return bytes((fixed | size,))
+    if size < 0x10000:
+        return header16 + struct.pack("!H", size)
+    return header32 + struct.pack("!I", size)
+
+
+def _cbor_header(size, major):
+    if size < 24:
+        return bytes((major | size,))
+    if size < 0x100:
+        return bytes((major | 24, size))
+    if size < 0x10000:
+        return bytes((major | 25,)) + struct.pack("!H", size)
+    return bytes((major | 26,)) + struct.pack("!I", size)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    content_type = "application/msgpack"
+    raw_json = False
+    binary = True
+    subprotocol = "jsonrpc.msgpack"
+    decode_errors = (ValueError, TypeError) + ((msgpack.UnpackException,) if msgpack is not None else ())
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+
+    def encode(self, value) -> bytes:
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    def decode(self, data):
+        # Like with CBOR, maps with other keys are refused by process_request.
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def join(self, encoded) -> bytes:
+        return _msgpack_header(len(encoded), 0x90, b"\xdc", b"\xdd") + b"".join(encoded)
+
+    def join_map(self, members) -> bytes:
+        return (_msgpack_header(len(members), 0x80, b"\xde", b"\xdf") +
+                b"".join([key + value for key, value in members]))
+
+
+class CborCodec(Codec):
+    name = "cbor"
+    content_type = "application/cbor"
+    raw_json = False
+    binary = True
+    subprotocol = "jsonrpc.cbor"
+    decode_errors = (ValueError, TypeError) + ((cbor2.CBORDecodeError,) if cbor2 is not None else ())
+
+    def __init__(self):
+        if cbor2 is None:
+            raise RuntimeError("cbor2 is not installed")
+
+    def encode(self, value) -> bytes:
+        return cbor2.dumps(value, default=_cbor_default)
+
+    def decode(self, data):
+        return cbor2.loads(data)
+
+    def join(self, encoded) -> bytes:
+        return _cbor_header(len(encoded), 0x80) + b"".join(encoded)
+
+    def join_map(self, members) -> bytes:
+        return _cbor_header(len(members), 0xa0) + b"".join([key + value for key, value in members])
+
+
+CODECS = {StdlibCodec.name: StdlibCodec}
+if ujson is not None:
+    CODECS[UjsonCodec.name] = UjsonCodec
+if orjson is not None:
+    CODECS[OrjsonCodec.name] = OrjsonCodec
+
+BINARY_CODECS = {}
+if msgpack is not None:
+    BINARY_CODECS[MsgpackCodec.name] = MsgpackCodec
+if cbor2 is not None:
+    BINARY_CODECS[CborCodec.name] = CborCodec
+
+# Preferred backends when no codec is requested explicitly.
+_AUTO_ORDER = ("orjson", "ujson", "json")
+_instances = {}
+
+
+def get_codec(codec=None) -> Codec:
+    """
+    Returns a codec instance.
+
+    `codec` may be a Codec instance, the name of a registered codec or None
+    to select the fastest JSON backend available.
+    """
+    if isinstance(codec, Codec):
+        return codec
+
+    if codec is None:
+        codec = next(name for name in _AUTO_ORDER if name in CODECS)
+    elif codec not in CODECS and codec not in BINARY_CODECS:
+        raise ValueError("Unknown codec: %r" % codec)
+
+    try:
+        return _instances[codec]
+    except KeyError:
+        codec_class = CODECS[codec] if codec in CODECS else BINARY_CODECS[codec]
+        instance = _instances[codec] = codec_class()
+        return instance
+
+
+_negotiable = {}
+
+
+def negotiable_codecs(names=None) -> dict:
+    """
+    Returns the binary codecs clients may ask for, by content type.
+
+    `names` lists the codecs offered, None offers every binary codec installed.
+    """
+    key = None if names is None else tuple(names)
+    try:
+        return _negotiable[key]
+    except KeyError:
+        codecs = [get_codec(name) for name in (BINARY_CODECS if names is None else names)]
+        offered = _negotiable[key] = {codec.content_type: codec for codec in codecs}
+        return offered
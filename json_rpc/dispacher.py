@@ -1,68 +1,448 @@
-from .jsonrpc import JSONRPCRequest, JSONRPCResponse, JSONRPCEvent
-from .exceptions import JSONRPCError, MethodNotFound, InvalidEvent
-from funcsigs import signature
+from .jsonrpc import JSONRPCRequest, JSONRPCResponse, JSONRPCEvent, encode
+from .exceptions import (JSONRPCError, MethodNotFound, InvalidEvent, InvalidParams, DeadlineExceeded,
+                         ServerOverloaded)
+from .executors import INLINE, ThreadExecutor
+from .events import DeliveryPolicy, TopicTrie, split_topic
+from .cache import ResultCache, default_cache_key
+from .codec import get_codec
+from collections import deque
+from inspect import Parameter, signature
+import asyncio
 import inspect
 
 
+class Bulkhead:
+    """
+    Caps the calls of one method: `max_concurrency` run at once and at most
+    `max_queue` wait for them (None for no limit), more are refused with
+    ServerOverloaded right away.
+    """
+    __slots__ = ('max_concurrency', 'max_queue', 'running', 'waiters', 'rejected')
+
+    def __init__(self, max_concurrency, max_queue=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiters = deque()
+        self.rejected = 0
+
+    async def acquire(self, name):
+        if self.running < self.max_concurrency and not self.waiters:
+            self.running += 1
+            return
+
+        if self.max_queue is not None and len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise ServerOverloaded("method '%s' has too many calls waiting" % name)
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                # release may already have dropped it.
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            else:
+                # Cancelled after being handed the slot.
+                self.release()
+            raise
+
+    def release(self):
+        # The slot goes to the next waiter, running does not change.
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self):
+        return {"running": self.running, "queued": len(self.waiters), "rejected": self.rejected}
+
+
+class CallPlan:
+    """
+    Everything needed to call a registered method, computed once at registration.
+
+    The parameter layout of the method is reduced to a few counters and name
+    sets so checking the params of a call does not need to bind a signature.
+    """
+
+    def __init__(self, method, name=None, executor=None, cache=None, coalesce=False, timeout=None,
+                 bulkhead=None):
+        self.method = method
+        self.name = name or getattr(method, "__name__", repr(method))
+        self.is_async = inspect.iscoroutinefunction(method) or inspect.isawaitable(method)
+        # Executor running a synchronous method, None runs it inline.
+        self.executor = None if self.is_async else executor
+        self.cache = None if cache is None else ResultCache(self.name, cache)
+        # Identical calls running at the same time share one execution.
+        self.coalesce = coalesce
+        self.in_flight = {}
+        self.coalesced = 0
+        # Seconds a call may run, inline synchronous methods can not be stopped.
+        self.timeout = timeout
+        self.bulkhead = bulkhead
+
+        try:
+            parameters = signature(method).parameters.values()
+        except (TypeError, ValueError):
+            # Signature not available (some builtins), let the call decide.
+            self.checked = False
+            return
+
+        self.checked = True
+        self.min_positional = 0
+        self.max_positional = 0
+        self.var_positional = False
+        self.var_keyword = False
+        self.keywords = set()
+        self.required_keywords = set()
+        self.required_keyword_only = set()
+        for param in parameters:
+            required = param.default is Parameter.empty
+            if param.kind is Parameter.VAR_POSITIONAL:
+                self.var_positional = True
+            elif param.kind is Parameter.VAR_KEYWORD:
+                self.var_keyword = True
+            elif param.kind is Parameter.KEYWORD_ONLY:
+                self.keywords.add(param.name)
+                if required:
+                    self.required_keywords.add(param.name)
+                    self.required_keyword_only.add(param.name)
+            else:
+                self.max_positional += 1
+                if required:
+                    self.min_positional += 1
+                if param.kind is Parameter.POSITIONAL_OR_KEYWORD:
+                    self.keywords.add(param.name)
+                    if required:
+                        self.required_keywords.add(param.name)
+                elif required:
+                    # A required positional only parameter can not be given by name.
+                    self.required_keywords.add(param.name)
+
+        if self.var_positional:
+            self.max_positional = None
+
+    def make_key(self, params):
+        """Key identifying the call for caching and coalescing, None if it has none."""
+        if self.cache is not None:
+            return self.cache.make_key(params)
+
+        try:
+            return default_cache_key(self.name, params)
+        except (TypeError, ValueError):
+            return None
+
+    def check_positional(self, count):
+        if not self.checked:
+            return
+
+        if self.required_keyword_only:
+            raise InvalidParams("method '%s' missing keyword params: %s" % (
+                self.name, ", ".join(sorted(self.required_keyword_only))))
+
+        if count < self.min_positional:
+            raise InvalidParams("method '%s' takes at least %d params but %d were given" % (
+                self.name, self.min_positional, count))
+
+        if self.max_positional is not None and count > self.max_positional:
+            raise InvalidParams("method '%s' takes at most %d params but %d were given" % (
+                self.name, self.max_positional, count))
+
+    def check_keywords(self, names):
+        if not self.checked:
+            return
+
+        if not self.var_keyword:
+            unexpected = names - self.keywords
+            if unexpected:
+                raise InvalidParams("method '%s' got unexpected params: %s" % (
+                    self.name, ", ".join(sorted(unexpected))))
+
+        missing = self.required_keywords.difference(names)
+        if missing:
+            raise InvalidParams("method '%s' missing params: %s" % (
+                self.name, ", ".join(sorted(missing))))
+
+    def __call__(self, params):
+        """Checks the params and calls the method, the result may be awaitable."""
+        if params is None:
+            self.check_positional(0)
+            return self.method()
+        if isinstance(params, list):
+            self.check_positional(len(params))
+            return self.method(*params)
+        if isinstance(params, dict):
+            self.check_keywords(params.keys())
+            return self.method(**params)
+
+        raise InvalidParams("params must be a list or an object")
+
+
 class Dispatcher:
-    def __init__(self, has_hevents=True):
+    """
+    Registry of the methods and events offered to the clients.
+
+    Events are dot separated topics. `register_event` accepts patterns where
+    "*" stands for one segment and a trailing "#" for any number of them,
+    clients may subscribe to any pattern covered by the registered ones.
+
+    Synchronous methods run inline on the event loop unless they are
+    registered with an executor: "threads" is a pool of `thread_pool_size`
+    threads, more pools can be added with `add_executor`. `executor` sets
+    the default for methods registered without one.
+
+    With a json_rpc.metrics.Metrics the events emitted and the subscribers
+    of every pattern are reported. With a `bus`, a backend of
+    json_rpc.eventbus such as json_rpc.prefork.EventBus, the events are also
+    sent to other processes or nodes, and theirs are delivered to the
+    subscribers of this one.
+    """
+
+    def __init__(self, has_hevents=True, executor=INLINE, thread_pool_size=None, metrics=None, bus=None):
         self.has_hevents = has_hevents
-        self.EVENTS = {}
+        # Registered event patterns and subscriptions of the transports.
+        self.REGISTERED_EVENTS = TopicTrie()
+        self.SUBSCRIPTIONS = TopicTrie()
+        self.EVENTS = self.SUBSCRIPTIONS.patterns
+        self.EVENT_POLICIES = {}
         self.RESOURCES_RPC = {}
+        self.CALL_PLANS = {}
+        self.EXECUTORS = {}
+        self.default_executor = executor
+        self.thread_pool_size = thread_pool_size
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.track_subscriptions(self.SUBSCRIPTIONS)
+            metrics.track_methods(self.RESOURCES_RPC)
+        self.bus = bus
+        if bus is not None:
+            bus.attach(self)
 
     async def emit_event(self, event_name, *params):
-        if not event_name or not (event_name in self.EVENTS.keys()):
-            raise InvalidEvent
+        if not self.is_event(event_name):
+            raise InvalidEvent("Event '%s' not found!" % event_name)
+
+        subscribers = self.SUBSCRIPTIONS.match(event_name)
+        if not subscribers and self.bus is None:
+            return
 
         notification = JSONRPCEvent(notification=event_name, params=params)
+        # The notification is encoded once for every codec used by the subscribers.
+        encoded = {}
+        if self.bus is not None:
+            data = encoded[self.bus.codec] = encode(notification, self.bus.codec)
+            self.bus.publish(event_name, data, self)
+        if subscribers:
+            self.deliver(event_name, subscribers, notification, encoded)
 
-        print("*** emit:", notification)
-        for transport in [*self.EVENTS[event_name]]:
-            if callable(getattr(transport, "emit_message", None)):
-                transport.emit_message(notification)
+    def deliver_event(self, event_name, data):
+        """Hands an event encoded by another worker to the local subscribers."""
+        subscribers = self.SUBSCRIPTIONS.match(event_name)
+        if subscribers:
+            self.deliver(event_name, subscribers, relayed=data)
 
-    def register_event(self, event_name):
-        if isinstance(event_name, list):
-            for ev in event_name:
-                if ev not in self.EVENTS.keys():
-                    self.EVENTS[ev] = set()
+    def deliver(self, event_name, subscribers, notification=None, encoded=None, relayed=None):
+        policy = self.get_event_policy(event_name) if self.EVENT_POLICIES else None
+        if relayed is not None:
+            # Transports using another encoding than the bus get the event decoded and encoded again.
+            relayed_type = self.bus.codec.content_type
+            encoded = {}
+        for transport in [*subscribers]:
+            emit_message = getattr(transport, "emit_message", None)
+            if not callable(emit_message):
+                continue
 
-        elif event_name not in self.EVENTS.keys():
-            self.EVENTS[event_name] = set()
+            codec = getattr(transport, "codec", None)
+            if relayed is not None and get_codec(codec).content_type == relayed_type:
+                data = relayed
+            else:
+                data = encoded.get(codec)
+                if data is None:
+                    if notification is None:
+                        notification = self.bus.codec.decode(relayed)
+                    data = encoded[codec] = encode(notification, codec)
+
+            if policy is not None:
+                emit_later = getattr(transport, "emit_message_later", None)
+                if emit_later is not None:
+                    emit_later(data, event_name, policy)
+                    continue
+            emit_message(data)
+
+        if self.metrics is not None:
+            self.metrics.event_emitted(len(subscribers))
+
+    def register_event(self, event_name, policy: DeliveryPolicy = None):
+        """
+        Registers event names or patterns.
+
+        `policy` is a DeliveryPolicy to conflate or batch the notifications
+        of these events, transports without `emit_message_later` get every
+        notification right away.
+        """
+        event_names = event_name if isinstance(event_name, list) else [event_name]
+        for name in event_names:
+            self.REGISTERED_EVENTS.add(name, name)
+            if policy is not None:
+                self.EVENT_POLICIES[name] = policy
+
+    def get_event_policy(self, event_name):
+        """The policy of the most specific registered pattern matching event_name."""
+        policies = [(len(name), self.EVENT_POLICIES[name])
+                    for name in self.REGISTERED_EVENTS.match(event_name) if name in self.EVENT_POLICIES]
+        return max(policies, key=lambda item: item[0])[1] if policies else None
+
+    def is_event(self, event_name):
+        """True if event_name is a concrete topic matching a registered event."""
+        try:
+            split_topic(event_name, pattern=False)
+        except ValueError:
+            return False
+        return bool(self.REGISTERED_EVENTS.match(event_name))
 
     async def method_subscribe(self, transport, event_name):
-        if not event_name or not (event_name in self.EVENTS.keys()):
+        try:
+            covered = self.REGISTERED_EVENTS.covers(event_name)
+        except ValueError:
+            covered = False
+        if not covered:
             raise InvalidEvent("Event '%s' not found!" % event_name)
 
-        self.EVENTS[event_name].add(transport)
+        if self.SUBSCRIPTIONS.add(event_name, transport) and self.bus is not None:
+            self.bus.subscribe(event_name)
         return {event_name: "ok"}
 
     async def method_unsubscribe(self, transport, event_name):
-        if not event_name or not (event_name in self.EVENTS.keys()):
+        try:
+            split_topic(event_name)
+        except ValueError:
+            raise InvalidParams("rpc.off takes the topic of a subscription")
+        if not self.SUBSCRIPTIONS.remove(event_name, transport):
             raise InvalidEvent("Event '%s' not found or not subscribed!" % event_name)
 
-        self.EVENTS[event_name].remove(transport)
+        if self.bus is not None:
+            self.bus.unsubscribe(event_name)
         return {event_name: "ok"}
 
+    def method_cancel(self, transport, params):
+        """Cancels a running call of the transport, True if it was still running."""
+        cancel_call = getattr(transport, "cancel_call", None)
+        if cancel_call is None:
+            raise MethodNotFound("method: 'rpc.cancel' not available on this transport")
+        if isinstance(params, list) and len(params) == 1:
+            return cancel_call(params[0])
+        if isinstance(params, dict) and params.keys() == {"id"}:
+            return cancel_call(params["id"])
+        raise InvalidParams("rpc.cancel takes the id of the call")
+
     def unsubscribe_all(self, transport):
-        for transports in self.EVENTS.values():
-            if transport in transports:
-                transports.remove(transport)
+        if self.bus is None:
+            self.SUBSCRIPTIONS.remove_subscriber(transport)
+            return
+
+        for pattern in list(self.SUBSCRIPTIONS.by_subscriber.get(transport, ())):
+            self.SUBSCRIPTIONS.remove(pattern, transport)
+            self.bus.unsubscribe(pattern)
+
+    def add_executor(self, name, max_workers=None):
+        if name == INLINE or name in self.EXECUTORS:
+            raise ValueError("Executor '%s' already exists" % name)
+
+        executor = self.EXECUTORS[name] = ThreadExecutor(name, max_workers)
+        return executor
+
+    def get_executor(self, name):
+        if name is None:
+            name = self.default_executor
+        if name == INLINE:
+            return None
+        if isinstance(name, ThreadExecutor):
+            return name
+
+        executor = self.EXECUTORS.get(name)
+        if executor is None:
+            if name != "threads":
+                raise ValueError("Executor '%s' not found" % name)
+            # The default pool is only started when a method uses it.
+            executor = self.add_executor(name, self.thread_pool_size)
+        return executor
+
+    def executor_stats(self):
+        return {name: executor.stats() for name, executor in self.EXECUTORS.items()}
+
+    def shutdown_executors(self, wait=True):
+        for executor in self.EXECUTORS.values():
+            executor.shutdown(wait=wait)
 
-    def register_method(self, resource, name=None):
+    def register_method(self, resource, name=None, executor=None, cache=None, coalesce=False,
+                        timeout=None, max_concurrency=None, max_queue=None):
+        """
+        Registers a callable, or the public methods of an object.
+
+        `executor` is the name of the executor running the synchronous
+        methods: "inline", "threads" or a name given to `add_executor`.
+        `cache` is a CachePolicy for methods whose result only depends on
+        the params, every method gets its own cache. With `coalesce` calls
+        made with the same params while one is running wait for its result
+        instead of running again. Calls running longer than `timeout`
+        seconds are cancelled and answered with DeadlineExceeded, a method
+        running in a thread is abandoned but finishes in the background.
+
+        With `max_concurrency` at most that many calls of a method run at
+        once, the next ones wait in a queue of at most `max_queue` calls and
+        the calls beyond are answered with ServerOverloaded. Every method of
+        a resource gets its own limits.
+        """
+        executor = self.get_executor(executor)
         if callable(resource):
             name = name or resource.__name__
-            self.RESOURCES_RPC[name] = resource
+            methods = {name: resource}
         else:
             name = name or resource.__class__.__name__
             mts = inspect.getmembers(resource, predicate=inspect.ismethod)
             methods = dict([("%s.%s" % (name, m[0]), m[1]) for m in mts if not m[0].startswith("_")])
-            self.RESOURCES_RPC.update(methods)
+
+        self.RESOURCES_RPC.update(methods)
+        for method_name, method in methods.items():
+            bulkhead = None if max_concurrency is None else Bulkhead(max_concurrency, max_queue)
+            self.CALL_PLANS[method_name] = CallPlan(method, method_name, executor, cache, coalesce, timeout,
+                                                    bulkhead)
 
     def get_method(self, method_name):
-        if method_name in self.RESOURCES_RPC:
-            return self.RESOURCES_RPC[method_name]
-        raise MethodNotFound("method: '%s' not found" % (method_name))
+        method = self.RESOURCES_RPC.get(method_name)
+        if method is None:
+            raise MethodNotFound("method: '%s' not found" % (method_name))
+        return method
+
+    def get_call_plan(self, method_name):
+        plan = self.CALL_PLANS.get(method_name)
+        if plan is None:
+            raise MethodNotFound("method: '%s' not found" % (method_name))
+        return plan
+
+    def invalidate_cache(self, method=None, prefix=None):
+        """Drops cached results of a method, with a key starting with prefix, or all."""
+        plans = self.CALL_PLANS.values() if method is None else [self.get_call_plan(method)]
+        for plan in plans:
+            if plan.cache is not None:
+                plan.cache.invalidate(prefix)
+
+    def cache_stats(self):
+        return {name: plan.cache.stats() for name, plan in self.CALL_PLANS.items() if plan.cache is not None}
+
+    def bulkhead_stats(self):
+        """Running, queued and refused calls of the methods with a concurrency limit."""
+        return {name: plan.bulkhead.stats() for name, plan in self.CALL_PLANS.items()
+                if plan.bulkhead is not None}
+
+    def coalesce_stats(self):
+        """Number of calls that waited for an identical running call, per method."""
+        return {name: plan.coalesced for name, plan in self.CALL_PLANS.items() if plan.coalesce}
 
     async def dispatch(self, transport, request: JSONRPCRequest):
 
@@ -70,31 +450,71 @@ class Dispatcher:
             return await self.method_subscribe(transport, request.params[0])
         elif self.has_hevents and request.method == 'rpc.off':
             return await self.method_unsubscribe(transport, request.params[0])
+        elif request.method == 'rpc.cancel':
+            return self.method_cancel(transport, getattr(request, 'params', None))
 
-        method = self.get_method(request.method)
+        plan = self.get_call_plan(request.method)
 
         try:
             params = request.params
         except AttributeError:
             params = None
 
-        if inspect.isawaitable(method) or inspect.iscoroutinefunction(method):
-            # print("is awaitable", method)
-            if params is None:
-                return await method()
-            if isinstance(params, list):
-                signature(method).bind(*params)
-                return await method(*params)
-            elif isinstance(params, dict):
-                signature(method).bind(**params)
-                return await method(**params)
+        if plan.cache is None and not plan.coalesce:
+            return await self.call(plan, params)
+
+        key = plan.make_key(params)
+        if key is None:
+            return await self.call(plan, params)
+
+        if plan.cache is not None:
+            result = plan.cache.get(key)
+            if result is not None:
+                return result
+
+        # The size of cached results is measured in the encoding of the transport.
+        codec = getattr(transport, "codec", None)
+        if plan.coalesce:
+            return await self.call_once(plan, params, key, codec)
+        return await self.call_cached(plan, params, key, codec)
+
+    async def call_once(self, plan: CallPlan, params, key, codec=None):
+        future = plan.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.call_cached(plan, params, key, codec))
+            plan.in_flight[key] = future
+            future.add_done_callback(lambda _: plan.in_flight.pop(key, None))
         else:
-            # print("not awaitable", method)
-            if params is None:
-                return method()
-            if isinstance(params, list):
-                signature(method).bind(*params)
-                return method(*params)
-            elif isinstance(params, dict):
-                signature(method).bind(**params)
-                return method(**params)
+            plan.coalesced += 1
+
+        # A waiter giving up does not cancel the call the others wait for.
+        return await asyncio.shield(future)
+
+    async def call_cached(self, plan: CallPlan, params, key, codec=None):
+        result = await self.call(plan, params)
+        if plan.cache is not None:
+            result = plan.cache.put(key, result, codec)
+        return result
+
+    async def call(self, plan: CallPlan, params):
+        bulkhead = plan.bulkhead
+        if bulkhead is not None:
+            await bulkhead.acquire(plan.name)
+        try:
+            if plan.is_async:
+                result = plan(params)
+            elif plan.executor is not None:
+                result = plan.executor.run(plan, params)
+            else:
+                return plan(params)
+
+            if plan.timeout is None:
+                return await result
+            try:
+                return await asyncio.wait_for(result, plan.timeout)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("method '%s' did not complete within %gs" % (
+                    plan.name, plan.timeout)) from None
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
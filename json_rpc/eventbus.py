@@ -0,0 +1,82 @@
+"""
+Backends carrying the events of Dispatchers beyond their own subscribers.
+
+A Dispatcher given a backend (`Dispatcher(bus=...)`) tells it about every
+subscription of its transports and hands it every event it emits, already
+encoded. Events coming from elsewhere are handed back to `deliver_event` of
+the attached dispatchers, which pass the bytes on to their subscribers.
+
+Backends count the local subscriptions of every pattern: `listen` is called
+when a pattern gets its first one and `unlisten` when the last one ends,
+so a backend talking to a broker only asks for the events somebody wants.
+"""
+
+from .codec import get_codec
+
+__all__ = ("EventBackend", "MemoryBackend")
+
+
+class EventBackend:
+    """
+    Base of the backends, they implement `send` and optionally `listen`
+    and `unlisten`. Events are encoded with `codec` to be sent.
+    """
+
+    def __init__(self, codec=None):
+        self.codec = get_codec(codec)
+        self.dispatchers = []
+        self.interest = {}  # pattern -> local subscriptions
+
+    def attach(self, dispatcher):
+        self.dispatchers.append(dispatcher)
+
+    def subscribe(self, pattern):
+        count = self.interest.get(pattern, 0)
+        self.interest[pattern] = count + 1
+        if not count:
+            self.listen(pattern)
+
+    def unsubscribe(self, pattern):
+        count = self.interest.get(pattern, 0)
+        if count > 1:
+            self.interest[pattern] = count - 1
+        elif count:
+            del self.interest[pattern]
+            self.unlisten(pattern)
+
+    def listen(self, pattern):
+        """Starts receiving the events of pattern from elsewhere."""
+
+    def unlisten(self, pattern):
+        """Stops receiving the events of pattern."""
+
+    def publish(self, topic, data, origin=None):
+        """Hands an event emitted by the origin dispatcher to everybody else."""
+        if len(self.dispatchers) > 1:
+            self.deliver(topic, data, origin)
+        self.send(topic, data)
+
+    def send(self, topic, data):
+        raise NotImplementedError("Backend does not implement send.")
+
+    def deliver(self, topic, data, origin=None):
+        """Hands an encoded event to the attached dispatchers."""
+        for dispatcher in self.dispatchers:
+            if dispatcher is not origin:
+                dispatcher.deliver_event(topic, data)
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return '{}(patterns={!r})'.format(self.__class__.__name__, len(self.interest))
+
+
+class MemoryBackend(EventBackend):
+    """
+    Events stay in the process, shared by the dispatchers attached to the
+    same backend. A Dispatcher without a backend keeps its events to itself.
+    """
+
+    def send(self, topic, data):
+        pass
@@ -0,0 +1,325 @@
+"""
+Delivery of events to the subscribers.
+"""
+
+import asyncio
+import itertools
+import logging
+from collections import deque
+
+__all__ = ("DROP_OLDEST", "DROP_NEWEST", "DISCONNECT", "SLOW_CONSUMER_POLICIES",
+           "DeliveryPolicy", "SendQueue",
+           "WILDCARD_ONE", "WILDCARD_ANY", "split_topic", "TopicTrie")
+
+logger = logging.getLogger("jsonrpc")
+
+# What a full SendQueue does with a new message.
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+
+class DeliveryPolicy:
+    """
+    How the events of a topic are delivered to each subscriber.
+
+    Instead of being sent right away the notifications are held for
+    `interval` seconds. With `conflate` only the latest notification of
+    every topic is kept. With `batch` the held notifications are sent as
+    JSON arrays of at most `max_batch` notifications, one frame each.
+    """
+
+    def __init__(self, conflate=False, batch=False, interval=0.1, max_batch=100):
+        self.conflate = conflate
+        self.batch = batch
+        self.interval = interval
+        self.max_batch = max_batch
+
+    def __repr__(self):
+        return '{}(conflate={!r}, batch={!r}, interval={!r})'.format(
+            self.__class__.__name__, self.conflate, self.batch, self.interval)
+
+
+def _join_json(messages):
+    return b"[" + b",".join(messages) + b"]"
+
+
+class SendQueue:
+    """
+    Bounded queue of encoded messages waiting to be sent to one subscriber.
+
+    `send` is a coroutine function writing one message, the queue waits for
+    it before sending the next one so a slow client only fills its own
+    queue. When `max_size` messages are waiting the `policy` decides: drop
+    the oldest message, drop the new one or call `disconnect`.
+
+    Messages of topics with a DeliveryPolicy are held by `put_later`, the
+    ones held with the same interval are queued together once the interval
+    of the first of them is over. Batches
+    are joined into one array by `join`, a JSON one by default (see
+    Codec.join).
+    """
+
+    def __init__(self, send, max_size=1000, policy=DROP_OLDEST, disconnect=None, join=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError("Unknown slow consumer policy: %r" % policy)
+
+        self.send = send
+        self.max_size = max_size
+        self.policy = policy
+        self.disconnect = disconnect
+        self.join = join if join is not None else _join_json
+        self.queue = deque()
+        self.dropped = 0
+        self.closed = False
+        self.conflated = 0
+        self._sending = None
+        # interval -> {topic (conflated) or sequence number -> (data, policy)}
+        self._held = {}
+        self._sequence = itertools.count()
+        self._flush_handles = {}  # interval -> timer
+
+    def put(self, data) -> bool:
+        """Queues a message, returns False if it was not queued."""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_size:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            elif self.policy == DROP_OLDEST:
+                self.queue.popleft()
+                self.dropped += 1
+            else:
+                logger.warning("slow consumer disconnected: %r", self.send)
+                self.close()
+                if self.disconnect is not None:
+                    self.disconnect()
+                return False
+
+        self.queue.append(data)
+        if self._sending is None:
+            self._sending = asyncio.ensure_future(self._drain())
+        return True
+
+    async def _drain(self):
+        try:
+            while self.queue:
+                await self.send(self.queue.popleft())
+        except Exception as error:
+            logger.debug("send failed, closing the queue: %r", error)
+            self.close()
+        finally:
+            self._sending = None
+
+    def put_later(self, data, topic, policy: DeliveryPolicy):
+        """Holds a message of topic until the next flush."""
+        if self.closed:
+            return
+
+        interval = policy.interval
+        held = self._held.get(interval)
+        if held is None:
+            held = self._held[interval] = {}
+            self._flush_handles[interval] = asyncio.get_event_loop().call_later(
+                interval, self.flush, interval)
+
+        if policy.conflate:
+            if held.pop(topic, None) is not None:
+                self.conflated += 1
+            held[topic] = (data, policy)
+        else:
+            held[next(self._sequence)] = (data, policy)
+
+    def flush(self, interval=None):
+        """Queues the messages held with interval, all of them for None."""
+        for due in ([*self._held] if interval is None else [interval]):
+            handle = self._flush_handles.pop(due, None)
+            if handle is not None:
+                handle.cancel()
+            self._flush_held(self._held.pop(due, {}))
+
+    def _flush_held(self, held):
+        batches = {}
+        for data, policy in held.values():
+            if policy.batch:
+                batches.setdefault(policy.max_batch, []).append(data)
+            else:
+                self.put(data)
+
+        for max_batch, messages in batches.items():
+            for start in range(0, len(messages), max_batch):
+                self.put(self.join(messages[start:start + max_batch]))
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self._held.clear()
+        for handle in self._flush_handles.values():
+            handle.cancel()
+        self._flush_handles.clear()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __repr__(self):
+        return '{}(max_size={!r}, policy={!r}, queued={!r})'.format(
+            self.__class__.__name__, self.max_size, self.policy, len(self.queue))
+
+
+# Topic segments are separated by dots. In a pattern "*" stands for exactly
+# one segment and "#", only allowed as the last segment, for any number.
+WILDCARD_ONE = "*"
+WILDCARD_ANY = "#"
+
+
+def split_topic(topic, pattern=True):
+    """Returns the segments of a topic, ValueError if it is not valid."""
+    if not isinstance(topic, str) or not topic:
+        raise ValueError("Topic must be a non empty string")
+
+    segments = topic.split(".")
+    for index, segment in enumerate(segments):
+        if not segment:
+            raise ValueError("Empty segment in topic %r" % topic)
+        if segment == WILDCARD_ONE or segment == WILDCARD_ANY:
+            if not pattern:
+                raise ValueError("Wildcards are not allowed in topic %r" % topic)
+            if segment == WILDCARD_ANY and index != len(segments) - 1:
+                raise ValueError("'#' must be the last segment of %r" % topic)
+        elif WILDCARD_ONE in segment or WILDCARD_ANY in segment:
+            raise ValueError("Wildcards must be whole segments in %r" % topic)
+    return segments
+
+
+class _TopicNode:
+    __slots__ = ('children', 'subscribers')
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = set()
+
+
+class TopicTrie:
+    """
+    Subscriptions indexed by the segments of their patterns.
+
+    Finding the subscribers of a topic walks one level per segment, following
+    the literal segment and the wildcards, so the cost depends on the depth
+    of the topic and not on the number of subscriptions. `patterns` maps
+    every pattern with subscribers to their set.
+    """
+
+    def __init__(self):
+        self.root = _TopicNode()
+        self.patterns = {}
+        self.by_subscriber = {}
+
+    def add(self, pattern, subscriber) -> bool:
+        """Subscribes to pattern, returns False if it already was."""
+        node = self.root
+        for segment in split_topic(pattern):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _TopicNode()
+            node = child
+
+        if subscriber in node.subscribers:
+            return False
+
+        node.subscribers.add(subscriber)
+        self.patterns[pattern] = node.subscribers
+        self.by_subscriber.setdefault(subscriber, set()).add(pattern)
+        return True
+
+    def remove(self, pattern, subscriber) -> bool:
+        """Unsubscribes from pattern, returns False if it was not subscribed."""
+        subscribers = self.patterns.get(pattern)
+        if subscribers is None or subscriber not in subscribers:
+            return False
+
+        subscribers.remove(subscriber)
+        patterns = self.by_subscriber[subscriber]
+        patterns.discard(pattern)
+        if not patterns:
+            del self.by_subscriber[subscriber]
+        if not subscribers:
+            del self.patterns[pattern]
+            self._prune(split_topic(pattern))
+        return True
+
+    def remove_subscriber(self, subscriber):
+        for pattern in list(self.by_subscriber.get(subscriber, ())):
+            self.remove(pattern, subscriber)
+
+    def _prune(self, segments):
+        # Drops the nodes left without subscribers nor children.
+        path = [self.root]
+        for segment in segments:
+            path.append(path[-1].children[segment])
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.subscribers or node.children:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+    def match(self, topic) -> set:
+        """
+        Returns the subscribers of every pattern matching the concrete topic.
+
+        The returned set may be the one stored in the trie, it must not be modified.
+        """
+        found = []
+        nodes = [self.root]
+        for segment in topic.split("."):
+            next_nodes = []
+            for node in nodes:
+                children = node.children
+                child = children.get(WILDCARD_ANY)
+                if child is not None:
+                    found.append(child.subscribers)
+                child = children.get(segment)
+                if child is not None:
+                    next_nodes.append(child)
+                child = children.get(WILDCARD_ONE)
+                if child is not None:
+                    next_nodes.append(child)
+            if not next_nodes:
+                break
+            nodes = next_nodes
+        else:
+            for node in nodes:
+                found.append(node.subscribers)
+                # "#" also matches no segment at all.
+                child = node.children.get(WILDCARD_ANY)
+                if child is not None:
+                    found.append(child.subscribers)
+
+        if len(found) == 1:
+            return found[0]
+        return set().union(*found)
+
+    def covers(self, pattern) -> bool:
+        """True if every topic matching pattern matches one of the patterns in the trie."""
+        segments = split_topic(pattern)
+
+        def walk(node, index):
+            child = node.children.get(WILDCARD_ANY)
+            if child is not None and child.subscribers:
+                return True
+            if index == len(segments):
+                return bool(node.subscribers)
+
+            segment = segments[index]
+            if segment == WILDCARD_ANY:
+                return False
+            if segment != WILDCARD_ONE:
+                child = node.children.get(segment)
+                if child is not None and walk(child, index + 1):
+                    return True
+            child = node.children.get(WILDCARD_ONE)
+            return child is not None and walk(child, index + 1)
+
+        return walk(self.root, 0)
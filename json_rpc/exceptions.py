@@ -55,3 +55,34 @@ class InternalError(JSONRPCError):
 class InvalidEvent(JSONRPCError):
     # Non-standard variant used for handling invalid Event.
     pass
+
+
+class InvalidResponse(JSONRPCError):
+    # Non-standard variant raised by the clients for replies they can not use.
+    pass
+
+
+class ServerError(JSONRPCError):
+    # Implementation-defined server errors use the codes -32000 to -32099.
+    error_code = -32000
+    short_message = "Server error"
+
+
+class RateLimitExceeded(ServerError):
+    error_code = -32001
+    short_message = "Rate limit exceeded"
+
+
+class DeadlineExceeded(ServerError):
+    error_code = -32002
+    short_message = "Deadline exceeded"
+
+
+class RequestCancelled(ServerError):
+    error_code = -32003
+    short_message = "Request cancelled"
+
+
+class ServerOverloaded(ServerError):
+    error_code = -32004
+    short_message = "Server overloaded"
@@ -0,0 +1,75 @@
+"""
+Executors running blocking synchronous methods away from the event loop.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ("INLINE", "ThreadExecutor")
+
+# Name of the pseudo executor calling methods directly on the event loop.
+INLINE = "inline"
+
+
+class ThreadExecutor:
+    """
+    A bounded thread pool that keeps count of its queue.
+
+    `queued` are calls waiting for a free thread, `running` the ones being
+    executed. `max_queued` is the deepest the queue has been, it helps to
+    size the pool.
+    """
+
+    def __init__(self, name, max_workers=None):
+        self.name = name
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix="jsonrpc-%s" % name)
+        self.max_workers = self.pool._max_workers
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queued = 0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args) -> asyncio.Future:
+        """Calls func(*args) in the pool, returns an asyncio future of the result."""
+        with self._lock:
+            self.queued += 1
+            if self.queued > self.max_queued:
+                self.max_queued = self.queued
+
+        future = self.pool.submit(self._work, func, args)
+        future.add_done_callback(self._forget_cancelled)
+        return asyncio.wrap_future(future)
+
+    def _work(self, func, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    def _forget_cancelled(self, future):
+        # A call cancelled while queued never reaches _work.
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.max_workers,
+                    "queued": self.queued,
+                    "running": self.running,
+                    "completed": self.completed,
+                    "max_queued": self.max_queued}
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+    def __repr__(self):
+        return '{}(name={!r}, max_workers={!r})'.format(self.__class__.__name__, self.name, self.max_workers)
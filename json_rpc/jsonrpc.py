@@ -1,25 +1,61 @@
-import json
-from .exceptions import JSONRPCError, InvalidRequest, ParseError, EmptyBatchRequest
+import re
+from .exceptions import JSONRPCError, InvalidRequest, InvalidResponse, ParseError, EmptyBatchRequest
+from .codec import get_codec
 
 SUPPORTED_VERSIONS = {'2.0', '1.0'}
 
 
-def encode(value):
-    """JSON-encodes the given Python object."""
-    return json.dumps(value, default=lambda o: o.toJson()).replace("</", "<\\/")
+def encode(value, codec=None) -> bytes:
+    """Encodes the given Python object, responses and events included."""
+    codec = get_codec(codec)
+    if isinstance(value, list):
+        if any(_has_encoded_result(item) for item in value):
+            return codec.join([encode(item, codec) for item in value])
+        value = [item.toJson() if isinstance(item, ENVELOPES) else item for item in value]
+    elif isinstance(value, ENVELOPES):
+        if _has_encoded_result(value):
+            return _encode_spliced(value, codec)
+        value = value.toJson()
 
+    return codec.encode(value)
 
-def decode(request_json, version=None):
-    """JSON-decodes the given string to Python object."""
-    try:
-        if isinstance(request_json, bytes):
-            request_json = request_json.decode("utf-8")
 
-        obj = json.loads(request_json)
+def _has_encoded_result(value):
+    return value.__class__ is JSONRPCResponse and value.result.__class__ is EncodedResult
+
+
+def _encode_spliced(response, codec):
+    # The result is already encoded, only the envelope around it is built.
+    result = response.result.encoded(codec)
+    if codec.raw_json:
+        if response.version == '1.0':
+            return b'{"id":' + codec.encode(response.id) + b',"result":' + result + b',"error":null}'
+        return b'{"jsonrpc":"2.0","id":' + codec.encode(response.id) + b',"result":' + result + b'}'
+
+    key = codec.encode
+    if response.version == '1.0':
+        members = [(key("id"), key(response.id)), (key("result"), result), (key("error"), key(None))]
+    else:
+        members = [(key("jsonrpc"), key("2.0")), (key("id"), key(response.id)), (key("result"), result)]
+    return codec.join_map(members)
+
 
-    except json.JSONDecodeError as jsonError:
+def decode(request_json, version=None, codec=None):
+    """Decodes the given bytes or string to request objects."""
+    return process_requests(parse(request_json, codec), version)
+
+
+def parse(request_json, codec=None):
+    """Decodes the given bytes or string with the codec, without validating it."""
+    codec = get_codec(codec)
+    try:
+        return codec.decode(request_json)
+    except codec.decode_errors as jsonError:
         raise ParseError(str(jsonError))
 
+
+def process_requests(obj, version=None):
+    """Builds the request objects of a decoded body, a list for a batch."""
     if isinstance(obj, list):  # Batch request
         requests = [process_request(data, version=version) for data in obj]
         if not requests:
@@ -34,227 +70,382 @@ def decode(request_json, version=None):
         return request
 
 
+class IncrementalDecoder:
+    """
+    Decodes a body arriving in chunks.
+
+    When the body is a batch every element is decoded to a request object as
+    soon as its last byte is fed, so only the unfinished element is buffered.
+    Any other body is buffered and returned by `finish` to be decoded at once.
+    """
+
+    _OUTSIDE_STRING = re.compile(rb'[\[\]{}",]')
+    _INSIDE_STRING = re.compile(rb'["\\]')
+    _WHITESPACE = b" \t\r\n"
+
+    def __init__(self, version=None, codec=None):
+        self.version = version
+        self.codec = get_codec(codec)
+        self.is_batch = None  # Unknown until the first byte of the document
+        self.count = 0
+        self._buffer = bytearray()
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._closed = False
+
+    def feed(self, chunk) -> list:
+        """Adds a chunk of the body and returns the requests completed by it."""
+        buffer = self._buffer
+        buffer += chunk
+        if self.is_batch is None:
+            stripped = buffer.lstrip(self._WHITESPACE)
+            if not stripped:
+                return []
+            self.is_batch = stripped.startswith(b"[")
+
+        if not self.is_batch:
+            return []
+
+        requests = []
+        pos, start, depth, in_string = self._pos, self._start, self._depth, self._in_string
+        while True:
+            if in_string:
+                match = self._INSIDE_STRING.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if buffer[match.start()] == 0x5c:  # backslash escapes the next byte
+                    if match.end() >= len(buffer):
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                else:
+                    in_string = False
+                    pos = match.end()
+                continue
+
+            match = self._OUTSIDE_STRING.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char, pos = buffer[match.start()], match.end()
+            if self._closed:
+                raise ParseError("Extra data after the batch")
+            if char == 0x22:  # "
+                in_string = True
+            elif char in b"[{":
+                depth += 1
+                if depth == 1:
+                    start = pos
+            elif char in b"]}":
+                depth -= 1
+                if depth < 0:
+                    raise ParseError("Unbalanced brackets")
+                if depth == 0:
+                    if char != 0x5d:
+                        raise ParseError("Unbalanced brackets")
+                    self._closed = True
+                    if start < match.start() and buffer[start:match.start()].strip(self._WHITESPACE):
+                        requests.append(self._decode_element(buffer[start:match.start()]))
+                    elif self.count:
+                        raise ParseError("Expecting value before ']'")
+                    start = pos
+            elif depth == 1:  # comma between elements
+                requests.append(self._decode_element(buffer[start:match.start()]))
+                start = pos
+
+        # Forget about everything already decoded.
+        if start:
+            del buffer[:start]
+            pos -= start
+            start = 0
+        self._pos, self._start, self._depth, self._in_string = pos, start, depth, in_string
+        return requests
+
+    def finish(self):
+        """
+        Ends the body.
+
+        Returns the buffered body when it is not a batch, None otherwise.
+        """
+        if not self.is_batch:
+            return bytes(self._buffer)
+
+        if not self._closed:
+            raise ParseError("Unexpected end of the batch")
+        if self._buffer.strip(self._WHITESPACE):
+            raise ParseError("Extra data after the batch")
+        if not self.count:
+            raise EmptyBatchRequest("Empty batch request")
+
+    def _decode_element(self, data):
+        try:
+            obj = self.codec.decode(bytes(data))
+        except self.codec.decode_errors as jsonError:
+            raise ParseError(str(jsonError))
+
+        self.count += 1
+        return process_request(obj, version=self.version)
+
+
 def process_request(request, version=None):
-    try:
-        request_version = request.get('jsonrpc', '1.0')
-        if version is not None and request_version != version:
-            raise InvalidRequest("Refusing to handle version {}".format(request_version))
-
-        if request_version == '2.0':
-            return JSONRPC2Request(**request)
-        elif request_version == '1.0':
-            return JSONRPC1Request(**request)
-        elif request_version not in SUPPORTED_VERSIONS:
-            return JSONRPCRequest(**request)
-    except KeyError as kerr:
-        return InvalidRequest('Missing member {!s}'.format(kerr),
-                              JSONRPCStyleRequest(**request))
-    except InvalidRequest as inverr:
-        return InvalidRequest(str(inverr), JSONRPCStyleRequest(**request))
-    except Exception as err:
-        return InvalidRequest(str(err))
+    """
+    Builds the request object of a decoded call, validating it in one pass.
+
+    Nothing is raised: an invalid call is returned as an InvalidRequest
+    carrying a JSONRPCStyleRequest, so the error can be answered with its id.
+    """
+    if not isinstance(request, dict):
+        return InvalidRequest("Invalid type for request, expected an object")
+    # MessagePack and CBOR maps may have other keys than strings.
+    if not all(isinstance(name, str) for name in request):
+        return _invalid_request(request, "Member names must be strings")
+
+    request_version = request.get('jsonrpc', '1.0')
+    if version is not None and request_version != version:
+        return _invalid_request(request, "Refusing to handle version {}".format(request_version))
+
+    if 'method' not in request:
+        return _invalid_request(request, "Missing member 'method'")
+
+    params = request.get('params')
+    if isinstance(params, dict) and not all(isinstance(name, str) for name in params):
+        return _invalid_request(request, 'Names in "params" must be strings!')
+    if request_version == '2.0':
+        request_class = JSONRPC2Request
+        is_notification = 'id' not in request
+        if params is not None and not isinstance(params, (list, dict)):
+            return _invalid_request(request, 'Invalid type for "params"!')
+    elif request_version == '1.0':
+        request_class = JSONRPC1Request
+        if 'id' not in request:
+            return _invalid_request(request, 'Missing member "id"')
+        is_notification = request['id'] is None
+        if not isinstance(params, list):
+            return _invalid_request(request, 'Invalid type for "params"!')
+    else:
+        return _invalid_request(request, "Unsupported JSONRPC version!")
+
+    method = request['method']
+    if not isinstance(method, str):
+        return _invalid_request(request, '"method" must be a string!')
+
+    timeout = request.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                or timeout <= 0):
+        return _invalid_request(request, '"timeout" must be a positive number of seconds!')
+
+    return request_class(method, params, request.get('id'), request_version, is_notification, timeout)
+
+
+def _invalid_request(request, message):
+    return InvalidRequest(message, JSONRPCStyleRequest(id=request.get('id'), method=request.get('method'),
+                                                       params=request.get('params'),
+                                                       jsonrpc=request.get('jsonrpc', '1.0')))
+
+
+def process_response(response):
+    """
+    Builds the response object of a decoded reply, used by the clients.
+
+    Like `process_request` nothing is raised: a reply that is not a response
+    is returned as an InvalidResponse.
+    """
+    if not isinstance(response, dict) or 'id' not in response:
+        return InvalidResponse("Invalid response: {!r}".format(response))
+
+    error = response.get('error')
+    if error is not None:
+        error = JSONRPCStyleError.fromJson(error)
+    elif 'result' not in response:
+        return InvalidResponse("Missing member 'result' or 'error'")
+
+    return JSONRPCResponse(response.get('jsonrpc', '1.0'), response['id'], response.get('result'), error)
 
 
 class JSONRPCStyleError:
+    __slots__ = ('code', 'message')
+
     def __init__(self, exception: JSONRPCError):
         assert isinstance(exception, JSONRPCError)
-        self._code = exception.error_code
-        self._message = "{}: {}".format(exception.short_message, str(exception))
-
-    @property
-    def code(self):
-        return self._code
-
-    @property
-    def message(self):
-        return self._message
+        self.code = exception.error_code
+        self.message = "{}: {}".format(exception.short_message, str(exception))
 
     def __repr__(self):
-        return '{}(code={!r})'.format(self.__class__.__name__, self._code)
+        return '{}(code={!r})'.format(self.__class__.__name__, self.code)
 
     def toJson(self):
-        return dict(code=self._code, message=self._message)
+        return {"code": self.code, "message": self.message}
+
+    @classmethod
+    def fromJson(cls, error):
+        """Builds the error of a decoded response."""
+        self = cls.__new__(cls)
+        if isinstance(error, dict):
+            self.code = error.get('code', JSONRPCError.error_code)
+            self.message = error.get('message', "")
+        else:  # JSON-RPC 1.0 allows any value
+            self.code = JSONRPCError.error_code
+            self.message = str(error)
+        return self
 
 
 class JSONRPCResponse:
-    def __init__(self, version, id=None, result=None, error: JSONRPCStyleError= None, exception: JSONRPCError=None):
-        self._version = version
-        self._id = id
-        self._result = result
-        self._error = error
+    __slots__ = ('version', 'id', 'result', 'error')
+
+    def __init__(self, version, id=None, result=None, error: JSONRPCStyleError = None,
+                 exception: JSONRPCError = None):
+        self.version = version
+        self.id = id
+        self.result = result
+        self.error = error
         if exception:
             try:
                 request = exception.args[1]
                 exception = exception.__class__(exception.args[0])
                 try:
-                    self._id = request.id
+                    self.id = request.id
                 except AttributeError:
                     pass
             except (IndexError, TypeError):
                 pass
 
-            self._error = JSONRPCStyleError(exception)
-
-    @property
-    def version(self) -> int:
-        return self._version
-
-    @property
-    def id(self) -> int:
-        return self._id
-
-    @property
-    def result(self) -> object:
-        return self._result
-
-    @property
-    def error(self) -> JSONRPCStyleError:
-        return self._error
+            self.error = JSONRPCStyleError(exception)
 
     def __repr__(self):
         return '{}(version={!r}, result={!r}, error={!r}, id={!r})'.format(
-            self.__class__.__name__, self._version, self._result, self._error, self._id)
+            self.__class__.__name__, self.version, self.result, self.error, self.id)
 
     def toJson(self):
-        if self._error:
+        if self.error:
             if self.version == '1.0':
-                return {"id": self._id,
+                return {"id": self.id,
                         "result": None,
-                        "error": self._error}
+                        "error": self.error.toJson()}
             else:
                 return {"jsonrpc": "2.0",
-                        "id": self._id,
-                        "error": self._error}
+                        "id": self.id,
+                        "error": self.error.toJson()}
         else:
             if self.version == '1.0':
-                return {"id": self._id,
-                        "result": self._result,
+                return {"id": self.id,
+                        "result": self.result,
                         "error": None}
             else:
                 return {"jsonrpc": "2.0",
-                        "id": self._id,
-                        "result": self._result}
+                        "id": self.id,
+                        "result": self.result}
 
 
-class JSONRPCEvent:
-    def __init__(self, notification: str, params: (list, dict)):
-        self._params = params
-        self._notification = notification
+class EncodedResult:
+    """
+    A method result kept together with its encodings.
+
+    The same instance can be sent in many responses, the result is only
+    encoded once for every codec.
+    """
+    __slots__ = ('value', 'encodings')
 
-    @property
-    def notification(self) -> str:
-        return self._notification
+    def __init__(self, value):
+        self.value = value
+        self.encodings = {}  # codec -> bytes
 
-    @property
-    def params(self) -> (list, dict):
-        return self._params
+    def encoded(self, codec=None) -> bytes:
+        codec = get_codec(codec)
+        data = self.encodings.get(codec)
+        if data is None:
+            data = self.encodings[codec] = codec.encode(self.value)
+        return data
 
     def toJson(self):
-        return {"jsonrpc": "2.0",
-                "notification": self._notification,
-                "params": self._params}
+        return self.value
 
     def __repr__(self):
-        return '{}(notification={!r}, params={!r})'.format(self.__class__.__name__, self._notification, self._params)
+        return '{}(value={!r})'.format(self.__class__.__name__, self.value)
 
 
-class JSONRPCStyleRequest:
+class JSONRPCEvent:
+    __slots__ = ('notification', 'params')
 
-    def __init__(self, **kwargs):
-        self._id = kwargs.get('id')
-        self._method = kwargs.get('method')
-        self._params = kwargs.get('params')
-        self._version = kwargs.get('jsonrpc', '1.0')
+    def __init__(self, notification: str, params: (list, dict)):
+        self.params = params
+        self.notification = notification
 
-    @property
-    def id(self):
-        return self._id
+    def toJson(self):
+        return {"jsonrpc": "2.0",
+                "notification": self.notification,
+                "params": self.params}
 
-    @property
-    def method(self):
-        return self._method
+    def __repr__(self):
+        return '{}(notification={!r}, params={!r})'.format(self.__class__.__name__, self.notification, self.params)
 
-    @property
-    def params(self):
-        return self._params
 
-    @property
-    def version(self):
-        return self._version
+class JSONRPCStyleRequest:
+    """
+    The members of a call that could not be turned into a request.
+    """
+    __slots__ = ('id', 'method', 'params', 'version')
+
+    def __init__(self, **kwargs):
+        self.id = kwargs.get('id')
+        self.method = kwargs.get('method')
+        self.params = kwargs.get('params')
+        self.version = kwargs.get('jsonrpc', '1.0')
 
 
 class JSONRPCRequest(JSONRPCStyleRequest):
     """
     A request in style of JSON-RPC.
 
-    This is a request not following of a specific version.
+    Requests are built and validated by `process_request`. When no params
+    were given the `params` attribute is left unset, reading it raises an
+    AttributeError. `timeout` is the optional "timeout" member, the seconds
+    the client is willing to wait for the response.
     """
+    __slots__ = ('is_notification', 'timeout')
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._method = kwargs['method']
-
-        self._is_notification = False
+    def __init__(self, method, params=None, id=None, version='1.0', is_notification=False, timeout=None):
+        self.method = method
+        if params is not None:
+            self.params = params
+        self.id = id
+        self.version = version
+        self.is_notification = is_notification
+        self.timeout = timeout
 
     def __repr__(self):
         return '{}(version={!r}, method={!r}, params={!r}, id={!r})'.format(
-            self.__class__.__name__, self._version, self._method, self._params, self._id)
-
-    @property
-    def id(self):
-        return self._id
-
-    @property
-    def is_notification(self):
-        return self._is_notification
-
-    @property
-    def params(self):
-        if self._params is None:
-            raise AttributeError("No params given.")
-
-        return self._params
-
-    @property
-    def version(self):
-        return self._version
+            self.__class__.__name__, self.version, self.method, getattr(self, 'params', None), self.id)
 
     def validate(self):
-        if self.version not in SUPPORTED_VERSIONS:
-            raise InvalidRequest("Unsupported JSONRPC version!")
+        """Kept for compatibility, requests are validated when they are built."""
 
-        if not isinstance(self._method, str):
-            raise InvalidRequest('"method" must be a string!')
+    def toJson(self):
+        params = getattr(self, 'params', None)
+        if self.version == '1.0':
+            request = {"method": self.method,
+                       "params": [] if params is None else params,
+                       "id": None if self.is_notification else self.id}
+        else:
+            request = {"jsonrpc": "2.0", "method": self.method}
+            if params is not None:
+                request["params"] = params
+            if not self.is_notification:
+                request["id"] = self.id
+        if self.timeout is not None:
+            request["timeout"] = self.timeout
+        return request
 
 
 class JSONRPC1Request(JSONRPCRequest):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-        if 'id' not in kwargs:
-            raise InvalidRequest('Missing member "id"')
-
-        if self._id is None:
-            self._is_notification = True
-
-    def validate(self):
-        super().validate()
-
-        if not isinstance(self._params, list):
-            raise InvalidRequest('Invalid type for "params"!')
+    __slots__ = ()
 
 
 class JSONRPC2Request(JSONRPCRequest):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-        if 'id' not in kwargs:
-            self._is_notification = True
-
-    def validate(self):
-        super().validate()
+    __slots__ = ()
 
-        if (self._params is not None and
-                not isinstance(self._params, (list, dict))):
 
-            raise InvalidRequest('Invalid type for "params"!')
+# Objects encoded through their toJson representation.
+ENVELOPES = (JSONRPCResponse, JSONRPCEvent, JSONRPCStyleError, JSONRPCRequest)
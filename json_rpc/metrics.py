@@ -0,0 +1,210 @@
+"""
+Metrics of the calls, batches and subscriptions, in the Prometheus text format.
+
+Everything is recorded from the event loop thread, even the calls of
+methods running in an executor are measured around the awaited future, so
+the counters are plain integers without locks. Histograms allocate their
+buckets once, observing a value is a bisect and two additions.
+"""
+
+import itertools
+import time
+from bisect import bisect_left
+
+__all__ = ("LATENCY_BUCKETS", "BATCH_SIZE_BUCKETS", "UNKNOWN_METHOD", "CONTENT_TYPE",
+           "Histogram", "MethodMetrics", "Metrics")
+
+# Upper bounds of the buckets, in seconds for the latencies.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Calls of methods that are not known to exist are counted together, clients
+# can not create a series per name they make up.
+UNKNOWN_METHOD = "<unknown>"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        # One more bucket for the values above the last bound.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, count of values below it) pairs, the last bound is "+Inf"."""
+        bounds = [_format_value(bound) for bound in self.bounds] + ["+Inf"]
+        return zip(bounds, itertools.accumulate(self.counts))
+
+    def __repr__(self):
+        return '{}(count={!r}, sum={!r})'.format(self.__class__.__name__, self.count, self.sum)
+
+
+class MethodMetrics:
+    __slots__ = ('calls', 'in_flight', 'latency', 'errors')
+
+    def __init__(self, buckets):
+        self.calls = 0
+        self.in_flight = 0
+        self.latency = Histogram(buckets)
+        self.errors = {}  # error code -> count
+
+
+class Metrics:
+    """
+    Registry of the metrics of one server.
+
+    Give the same instance to the handlers (`metrics` in the route spec) and
+    to the Dispatcher, and mount a MetricsHandler to expose it.
+
+    Methods get a series of their own once they are known to exist: they
+    are registered with a Dispatcher given the instance, or a call of them
+    succeeded. The calls of other names are counted as UNKNOWN_METHOD.
+    """
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS, batch_size_buckets=BATCH_SIZE_BUCKETS):
+        self.latency_buckets = tuple(latency_buckets)
+        self.methods = {}
+        self.batch_sizes = Histogram(batch_size_buckets)
+        self.rejected = {}  # error code -> count
+        self.events = 0
+        self.deliveries = 0
+        self.subscriptions = []
+        self.queue_waits = {}  # scheduling class -> Histogram
+        self.method_registries = []
+
+    def track_methods(self, registry):
+        """Methods registered in registry (a mapping by name) get a series of their own."""
+        self.method_registries.append(registry)
+
+    def is_known(self, method):
+        return method in self.methods or any(method in registry for registry in self.method_registries)
+
+    def _stats(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodMetrics(self.latency_buckets)
+        return stats
+
+    def call_started(self, method):
+        """Counts a call in flight, returns the token to give to call_finished."""
+        stats = self._stats(method if self.is_known(method) else UNKNOWN_METHOD)
+        stats.in_flight += 1
+        return stats, time.perf_counter()
+
+    def call_finished(self, method, started, error_code=None):
+        stats, start = started
+        elapsed = time.perf_counter() - start
+        stats.in_flight -= 1
+        if error_code is None or self.is_known(method):
+            stats = self._stats(method)
+        else:
+            stats = self._stats(UNKNOWN_METHOD)
+
+        stats.calls += 1
+        stats.latency.observe(elapsed)
+        if error_code is not None:
+            stats.errors[error_code] = stats.errors.get(error_code, 0) + 1
+
+    def call_scheduled(self, traffic_class, waited):
+        """Records the seconds a call waited in the queue of its scheduling class."""
+        histogram = self.queue_waits.get(traffic_class)
+        if histogram is None:
+            histogram = self.queue_waits[traffic_class] = Histogram(self.latency_buckets)
+        histogram.observe(waited)
+
+    def request_rejected(self, error_code):
+        """Counts a body or batch member refused before calling any method."""
+        self.rejected[error_code] = self.rejected.get(error_code, 0) + 1
+
+    def batch_received(self, size):
+        self.batch_sizes.observe(size)
+
+    def event_emitted(self, deliveries):
+        self.events += 1
+        self.deliveries += deliveries
+
+    def track_subscriptions(self, trie):
+        """Reports the subscribers of every pattern of a TopicTrie."""
+        self.subscriptions.append(trie)
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name, kind, help):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        methods = sorted(self.methods.items())
+        family("jsonrpc_calls_total", "counter", "Calls answered, by method.")
+        for method, stats in methods:
+            lines.append('jsonrpc_calls_total{method="%s"} %d' % (_escape(method), stats.calls))
+
+        family("jsonrpc_call_errors_total", "counter", "Calls answered with an error, by method and code.")
+        for method, stats in methods:
+            for code, count in sorted(stats.errors.items()):
+                lines.append('jsonrpc_call_errors_total{method="%s",code="%s"} %d' % (
+                    _escape(method), code, count))
+
+        family("jsonrpc_calls_in_flight", "gauge", "Calls being computed, by method.")
+        for method, stats in methods:
+            lines.append('jsonrpc_calls_in_flight{method="%s"} %d' % (_escape(method), stats.in_flight))
+
+        family("jsonrpc_call_duration_seconds", "histogram", "Time to compute the calls, by method.")
+        for method, stats in methods:
+            _histogram(lines, "jsonrpc_call_duration_seconds", stats.latency, 'method="%s"' % _escape(method))
+
+        family("jsonrpc_queue_wait_seconds", "histogram", "Time waited for a slot, by scheduling class.")
+        for traffic_class, histogram in sorted(self.queue_waits.items()):
+            _histogram(lines, "jsonrpc_queue_wait_seconds", histogram, 'class="%s"' % _escape(traffic_class))
+
+        family("jsonrpc_rejected_total", "counter", "Requests refused before any call, by error code.")
+        for code, count in sorted(self.rejected.items()):
+            lines.append('jsonrpc_rejected_total{code="%s"} %d' % (code, count))
+
+        family("jsonrpc_batch_size", "histogram", "Number of calls in the batch requests.")
+        _histogram(lines, "jsonrpc_batch_size", self.batch_sizes)
+
+        family("jsonrpc_events_total", "counter", "Events emitted to at least one subscriber.")
+        lines.append("jsonrpc_events_total %d" % self.events)
+        family("jsonrpc_event_deliveries_total", "counter", "Events handed to the subscribers.")
+        lines.append("jsonrpc_event_deliveries_total %d" % self.deliveries)
+
+        family("jsonrpc_subscribers", "gauge", "Subscribers, by topic pattern.")
+        subscribers = {}
+        for trie in self.subscriptions:
+            for pattern, transports in trie.patterns.items():
+                subscribers[pattern] = subscribers.get(pattern, 0) + len(transports)
+        for pattern, count in sorted(subscribers.items()):
+            lines.append('jsonrpc_subscribers{topic="%s"} %d' % (_escape(pattern), count))
+
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return '{}(methods={!r})'.format(self.__class__.__name__, len(self.methods))
+
+
+def _histogram(lines, name, histogram, labels=""):
+    separator = "," if labels else ""
+    for bound, count in histogram.cumulative():
+        lines.append('%s_bucket{%s%sle="%s"} %d' % (name, labels, separator, bound, count))
+    labels = "{%s}" % labels if labels else ""
+    lines.append("%s_sum%s %s" % (name, labels, _format_value(histogram.sum)))
+    lines.append("%s_count%s %d" % (name, labels, histogram.count))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
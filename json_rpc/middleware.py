@@ -0,0 +1,127 @@
+"""
+Middleware around the processing of the calls.
+
+A Middleware implements any of the hooks:
+
+* `before_decode(processor, body)` returns the body to decode, it is not
+  called for the batches decoded while received by StreamingJSONRPCHandler.
+* `before_dispatch(processor, request)` runs before the call is computed,
+  raising a JSONRPCError answers the call with it.
+* `after_dispatch(processor, request, result)` returns the result to send.
+* `on_error(processor, request, error)` sees the errors of the call, the
+  error is raised again afterwards.
+
+or overrides `wrap` to run around the rest of the chain. A MiddlewareChain
+composes them into one callable whenever it is changed, processing a call
+does not look at the middlewares that have no hook for it.
+"""
+
+from .jsonrpc import EncodedResult
+
+__all__ = ("Middleware", "MiddlewareChain")
+
+
+async def _compute(processor, request):
+    return await processor.compute_result(request)
+
+
+def _overrides(middleware, hook):
+    return getattr(type(middleware), hook) is not getattr(Middleware, hook)
+
+
+class Middleware:
+
+    def before_decode(self, processor, body):
+        return body
+
+    async def before_dispatch(self, processor, request):
+        pass
+
+    async def after_dispatch(self, processor, request, result):
+        return result
+
+    async def on_error(self, processor, request, error):
+        pass
+
+    def wrap(self, call_next):
+        """
+        Returns the coroutine function computing a call through this middleware.
+
+        `call_next(processor, request)` computes it through the rest of the chain.
+        """
+        before = self.before_dispatch if _overrides(self, "before_dispatch") else None
+        after = self.after_dispatch if _overrides(self, "after_dispatch") else None
+        on_error = self.on_error if _overrides(self, "on_error") else None
+        if before is None and after is None and on_error is None:
+            return call_next
+
+        async def call(processor, request):
+            try:
+                if before is not None:
+                    await before(processor, request)
+                result = await call_next(processor, request)
+            except Exception as error:
+                if on_error is not None:
+                    await on_error(processor, request, error)
+                raise
+
+            if after is not None:
+                if result.__class__ is EncodedResult:
+                    # Cached results are seen as their value, kept encoded when returned unchanged.
+                    value = await after(processor, request, result.value)
+                    return result if value is result.value else value
+                result = await after(processor, request, result)
+            return result
+
+        return call
+
+    def __repr__(self):
+        return '{}()'.format(self.__class__.__name__)
+
+
+class MiddlewareChain:
+    """
+    Ordered middlewares, the first one is the outermost.
+
+    Give the chain as `middleware` in the route spec of the handlers, it is
+    compiled once and shared by the requests.
+    """
+
+    def __init__(self, middlewares=()):
+        self.middlewares = list(middlewares)
+        self.compile()
+
+    def add(self, middleware):
+        self.middlewares.append(middleware)
+        self.compile()
+
+    def remove(self, middleware):
+        self.middlewares.remove(middleware)
+        self.compile()
+
+    def compile(self):
+        call = _compute
+        for middleware in reversed(self.middlewares):
+            call = middleware.wrap(call)
+        # call(processor, request) computes a call through every middleware.
+        self.call = call
+
+        hooks = [middleware.before_decode for middleware in self.middlewares
+                 if _overrides(middleware, "before_decode")]
+        if not hooks:
+            # None when no middleware looks at the body.
+            self.before_decode = None
+        elif len(hooks) == 1:
+            self.before_decode = hooks[0]
+        else:
+            def before_decode(processor, body):
+                for hook in hooks:
+                    body = hook(processor, body)
+                return body
+            self.before_decode = before_decode
+
+    def __len__(self):
+        return len(self.middlewares)
+
+    def __repr__(self):
+        return '{}({!r})'.format(self.__class__.__name__, self.middlewares)
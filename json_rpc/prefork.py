@@ -0,0 +1,186 @@
+"""
+Serving from several processes, with events relayed between them.
+
+`serve` forks worker processes sharing the listening sockets, plus one
+process running an EventBroker on a Unix socket. Every worker connects an
+EventBus to it: the events emitted by the Dispatcher of a worker are sent
+to the broker once, already encoded, and the broker relays the same bytes
+to the other workers which hand them to their own subscribers.
+
+Frames on the bus are a header with the sizes of the topic and of the
+data, the topic in UTF-8 and the encoded notification.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import struct
+import tempfile
+
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream, StreamBufferFullError, StreamClosedError
+from tornado.netutil import bind_sockets, bind_unix_socket
+from tornado.process import cpu_count, fork_processes
+from tornado.tcpserver import TCPServer
+
+from .eventbus import EventBackend
+
+__all__ = ("EventBroker", "EventBus", "serve")
+
+logger = logging.getLogger("jsonrpc")
+
+# Sizes of the topic and of the data.
+HEADER = struct.Struct("!HI")
+
+
+class EventBroker(TCPServer):
+    """
+    Relays every frame received on the Unix socket at `path` to the other
+    connections. A worker reading too slowly to keep up with
+    `max_buffer_size` bytes of frames is disconnected, it reconnects.
+    """
+
+    def __init__(self, path, max_buffer_size=64 * 1024 * 1024):
+        super().__init__()
+        self.path = path
+        self.max_buffer_size = max_buffer_size
+        self.streams = set()
+
+    def listen(self):
+        self.add_socket(bind_unix_socket(self.path))
+
+    async def handle_stream(self, stream, address):
+        stream.max_write_buffer_size = self.max_buffer_size
+        self.streams.add(stream)
+        try:
+            while True:
+                header = await stream.read_bytes(HEADER.size)
+                topic_size, size = HEADER.unpack(header)
+                frame = header + await stream.read_bytes(topic_size + size)
+                self.relay(frame, stream)
+        except StreamClosedError:
+            pass
+        finally:
+            self.streams.discard(stream)
+
+    def relay(self, frame, sender):
+        for stream in [*self.streams]:
+            if stream is sender:
+                continue
+            try:
+                stream.write(frame)
+            except StreamBufferFullError:
+                logger.warning("event bus: worker too slow, disconnecting it")
+                stream.close()
+            except StreamClosedError:
+                self.streams.discard(stream)
+
+
+class EventBus(EventBackend):
+    """
+    Connection of a worker to the EventBroker at `path`.
+
+    Give it to the Dispatcher (`Dispatcher(bus=...)`), the events are
+    encoded with `codec` to be sent. Every event goes to every worker, the
+    broker does not know about the subscriptions. Events emitted while the
+    broker is unreachable only reach the local subscribers, the bus
+    reconnects every `reconnect_interval` seconds.
+    """
+
+    def __init__(self, path, codec=None, reconnect_interval=1.0):
+        super().__init__(codec)
+        self.path = path
+        self.reconnect_interval = reconnect_interval
+        self.stream = None
+        self.closed = False
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def connect(self):
+        """Connects to the broker, retrying until it is up."""
+        while not self.closed:
+            stream = IOStream(socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+            try:
+                await stream.connect(self.path)
+            except (StreamClosedError, OSError):
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            self.stream = stream
+            asyncio.ensure_future(self._read(stream))
+            return
+
+    def send(self, topic, data):
+        """Sends an encoded event to the other workers."""
+        stream = self.stream
+        if stream is None or stream.closed():
+            self.dropped += 1
+            return
+
+        topic = topic.encode("utf-8")
+        # Two writes, the data is not copied into a frame.
+        stream.write(HEADER.pack(len(topic), len(data)) + topic)
+        stream.write(data)
+        self.published += 1
+
+    async def _read(self, stream):
+        try:
+            while True:
+                topic_size, size = HEADER.unpack(await stream.read_bytes(HEADER.size))
+                topic = (await stream.read_bytes(topic_size)).decode("utf-8")
+                data = await stream.read_bytes(size)
+                self.received += 1
+                self.deliver(topic, data)
+        except StreamClosedError:
+            pass
+        except Exception:
+            logger.exception("event bus: invalid frame")
+            stream.close()
+
+        if self.stream is stream:
+            self.stream = None
+        if not self.closed:
+            logger.warning("event bus: connection to the broker lost, reconnecting")
+            await self.connect()
+
+    def close(self):
+        self.closed = True
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    def __repr__(self):
+        return '{}(path={!r}, connected={!r})'.format(
+            self.__class__.__name__, self.path, self.stream is not None)
+
+
+def serve(make_app, port, address=None, workers=None, bus_path=None, **server_options):
+    """
+    Serves `make_app(bus)` on port from `workers` processes, one per CPU by default.
+
+    make_app is called in every worker with its EventBus and returns the
+    tornado.web.Application, its Dispatcher should be given the bus. One
+    more process runs the EventBroker at `bus_path`, by default a socket in
+    the temporary directory. Crashed processes are restarted. Never returns.
+    """
+    sockets = bind_sockets(port, address)
+    if bus_path is None:
+        bus_path = os.path.join(tempfile.gettempdir(), "json-rpc-bus-%d.sock" % os.getpid())
+    workers = workers or cpu_count()
+
+    # The last process runs the broker.
+    task_id = fork_processes(workers + 1)
+    if task_id == workers:
+        for sock in sockets:
+            sock.close()
+        EventBroker(bus_path).listen()
+    else:
+        bus = EventBus(bus_path)
+        server = HTTPServer(make_app(bus), **server_options)
+        server.add_sockets(sockets)
+        IOLoop.current().spawn_callback(bus.connect)
+
+    IOLoop.current().start()
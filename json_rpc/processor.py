@@ -1,7 +1,9 @@
+import asyncio
 import logging
-from .jsonrpc import decode, encode, JSONRPCStyleError, JSONRPCResponse
+from .jsonrpc import decode, encode, parse, process_requests, JSONRPCStyleError, JSONRPCResponse
 from .exceptions import (JSONRPCError, ParseError, InvalidRequest, MethodNotFound,
-                         InvalidParams, InternalError, EmptyBatchRequest)
+                         InvalidParams, InternalError, EmptyBatchRequest, ServerError,
+                         DeadlineExceeded, RequestCancelled)
 
 __all__ = ("BasicJSONRPCProcessor")
 
@@ -11,54 +13,230 @@ logger = logging.getLogger("jsonrpc")
 class BasicJSONRPCProcessor():
 
     version = None
+    # Maximum number of batch members computed at the same time.
+    # 1 keeps the sequential behaviour, None removes the limit.
+    batch_concurrency = 1
+    # Codec instance or name (see json_rpc.codec), None selects the fastest one.
+    codec = None
+    # Codec of the responses when the client asked for another one, None uses `codec`.
+    response_codec = None
+    # json_rpc.metrics.Metrics recording the calls, None records nothing.
+    metrics = None
+    # json_rpc.middleware.MiddlewareChain around the calls.
+    middleware = None
+    # json_rpc.tracing.Tracer sampling the requests, None traces nothing.
+    tracer = None
+    # json_rpc.ratelimit.RateLimiter admitting the calls, None admits all of them.
+    rate_limiter = None
+    # Seconds a call may run before it is cancelled, None lets it run.
+    timeout = None
+    # Loop time by which the whole request must be answered, None if the client set none.
+    deadline = None
+    # Running calls by id, cancellable with `cancel_call`. None does not track them.
+    running_calls = None
+    # json_rpc.scheduling.FairScheduler queuing the calls, None runs them right away.
+    scheduler = None
 
-    async def process_jsonrpc(self, request_json):
+    def start_trace(self, transport):
+        """Returns the root span of the request, None when it is not traced."""
+        if self.tracer is None:
+            return None
+        return self.tracer.start_trace("jsonrpc.request", transport=transport)
+
+    def decode_jsonrpc(self, request_json, trace=None):
+        """
+        Decodes the request(s).
+
+        A request that can not be decoded is answered right away, the
+        JSONRPCResponse with the error is returned instead.
+        """
         try:
-            request = decode(request_json, version=self.version)
+            if self.middleware is not None and self.middleware.before_decode is not None:
+                request_json = self.middleware.before_decode(self, request_json)
+            if trace is None:
+                request = decode(request_json, version=self.version, codec=self.codec)
+            else:
+                request = self.decode_traced(request_json, trace)
         except (InvalidRequest, ParseError, EmptyBatchRequest) as ex:
             logger.error("decode error: %r", ex)
+            if self.metrics is not None:
+                self.metrics.request_rejected(ex.error_code)
             return(JSONRPCResponse(self.version, exception=ex))
         except Exception:
             return
 
+        if self.metrics is not None and isinstance(request, list):
+            self.metrics.batch_received(len(request))
+        return request
+
+    def decode_traced(self, request_json, trace):
+        with trace.child("jsonrpc.decode", size=len(request_json)):
+            obj = parse(request_json, codec=self.codec)
+        with trace.child("jsonrpc.validate") as span:
+            request = process_requests(obj, version=self.version)
+            span.set("calls", len(request) if isinstance(request, list) else 1)
+        return request
+
+    async def process_jsonrpc(self, request_json, trace=None):
+        request = self.decode_jsonrpc(request_json, trace)
+        if request is None or isinstance(request, JSONRPCResponse):
+            return request
+
         # process_jsonrpc_request
         if isinstance(request, list):  # batch request
-            return await self.process_jsonrpc_batch_request(request)
+            return await self.process_jsonrpc_batch_request(request, trace)
         else:
-            return await self.process_jsonrpc_single_request(request)
+            return await self.process_jsonrpc_call(request, trace)
 
-    async def process_jsonrpc_batch_request(self, request):
-        responses = []
-        for call in request:
-            if isinstance(call, JSONRPCError):
-                responses.append(JSONRPCResponse(self.version, exception=call))
-                continue
+    def encode_response(self, response, trace=None) -> bytes:
+        codec = self.codec if self.response_codec is None else self.response_codec
+        if trace is None:
+            return encode(response, codec=codec)
 
-            response = await self.process_jsonrpc_single_request(call)
-            if response:
-                responses.append(response)
+        with trace.child("jsonrpc.encode") as span:
+            data = encode(response, codec=codec)
+            span.set("size", len(data))
+        return data
 
-        return responses
+    async def process_jsonrpc_batch_request(self, request, trace=None):
+        if self.batch_concurrency == 1:
+            responses = []
+            for call in request:
+                responses.append(await self.process_jsonrpc_call(call, trace))
+        else:
+            # gather keeps the order of the request
+            responses = await asyncio.gather(*self.schedule_batch_request(request, trace))
 
-    async def process_jsonrpc_single_request(self, request):
-        logger.warning("Procesar request:%r", request)
+        return [response for response in responses if response]
 
-        try:
-            request.validate()
-        except InvalidRequest as e:
-            return JSONRPCResponse(self.version, id=request.id, exception=e)
+    def schedule_batch_request(self, request, trace=None):
+        """Starts computing the batch members, returns the futures of their responses."""
+        if not self.batch_concurrency:
+            return [asyncio.ensure_future(self.process_jsonrpc_call(call, trace)) for call in request]
+
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def limited(call):
+            async with semaphore:
+                return await self.process_jsonrpc_call(call, trace)
+
+        return [asyncio.ensure_future(limited(call)) for call in request]
 
+    async def process_jsonrpc_call(self, call, trace=None):
+        if isinstance(call, JSONRPCError):
+            if self.metrics is not None:
+                self.metrics.request_rejected(call.error_code)
+            return JSONRPCResponse(self.version, exception=call)
+
+        return await self.process_jsonrpc_single_request(call, trace)
+
+    async def process_jsonrpc_single_request(self, request, trace=None):
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.call_started(request.method)
+        span = None
+        if trace is not None:
+            span = trace.child("jsonrpc.dispatch", method=request.method)
+            if not request.is_notification:
+                span.set("id", request.id)
+        error_code = None
         try:
-            method_result = await self.compute_result(request)
+            if self.rate_limiter is not None:
+                self.rate_limiter.check(self, request.method)
+            limited = (self.timeout is not None or self.deadline is not None or request.timeout is not None
+                       or self.running_calls is not None)
+            if limited:
+                # Checked before the call is created, a late request starts nothing.
+                timeout = self.call_timeout(request)
+                if timeout is not None and timeout <= 0:
+                    raise DeadlineExceeded("deadline passed before the call started")
+            if self.middleware is None:
+                call = self.compute_result(request)
+            else:
+                call = self.middleware.call(self, request)
+            if self.scheduler is not None:
+                call = self.scheduler.run(self, request, call)
+            if limited:
+                method_result = await self.await_call(request, call, timeout)
+            else:
+                method_result = await call
             if not request.is_notification:
                 return JSONRPCResponse(self.version, id=request.id, result=method_result)
 
-        except (MethodNotFound, InvalidParams) as e:
+        except (MethodNotFound, InvalidParams, ServerError) as e:
+            error_code = e.error_code
             if not request.is_notification:
                 return JSONRPCResponse(self.version, id=request.id, exception=e)
+        except asyncio.CancelledError:
+            # The request itself was cancelled, nobody waits for the response.
+            error_code = RequestCancelled.error_code
+            raise
         except Exception as error:
+            error_code = InternalError.error_code
             if not request.is_notification:
                 return JSONRPCResponse(self.version, id=request.id, exception=InternalError(str(error)))
+        finally:
+            if metrics is not None:
+                metrics.call_finished(request.method, start, error_code)
+            if span is not None:
+                if error_code is not None:
+                    span.set("error.code", error_code)
+                span.finish(error_code)
+
+    def call_timeout(self, request):
+        """Seconds left to compute request, the shortest of the limits set; None without one."""
+        timeout = self.timeout
+        if request.timeout is not None and (timeout is None or request.timeout < timeout):
+            timeout = request.timeout
+        if self.deadline is not None:
+            remaining = self.deadline - asyncio.get_event_loop().time()
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        return timeout
+
+    async def await_call(self, request, call, timeout=None):
+        """
+        Awaits the result of a call within timeout seconds, see call_timeout.
+
+        A call that takes longer is cancelled and answered with
+        DeadlineExceeded. When `running_calls` is set the call runs in a task
+        of its own so `cancel_call` can stop it, it is then answered with
+        RequestCancelled. Calls with an id that is not hashable, like a list,
+        can not be cancelled.
+        """
+        running = None if request.is_notification or not _hashable(request.id) else self.running_calls
+        if running is not None:
+            call = asyncio.ensure_future(call)
+            running[request.id] = call
+        try:
+            if timeout is None:
+                return await call
+            return await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("call did not complete within %gs" % timeout) from None
+        except asyncio.CancelledError:
+            # cancel_call forgets the call before cancelling it.
+            if running is not None and running.get(request.id) is not call:
+                raise RequestCancelled("call %r was cancelled" % (request.id,)) from None
+            raise
+        finally:
+            if running is not None and running.get(request.id) is call:
+                del running[request.id]
+
+    def cancel_call(self, id) -> bool:
+        """Cancels the running call with this id, False if there is none."""
+        if self.running_calls is None or not _hashable(id):
+            return False
+        call = self.running_calls.pop(id, None)
+        return call is not None and call.cancel()
 
     async def compute_result(self, request):
         raise NotImplementedError("Handler does not create an result.")
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
@@ -0,0 +1,187 @@
+"""
+Sampled profiling of the calls, as a middleware.
+
+Profiling everything is too expensive for a production server, the
+ProfilingMiddleware only profiles a `sample_rate` of the calls, and only
+one at a time. Its attributes can be changed while the server runs.
+"""
+
+import cProfile
+import itertools
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+from collections import Counter
+
+from .exceptions import MethodNotFound
+from .middleware import Middleware
+
+__all__ = ("CPROFILE", "STACK_SAMPLER", "StackSampler", "ProfilingMiddleware")
+
+CPROFILE = "cprofile"
+STACK_SAMPLER = "sampler"
+
+# Characters kept in the names of the saved files, the others are replaced.
+_UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append("%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler:
+    """
+    Samples the stack of a thread from a background thread.
+
+    Every `interval` seconds between `start` and `stop` the stack of the
+    thread is counted in `stacks`, folded as "outer;...;inner" like the flame
+    graph tools expect. Unlike cProfile the sampled thread is not slowed down.
+    """
+
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="jsonrpc-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        return self.stacks
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+
+class ProfilingMiddleware(Middleware):
+    """
+    Profiles a sample of the calls, the profiles are kept by method name.
+
+    With `profiler=CPROFILE` the profiles are pstats.Stats and also contain
+    whatever the event loop ran while the call was waiting. `STACK_SAMPLER`
+    samples the stack of the event loop thread every `interval` seconds into
+    folded stacks. `methods` limits the profiling to these method names,
+    calls of methods that do not exist are never kept. `save` writes the
+    profiles to a directory, call `reset` after changing the profiler.
+    """
+
+    def __init__(self, sample_rate=0.01, profiler=CPROFILE, methods=None, interval=0.001):
+        if profiler not in (CPROFILE, STACK_SAMPLER):
+            raise ValueError("Unknown profiler: %r" % profiler)
+
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self.methods = None if methods is None else set(methods)
+        self.interval = interval
+        self.profiles = {}  # method -> pstats.Stats or Counter of folded stacks
+        self.samples = Counter()  # method -> number of profiled calls
+        self._profiling = False
+
+    def wrap(self, call_next):
+        async def call(processor, request):
+            if (self._profiling or not self.sample_rate or random.random() >= self.sample_rate or
+                    (self.methods is not None and request.method not in self.methods)):
+                return await call_next(processor, request)
+
+            self._profiling = True
+            try:
+                if self.profiler == CPROFILE:
+                    return await self._profile(call_next, processor, request)
+                return await self._sample(call_next, processor, request)
+            finally:
+                self._profiling = False
+
+        return call
+
+    async def _profile(self, call_next, processor, request):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread.
+            return await call_next(processor, request)
+
+        found = True
+        try:
+            return await call_next(processor, request)
+        except MethodNotFound:
+            found = False
+            raise
+        finally:
+            profile.disable()
+            if found:
+                stats = self.profiles.get(request.method)
+                if stats is None:
+                    self.profiles[request.method] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+                self.samples[request.method] += 1
+
+    async def _sample(self, call_next, processor, request):
+        sampler = StackSampler(interval=self.interval)
+        sampler.start()
+        found = True
+        try:
+            return await call_next(processor, request)
+        except MethodNotFound:
+            found = False
+            raise
+        finally:
+            stacks = sampler.stop()
+            if found:
+                self.profiles.setdefault(request.method, Counter()).update(stacks)
+                self.samples[request.method] += 1
+
+    def save(self, directory) -> list:
+        """
+        Writes a file per method, .prof for pstats and .folded for stacks.
+        Other characters than letters, digits, "_", "." and "-" of the method
+        names are replaced by "_".
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        names = set()
+        for method, profile in sorted(self.profiles.items()):
+            name = base = _UNSAFE_CHARACTERS.sub("_", method).lstrip(".") or "_"
+            # Names made alike by the replacement get a number.
+            for number in itertools.count(2):
+                if name not in names:
+                    break
+                name = "%s-%d" % (base, number)
+            names.add(name)
+            if isinstance(profile, pstats.Stats):
+                path = os.path.join(directory, name + ".prof")
+                profile.dump_stats(path)
+            else:
+                path = os.path.join(directory, name + ".folded")
+                with open(path, "w") as output:
+                    for stack, count in sorted(profile.items()):
+                        output.write("%s %d\n" % (stack, count))
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        self.profiles.clear()
+        self.samples.clear()
+
+    def __repr__(self):
+        return '{}(sample_rate={!r}, profiler={!r})'.format(
+            self.__class__.__name__, self.sample_rate, self.profiler)
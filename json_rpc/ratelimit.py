@@ -0,0 +1,109 @@
+"""
+Admission control of the calls with per-client token buckets.
+"""
+
+import time
+from collections import OrderedDict
+
+from .exceptions import RateLimitExceeded
+
+__all__ = ("RateLimiter", "TokenBucket", "remote_ip", "cookie", "header")
+
+
+def remote_ip(handler):
+    """Identifies the clients of a Tornado handler by address."""
+    return handler.request.remote_ip
+
+
+def cookie(name):
+    """Identifies the clients of a Tornado handler by the value of a cookie."""
+    def identify(handler):
+        return handler.get_cookie(name)
+    return identify
+
+
+def header(name="Authorization"):
+    """Identifies the clients of a Tornado handler by a header, an auth token by default."""
+    def identify(handler):
+        return handler.request.headers.get(name)
+    return identify
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    Token buckets refilled at `rate` tokens per second up to `burst`.
+
+    Every client, as named by `identify(processor)`, has its own bucket and a
+    call takes `costs[method]` tokens (1 by default). Clients without a name
+    share one bucket. Buckets are refilled when used, a call is O(1).
+
+    Buckets unused for `idle_timeout` seconds are dropped, by default the
+    time a bucket takes to refill so dropping it loses nothing. At most
+    `max_clients` buckets are kept, the least recently used go first.
+    """
+
+    def __init__(self, rate, burst=None, identify=remote_ip, costs=None, max_clients=100000,
+                 idle_timeout=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.identify = identify
+        self.costs = costs or {}
+        self.max_clients = max_clients
+        self.idle_timeout = self.burst / rate if idle_timeout is None else idle_timeout
+        self.buckets = OrderedDict()  # least recently used first
+        self.rejected = 0
+        self.clock = time.monotonic
+
+    def acquire(self, client, cost=1) -> bool:
+        """Takes cost tokens from the bucket of client, False if there are not enough."""
+        now = self.clock()
+        self.evict(now)
+
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.burst, now)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens < cost:
+            self.rejected += 1
+            return False
+        bucket.tokens -= cost
+        return True
+
+    def check(self, processor, method):
+        """Raises RateLimitExceeded when the client of processor may not call method now."""
+        client = self.identify(processor) if self.identify is not None else None
+        if not self.acquire(client, self.costs.get(method, 1)):
+            raise RateLimitExceeded("too many calls, retry later")
+
+    def evict(self, now):
+        # The oldest buckets are first, stop at the first one still in use.
+        buckets = self.buckets
+        limit = now - self.idle_timeout
+        while buckets:
+            client, bucket = next(iter(buckets.items()))
+            if bucket.updated > limit:
+                break
+            del buckets[client]
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __repr__(self):
+        return '{}(rate={!r}, burst={!r}, clients={!r})'.format(
+            self.__class__.__name__, self.rate, self.burst, len(self.buckets))
@@ -0,0 +1,248 @@
+"""
+Event backend sharing the events between nodes through Redis pub/sub.
+
+Only the pub/sub commands of the Redis protocol (RESP) are used, so any
+server speaking them will do. Every event is published on the channel
+`prefix + topic`. A node subscribes to a channel, or to a glob pattern for
+the topic patterns with wildcards, only while it has local subscribers;
+the broker forwards nothing to the nodes that do not want it.
+
+Globs are broader than the topic patterns ("*" also matches dots), events
+that do not match a local subscription are dropped when they arrive.
+Messages start with the id of the node and a sequence number: a node skips
+its own events, and the copies Redis sends for every matching subscription.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+from collections import OrderedDict
+
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+
+from .eventbus import EventBackend
+from .events import WILDCARD_ANY, WILDCARD_ONE, split_topic
+
+__all__ = ("RedisBackend", "encode_command", "read_reply", "topic_glob")
+
+logger = logging.getLogger("jsonrpc")
+
+# Id of the node and number of the message, in front of the encoded event.
+MESSAGE_HEADER = struct.Struct("!16sQ")
+
+
+class ReplyError(Exception):
+    """An error reply of the server."""
+
+
+def encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(stream):
+    """
+    Reads one reply, error replies are returned as ReplyError.
+
+    Raises ValueError for a reply that is not valid RESP.
+    """
+    line = await stream.read_until(b"\r\n")
+    kind, value = line[:1], line[1:-2]
+    if kind == b"+":
+        return value.decode("utf-8")
+    if kind == b"-":
+        return ReplyError(value.decode("utf-8"))
+    if kind == b":":
+        return int(value)
+    if kind == b"$":
+        size = int(value)
+        if size < 0:
+            return None
+        return (await stream.read_bytes(size + 2))[:-2]
+    if kind == b"*":
+        size = int(value)
+        if size < 0:
+            return None
+        return [await read_reply(stream) for _ in range(size)]
+    raise ValueError("Invalid reply: %r" % line)
+
+
+def _escape_glob(text):
+    for char in "\\?*[]":
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def topic_glob(pattern):
+    """The Redis glob matching at least the topics of pattern, None for a concrete topic."""
+    segments = split_topic(pattern)
+    if WILDCARD_ONE not in segments and WILDCARD_ANY not in segments:
+        return None
+
+    parts = ["*" if segment == WILDCARD_ONE else _escape_glob(segment) for segment in segments]
+    if segments[-1] == WILDCARD_ANY:
+        # "#" also matches no segment at all: "a.#" matches "a".
+        return ".".join(parts[:-1]) + "*"
+    return ".".join(parts)
+
+
+class RedisBackend(EventBackend):
+    """
+    Shares the events of the Dispatchers of several nodes through Redis.
+
+    Call `connect` once the event loop runs. While the server is
+    unreachable events only reach the local subscribers, the backend
+    reconnects every `reconnect_interval` seconds and subscribes again.
+    A reply that can not be parsed is handled like a lost connection.
+    """
+
+    # Number of nodes whose last sequence number is remembered, the least
+    # recently heard from are forgotten first.
+    max_nodes = 1024
+
+    def __init__(self, host="localhost", port=6379, password=None, prefix="jsonrpc:", codec=None,
+                 reconnect_interval=1.0):
+        super().__init__(codec)
+        self.host = host
+        self.port = port
+        self.password = password
+        self.prefix = prefix
+        self.reconnect_interval = reconnect_interval
+        self.node_id = os.urandom(16)
+        self.sequence = 0
+        self.last_seen = OrderedDict()  # node id -> last sequence number received
+        # Subscribed connections can not publish, there is one of each.
+        self.publisher = None
+        self.subscriber = None
+        self.closed = False
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+
+    async def connect(self):
+        """Connects to the server, retrying until it is up."""
+        while not self.closed:
+            try:
+                publisher = await self._open()
+                try:
+                    subscriber = await self._open()
+                except (StreamClosedError, OSError):
+                    publisher.close()
+                    raise
+            except (StreamClosedError, OSError):
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            self.publisher, self.subscriber = publisher, subscriber
+            asyncio.ensure_future(self._read_replies(publisher))
+            asyncio.ensure_future(self._read_messages(subscriber))
+            for pattern in self.interest:
+                self.listen(pattern)
+            return
+
+    async def _open(self):
+        stream = await TCPClient().connect(self.host, self.port)
+        if self.password is not None:
+            stream.write(encode_command("AUTH", self.password))
+        return stream
+
+    def _command(self, pattern, subscribe):
+        glob = topic_glob(pattern)
+        if glob is None:
+            command = "SUBSCRIBE" if subscribe else "UNSUBSCRIBE"
+            return encode_command(command, self.prefix + pattern)
+        command = "PSUBSCRIBE" if subscribe else "PUNSUBSCRIBE"
+        return encode_command(command, _escape_glob(self.prefix) + glob)
+
+    def listen(self, pattern):
+        if self.subscriber is not None:
+            self.subscriber.write(self._command(pattern, True))
+
+    def unlisten(self, pattern):
+        if self.subscriber is not None:
+            self.subscriber.write(self._command(pattern, False))
+
+    def send(self, topic, data):
+        stream = self.publisher
+        if stream is None:
+            self.dropped += 1
+            return
+
+        self.sequence += 1
+        channel = (self.prefix + topic).encode("utf-8")
+        header = MESSAGE_HEADER.pack(self.node_id, self.sequence)
+        # The encoded event is written as it is, not copied into the command.
+        stream.write(b"*3\r\n$7\r\nPUBLISH\r\n$%d\r\n%s\r\n$%d\r\n%s" % (
+            len(channel), channel, len(header) + len(data), header))
+        stream.write(data)
+        stream.write(b"\r\n")
+        self.published += 1
+
+    async def _read_replies(self, stream):
+        try:
+            while True:
+                reply = await read_reply(stream)
+                if isinstance(reply, ReplyError):
+                    logger.error("event bus: %s", reply)
+        except StreamClosedError:
+            pass
+        except ValueError as error:
+            logger.error("event bus: %s", error)
+        await self._lost(stream)
+
+    async def _read_messages(self, stream):
+        try:
+            while True:
+                reply = await read_reply(stream)
+                if isinstance(reply, ReplyError):
+                    logger.error("event bus: %s", reply)
+                elif isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                    self._received(reply[1], reply[2])
+                elif isinstance(reply, list) and len(reply) == 4 and reply[0] == b"pmessage":
+                    self._received(reply[2], reply[3])
+        except StreamClosedError:
+            pass
+        except ValueError as error:
+            logger.error("event bus: %s", error)
+        await self._lost(stream)
+
+    def _received(self, channel, message):
+        if not isinstance(channel, bytes) or not isinstance(message, bytes) or len(message) < MESSAGE_HEADER.size:
+            # Not published by a backend.
+            return
+        node_id, sequence = MESSAGE_HEADER.unpack_from(message)
+        if node_id == self.node_id or sequence <= self.last_seen.get(node_id, 0):
+            return
+        self.last_seen[node_id] = sequence
+        self.last_seen.move_to_end(node_id)
+        if len(self.last_seen) > self.max_nodes:
+            self.last_seen.popitem(last=False)
+        self.received += 1
+        self.deliver(channel.decode("utf-8")[len(self.prefix):], message[MESSAGE_HEADER.size:])
+
+    async def _lost(self, stream):
+        if stream is not self.publisher and stream is not self.subscriber:
+            return
+        for connection in (self.publisher, self.subscriber):
+            connection.close()
+        self.publisher = self.subscriber = None
+        if not self.closed:
+            logger.warning("event bus: connection to the server lost, reconnecting")
+            await self.connect()
+
+    def close(self):
+        self.closed = True
+        for connection in (self.publisher, self.subscriber):
+            if connection is not None:
+                connection.close()
+        self.publisher = self.subscriber = None
+
+    def __repr__(self):
+        return '{}(host={!r}, port={!r}, connected={!r})'.format(
+            self.__class__.__name__, self.host, self.port, self.publisher is not None)
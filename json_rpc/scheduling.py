@@ -0,0 +1,155 @@
+"""
+Weighted fair scheduling of the calls between traffic classes.
+
+Calls are assigned to a class by method name, or by a `classify` function
+looking at the client. At most `concurrency` calls run at once, when they
+all are taken the calls wait in the queue of their class. A freed slot goes
+to the class with the lowest virtual start time (start-time fair queuing):
+every call started moves its class forward by 1 / weight, so under load
+the classes get slots in proportion to their weights and a class that was
+idle starts again at the current virtual time instead of using up credit.
+"""
+
+import asyncio
+import time
+from collections import deque
+
+__all__ = ("TrafficClass", "FairScheduler")
+
+
+class TrafficClass:
+    """
+    Share of a class of calls: its `weight` and the calls it may run at
+    once, `max_concurrency` (None for the whole scheduler).
+    """
+
+    def __init__(self, weight=1, max_concurrency=None):
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+
+    def __repr__(self):
+        return '{}(weight={!r}, max_concurrency={!r})'.format(
+            self.__class__.__name__, self.weight, self.max_concurrency)
+
+
+class ClassQueue:
+    __slots__ = ('name', 'weight', 'max_concurrency', 'waiters', 'running', 'finish')
+
+    def __init__(self, name, traffic_class):
+        self.name = name
+        self.weight = traffic_class.weight
+        self.max_concurrency = traffic_class.max_concurrency
+        self.waiters = deque()
+        self.running = 0
+        # Virtual finish time of the last call started.
+        self.finish = 0.0
+
+    def has_room(self):
+        return self.max_concurrency is None or self.running < self.max_concurrency
+
+
+class FairScheduler:
+    """
+    Runs the calls through weighted fair queues.
+
+    `classes` maps the class names to TrafficClass, `methods` the method
+    names to a class name. `classify(processor, request)` may return the
+    class of a call first, for example by client; calls left without one
+    go to `default`, created with weight 1 when it is not in `classes`.
+
+    Pass it as `scheduler` in the route spec. Time spent waiting in the
+    queues counts against the timeout of the call and is recorded in the
+    metrics of the handler by class.
+    """
+
+    def __init__(self, concurrency, classes=None, methods=None, classify=None, default="default"):
+        self.concurrency = concurrency
+        self.queues = {name: ClassQueue(name, traffic_class)
+                       for name, traffic_class in (classes or {}).items()}
+        if default not in self.queues:
+            self.queues[default] = ClassQueue(default, TrafficClass())
+        self.methods = methods or {}
+        self.classify = classify
+        self.default = default
+        self.running = 0
+        self.vtime = 0.0
+
+    def class_of(self, processor, request) -> ClassQueue:
+        name = self.classify(processor, request) if self.classify is not None else None
+        if name is None:
+            name = self.methods.get(request.method, self.default)
+        queue = self.queues.get(name)
+        return queue if queue is not None else self.queues[self.default]
+
+    async def run(self, processor, request, call):
+        """Awaits the call once it gets a slot."""
+        queue = self.class_of(processor, request)
+        if self.running < self.concurrency and queue.has_room() and not queue.waiters:
+            # Nothing of this class waits and a slot is free: no other class can use it.
+            self.start(queue)
+            waited = 0.0
+        else:
+            waited = await self.wait(queue, call)
+
+        if processor.metrics is not None:
+            processor.metrics.call_scheduled(queue.name, waited)
+        try:
+            return await call
+        finally:
+            self.running -= 1
+            queue.running -= 1
+            self.schedule()
+
+    async def wait(self, queue, call):
+        """Waits for the turn of the class, returns the seconds waited."""
+        start = time.perf_counter()
+        waiter = asyncio.get_event_loop().create_future()
+        queue.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                # schedule may already have dropped it.
+                if waiter in queue.waiters:
+                    queue.waiters.remove(waiter)
+            else:
+                # Cancelled after being given a slot, hand it on.
+                self.running -= 1
+                queue.running -= 1
+                self.schedule()
+            if asyncio.iscoroutine(call):
+                call.close()
+            raise
+        return time.perf_counter() - start
+
+    def start(self, queue):
+        start_tag = max(queue.finish, self.vtime)
+        queue.finish = start_tag + 1.0 / queue.weight
+        self.vtime = start_tag
+        self.running += 1
+        queue.running += 1
+
+    def schedule(self):
+        """Gives the free slots to the waiting calls, lowest virtual start time first."""
+        while self.running < self.concurrency:
+            ready = [queue for queue in self.queues.values() if queue.waiters and queue.has_room()]
+            if not ready:
+                return
+            queue = min(ready, key=lambda queue: max(queue.finish, self.vtime))
+            waiter = queue.waiters.popleft()
+            if waiter.done():
+                # Cancelled in the same iteration of the loop, it waits no more.
+                continue
+            self.start(queue)
+            waiter.set_result(None)
+
+    def stats(self):
+        """Running and queued calls of every class."""
+        return {name: {"running": queue.running, "queued": len(queue.waiters)}
+                for name, queue in self.queues.items()}
+
+    def __repr__(self):
+        return '{}(concurrency={!r}, classes={!r})'.format(
+            self.__class__.__name__, self.concurrency, sorted(self.queues))
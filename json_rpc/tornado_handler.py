@@ -1,65 +1,393 @@
-from tornado.web import RequestHandler
-from tornado.websocket import WebSocketHandler
+import asyncio
+from tornado.web import RequestHandler, stream_request_body
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
 from .processor import BasicJSONRPCProcessor
-from .jsonrpc import encode, decode
+from .jsonrpc import encode, decode, IncrementalDecoder, JSONRPCResponse
+from .exceptions import ParseError, EmptyBatchRequest
+from .codec import get_codec, negotiable_codecs
 from .dispacher import Dispatcher
+from .events import SendQueue, DROP_OLDEST
+from .metrics import CONTENT_TYPE
 import logging
 
 logger = logging.getLogger("jsonrpc")
 
+# Request header with the seconds a client is willing to wait for the response.
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+def _media_type(value):
+    return value.split(";", 1)[0].strip().lower()
+
+
+def accepted_codec(accept, codec, json_codec, offered):
+    """
+    The codec of the response to a request decoded with codec for an Accept header.
+
+    Media types are tried by decreasing quality, the first one that is the
+    content type of codec, of json_codec or of an offered codec wins.
+    Without any, the response is encoded like the request.
+    """
+    media_types = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, _, parameters = item.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            media_types.append((-quality, position, media_type.strip().lower()))
+
+    for _, _, media_type in sorted(media_types):
+        if media_type == codec.content_type or media_type == "*/*":
+            return codec
+        if media_type == json_codec.content_type:
+            return json_codec
+        if media_type in offered:
+            return offered[media_type]
+    return codec
+
 # BasicJSONRPCHandler
 
 
 class BasicJSONRPCHandler(RequestHandler, BasicJSONRPCProcessor):
-    def initialize(self, version=None):
+    # Root span of the request when it is traced.
+    trace = None
+    write_span = None
+
+    def initialize(self, version=None, batch_concurrency=1, codec=None, stream_response=False,
+                   metrics=None, middleware=None, tracer=None, rate_limiter=None, timeout=None,
+                   scheduler=None, codecs=None):
         self.version = version
+        self.batch_concurrency = batch_concurrency
+        self.codec = get_codec(codec)
+        self.codecs = negotiable_codecs(codecs)
+        self.stream_response = stream_response
+        self.metrics = metrics
+        self.middleware = middleware
+        self.tracer = tracer
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.scheduler = scheduler
+
+    def prepare(self):
+        self.trace = self.start_trace("http")
+        # The binary codecs are used when the client asks for them, JSON otherwise.
+        json_codec = self.codec
+        content_type = _media_type(self.request.headers.get("Content-Type", ""))
+        self.codec = codec = self.codecs.get(content_type, json_codec)
+        accept = self.request.headers.get("Accept")
+        if accept is not None:
+            codec = accepted_codec(accept, self.codec, json_codec, self.codecs)
+            if codec is not self.codec:
+                self.response_codec = codec
+        if codec is not json_codec:
+            self.set_header('Content-Type', codec.content_type)
+        # Seconds the client waits for the response, the calls are cancelled after.
+        client_timeout = self.request.headers.get(TIMEOUT_HEADER)
+        if client_timeout is not None:
+            try:
+                self.deadline = asyncio.get_event_loop().time() + float(client_timeout)
+            except ValueError:
+                logger.debug("invalid %s header: %r", TIMEOUT_HEADER, client_timeout)
+
+    def on_finish(self):
+        if self.trace is not None:
+            if self.write_span is not None:
+                self.write_span.finish()
+            self.trace.set("http.status_code", self.get_status())
+            self.trace.finish()
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'application/json')
 
+    def write_response(self, response):
+        if response:
+            self.write(self.encode_response(response, self.trace))
+            if self.trace is not None and self.write_span is None:
+                # Ends once the response is handed to the connection.
+                self.write_span = self.trace.child("jsonrpc.write")
+
+    async def write_batch_stream(self, pending_responses):
+        """
+        Writes the responses of a batch in the order they complete.
+
+        Every response is flushed on its own (chunked transfer encoding) so
+        the client can start reading before the slowest call is done.
+        Binary documents can not be written in pieces, they are written
+        once the whole batch is done.
+        """
+        codec = self.codec if self.response_codec is None else self.response_codec
+        if not codec.raw_json:
+            responses = await asyncio.gather(*pending_responses)
+            self.write_response([response for response in responses if response])
+            return
+
+        separator = b"["
+        for pending in asyncio.as_completed(pending_responses):
+            response = await pending
+            if not response:
+                continue
+
+            self.write(separator + self.encode_response(response, self.trace))
+            separator = b","
+            await self.flush()
+
+        # A batch of notifications is answered with nothing at all.
+        if separator == b",":
+            self.write(b"]")
+
 
 class JSONRPCHandler(BasicJSONRPCHandler):
-    def initialize(self, response_creator, version=None):
-        super().initialize(version=version)
+    def initialize(self, response_creator, version=None, batch_concurrency=1, codec=None,
+                   stream_response=False, metrics=None, middleware=None, tracer=None,
+                   rate_limiter=None, timeout=None, scheduler=None, codecs=None):
+        super().initialize(version=version, batch_concurrency=batch_concurrency, codec=codec,
+                           stream_response=stream_response, metrics=metrics, middleware=middleware,
+                           tracer=tracer, rate_limiter=rate_limiter, timeout=timeout,
+                           scheduler=scheduler, codecs=codecs)
         self.create_response = response_creator
 
     async def post(self):
-        return await self.process_jsonrpc(self.request.body)
+        if not self.stream_response:
+            response = await self.process_jsonrpc(self.request.body, self.trace)
+            self.write_response(response)
+            return
+
+        request = self.decode_jsonrpc(self.request.body, self.trace)
+        if isinstance(request, list):
+            await self.write_batch_stream(self.schedule_batch_request(request, self.trace))
+        elif request is not None and not isinstance(request, JSONRPCResponse):
+            self.write_response(await self.process_jsonrpc_call(request, self.trace))
+        else:
+            self.write_response(request)
 
     async def compute_result(self, request):
         return await self.create_response(request)
 
 
+@stream_request_body
+class StreamingJSONRPCHandler(JSONRPCHandler):
+    """
+    JSONRPCHandler decoding the body while it is received.
+
+    The members of a batch are dispatched as soon as they are decoded. At most
+    `batch_concurrency` calls run at once, reading the body is paused while
+    the window is full so the memory used does not grow with the batch size.
+    Binary bodies are only decoded once they are complete.
+    """
+
+    def initialize(self, response_creator, version=None, batch_concurrency=16, codec=None,
+                   stream_response=False, max_body_size=None, metrics=None, middleware=None,
+                   tracer=None, rate_limiter=None, timeout=None, scheduler=None, codecs=None):
+        super().initialize(response_creator, version=version, batch_concurrency=batch_concurrency,
+                           codec=codec, stream_response=stream_response, metrics=metrics,
+                           middleware=middleware, tracer=tracer, rate_limiter=rate_limiter,
+                           timeout=timeout, scheduler=scheduler, codecs=codecs)
+        self.max_body_size = max_body_size
+
+    def prepare(self):
+        super().prepare()
+        if self.max_body_size is not None:
+            self.request.connection.set_max_body_size(self.max_body_size)
+
+        if self.codec.raw_json:
+            self.decoder = IncrementalDecoder(version=self.version, codec=self.codec)
+        else:
+            self.decoder = None
+            self.chunks = []
+        self.decode_error = None
+        self.pending_calls = []
+        self.window = asyncio.Semaphore(self.batch_concurrency) if self.batch_concurrency else None
+
+    async def data_received(self, chunk):
+        if self.decoder is None:
+            self.chunks.append(chunk)
+            return
+        if self.decode_error:
+            return
+
+        try:
+            calls = self.decoder.feed(chunk)
+        except ParseError as ex:
+            self.decode_error = ex
+            return
+
+        for call in calls:
+            if self.window:
+                # Waiting here stops reading the body until a call finishes.
+                await self.window.acquire()
+            self.pending_calls.append(asyncio.ensure_future(self.process_windowed_call(call)))
+
+    async def process_windowed_call(self, call):
+        try:
+            return await self.process_jsonrpc_call(call, self.trace)
+        finally:
+            if self.window:
+                self.window.release()
+
+    async def post(self):
+        if self.decoder is None:
+            self.write_response(await self.process_jsonrpc(b"".join(self.chunks), self.trace))
+            return
+
+        try:
+            body = self.decoder.finish()
+        except (ParseError, EmptyBatchRequest) as ex:
+            self.decode_error = self.decode_error or ex
+
+        if self.decode_error:
+            # Calls already dispatched are completed even if the body turns out invalid.
+            await asyncio.gather(*self.pending_calls)
+            logger.error("decode error: %r", self.decode_error)
+            if self.metrics is not None:
+                self.metrics.request_rejected(self.decode_error.error_code)
+            self.write_response(JSONRPCResponse(self.version, exception=self.decode_error))
+            return
+
+        if not self.decoder.is_batch:
+            self.write_response(await self.process_jsonrpc(body, self.trace))
+            return
+
+        if self.metrics is not None:
+            self.metrics.batch_received(self.decoder.count)
+        if self.stream_response:
+            await self.write_batch_stream(self.pending_calls)
+        else:
+            responses = await asyncio.gather(*self.pending_calls)
+            self.write_response([response for response in responses if response])
+
+
 class BasicJSONRPCHandlerWS(WebSocketHandler, BasicJSONRPCProcessor):
-    def initialize(self, version=None):
+    """
+    Clients select a binary codec with its subprotocol ("jsonrpc.msgpack",
+    "jsonrpc.cbor"), the messages are then sent in binary frames.
+    """
+
+    def initialize(self, version=None, batch_concurrency=1, codec=None, metrics=None, middleware=None,
+                   tracer=None, rate_limiter=None, timeout=None, scheduler=None, codecs=None):
         self.version = version
+        self.batch_concurrency = batch_concurrency
+        self.codec = get_codec(codec)
+        self.codecs = negotiable_codecs(codecs)
+        self.metrics = metrics
+        self.middleware = middleware
+        self.tracer = tracer
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.scheduler = scheduler
 
     def check_origin(self, origin):
         return True
 
+    def select_subprotocol(self, subprotocols):
+        for subprotocol in subprotocols:
+            for codec in self.codecs.values():
+                if codec.subprotocol == subprotocol:
+                    self.codec = codec
+                    return subprotocol
+        return None
+
+    def write_frame(self, data):
+        return self.write_message(data, binary=self.codec.binary)
+
+    def join_messages(self, messages):
+        # The codec is only known once the subprotocol is selected.
+        return self.codec.join(messages)
+
 
 class JSONRPCHandlerWS(BasicJSONRPCHandlerWS):
+    """
+    JSON-RPC over a WebSocket, with events.
 
-    def initialize(self, dispatcher: Dispatcher, version="2.0"):
-        super().initialize(version=version)
-        self.dispatcher = dispatcher
+    Up to `max_in_flight` messages of a connection are processed at the same
+    time and every response is written as soon as it is ready, clients match
+    them by id. While the limit is reached no further message is read.
+    Calls are recorded in `metrics`, by default the ones of the dispatcher.
+
+    A running call is cancelled by calling `rpc.cancel` with its id, all of
+    them are cancelled when the connection closes.
+    """
 
-    async def open(self):
-        print("WebSocket opened", self)
-        print("check user login")
+    def initialize(self, dispatcher: Dispatcher, version="2.0", batch_concurrency=1, codec=None,
+                   send_queue_size=1000, slow_consumer_policy=DROP_OLDEST, max_in_flight=16,
+                   metrics=None, middleware=None, tracer=None, rate_limiter=None, timeout=None,
+                   scheduler=None, codecs=None):
+        super().initialize(version=version, batch_concurrency=batch_concurrency, codec=codec,
+                           metrics=metrics if metrics is not None else dispatcher.metrics,
+                           middleware=middleware, tracer=tracer, rate_limiter=rate_limiter,
+                           timeout=timeout, scheduler=scheduler, codecs=codecs)
+        self.dispatcher = dispatcher
+        self.send_queue = SendQueue(self.write_frame, max_size=send_queue_size,
+                                    policy=slow_consumer_policy, disconnect=self.close,
+                                    join=self.join_messages)
+        self.in_flight = set()
+        self.in_flight_window = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self.running_calls = {}
 
-    async def on_close(self):
-        print("WebSocket closed", self)
+    def on_close(self):
+        self.send_queue.close()
         self.dispatcher.unsubscribe_all(self)
+        # Nobody is left to read the responses.
+        for task in self.in_flight:
+            task.cancel()
 
     async def on_message(self, messagejson):
-        await self.process_jsonrpc(messagejson)
+        # Tornado reads the next message once this returns.
+        if self.in_flight_window is not None:
+            await self.in_flight_window.acquire()
+
+        task = asyncio.ensure_future(self.process_message(messagejson))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def process_message(self, messagejson):
+        trace = self.start_trace("websocket")
+        try:
+            response = await self.process_jsonrpc(messagejson, trace)
+            if response:
+                self.send_message(response, trace)
+        except WebSocketClosedError as error:
+            logger.debug("connection closed before the response was sent")
+            if trace is not None:
+                trace.error = error
+        finally:
+            if self.in_flight_window is not None:
+                self.in_flight_window.release()
+            if trace is not None:
+                trace.finish()
 
     async def compute_result(self, request):
-        print("*** compute_result", self, request)
-        r = await self.dispatcher.dispatch(self, request)
-        return r
+        return await self.dispatcher.dispatch(self, request)
+
+    def send_message(self, msg, trace=None):
+        if not isinstance(msg, (bytes, str)):
+            msg = self.encode_response(msg, trace)
+        if trace is None:
+            self.write_frame(msg)
+        else:
+            with trace.child("jsonrpc.write", size=len(msg)):
+                self.write_frame(msg)
+
+    def emit_message(self, data):
+        """Queues an encoded event, see SendQueue for slow subscribers."""
+        self.send_queue.put(data)
+
+    def emit_message_later(self, data, topic, policy):
+        """Holds an encoded event of a topic with a DeliveryPolicy."""
+        self.send_queue.put_later(data, topic, policy)
+
+
+class MetricsHandler(RequestHandler):
+    """Serves a json_rpc.metrics.Metrics in the Prometheus text format."""
+
+    def initialize(self, metrics):
+        self.metrics = metrics
 
-    def send_message(self, msg):
-        logger.debug("send_message: %r", msg)
-        self.write_message(msg)
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(self.metrics.render())
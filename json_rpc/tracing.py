@@ -0,0 +1,174 @@
+"""
+Sampled tracing of the requests.
+
+A Tracer decides once per request whether it is traced. A traced request
+gets a root span with children for decoding, validating, dispatching every
+call, encoding and writing the response. Requests that are not sampled get
+no trace at all: the processing code only checks for None.
+
+Finished traces are handed to an exporter, in memory (RingBufferExporter)
+or appended to a file (FileExporter) in the OTLP/JSON shape used by
+OpenTelemetry collectors.
+"""
+
+import json
+import random
+import time
+from collections import deque
+
+__all__ = ("Span", "Tracer", "RingBufferExporter", "FileExporter", "to_otlp")
+
+# OTLP enum values.
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_CODE_ERROR = 2
+
+
+def _now():
+    return int(time.time() * 1e9)
+
+
+class Span:
+    """
+    A timed operation of a traced request.
+
+    Spans are context managers, an exception leaving the block is recorded
+    as the error of the span.
+    """
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent', 'name', 'start', 'end', 'attributes',
+                 'error', 'spans')
+
+    def __init__(self, tracer, name, trace_id, parent=None, attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent = parent
+        self.name = name
+        self.start = _now()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+        # Every span of the trace, kept by the root.
+        self.spans = [self] if parent is None else parent.spans
+
+    def child(self, name, **attributes) -> 'Span':
+        span = Span(self.tracer, name, self.trace_id, self, attributes)
+        self.spans.append(span)
+        return span
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        if self.end is not None:
+            return
+        self.end = _now()
+        if error is not None:
+            self.error = error
+        if self.parent is None:
+            self.tracer.export(self.spans)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.finish(exc)
+
+    def toJson(self):
+        span = {"traceId": "%032x" % self.trace_id,
+                "spanId": "%016x" % self.span_id,
+                "name": self.name,
+                "kind": SPAN_KIND_SERVER if self.parent is None else SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(self.start),
+                "endTimeUnixNano": str(self.end if self.end is not None else _now()),
+                "attributes": [{"key": key, "value": _attribute_value(value)}
+                               for key, value in self.attributes.items()]}
+        if self.parent is not None:
+            span["parentSpanId"] = "%016x" % self.parent.span_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_CODE_ERROR, "message": repr(self.error)}
+        return span
+
+    def __repr__(self):
+        return '{}(name={!r}, attributes={!r})'.format(self.__class__.__name__, self.name, self.attributes)
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans, service_name="json-rpc"):
+    """The OTLP/JSON export request of the spans."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{"scope": {"name": "json_rpc"},
+                        "spans": [span.toJson() for span in spans]}],
+    }]}
+
+
+class Tracer:
+    """
+    Traces a `sample_rate` of the requests, 0 disables the tracing.
+
+    The rate can be changed while the server runs.
+    """
+
+    def __init__(self, exporter, sample_rate=1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_trace(self, name="jsonrpc.request", **attributes):
+        """Returns the root span of a new trace, None when the request is not sampled."""
+        if self.sample_rate < 1 and (not self.sample_rate or random.random() >= self.sample_rate):
+            return None
+        return Span(self, name, random.getrandbits(128), attributes=attributes)
+
+    def export(self, spans):
+        self.exporter.export(spans)
+
+    def __repr__(self):
+        return '{}(exporter={!r}, sample_rate={!r})'.format(
+            self.__class__.__name__, self.exporter, self.sample_rate)
+
+
+class RingBufferExporter:
+    """Keeps the spans of the last traces in memory, at most `size` spans."""
+
+    def __init__(self, size=10000):
+        self.buffer = deque(maxlen=size)
+
+    def export(self, spans):
+        self.buffer.extend(spans)
+
+    def spans(self) -> list:
+        return list(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
+
+    def __repr__(self):
+        return '{}(size={!r})'.format(self.__class__.__name__, self.buffer.maxlen)
+
+
+class FileExporter:
+    """Appends every trace to `path` as one line of OTLP/JSON."""
+
+    def __init__(self, path, service_name="json-rpc"):
+        self.path = path
+        self.service_name = service_name
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, spans):
+        self.file.write(json.dumps(to_otlp(spans, self.service_name), separators=(",", ":")) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __repr__(self):
+        return '{}(path={!r})'.format(self.__class__.__name__, self.path)
@@ -21,6 +21,10 @@ setuptools.setup(
     install_requires=['tornado>=5.0'],
     extras_require={
         'test': ['pytest-tornado'],
+        'orjson': ['orjson'],
+        'ujson': ['ujson'],
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
     },
     tests_require=['pytest-tornado'],
     classifiers=[
@@ -112,7 +112,7 @@ class JSONRPCHandler3(BasicJSONRPCHandler):
             return
 
         print("------ EMIT", self, message)
-        self.write(encode(message))
+        self.write(message)
 
     def set_default_headers(self):
         self.set_header('Content-Type', 'application/json')
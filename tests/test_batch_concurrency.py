@@ -0,0 +1,89 @@
+"""
+Tests for the concurrent execution of batch requests.
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from json_rpc.processor import BasicJSONRPCProcessor
+
+
+class SleepingProcessor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, batch_concurrency):
+        self.batch_concurrency = batch_concurrency
+        self.running = 0
+        self.max_running = 0
+
+    async def compute_result(self, request):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(request.params[0])
+        finally:
+            self.running -= 1
+        return request.params[0]
+
+
+def make_batch(delays, notify=()):
+    batch = []
+    for index, delay in enumerate(delays):
+        call = {"jsonrpc": "2.0", "method": "sleep", "params": [delay]}
+        if index not in notify:
+            call["id"] = index
+        batch.append(call)
+    return json.dumps(batch)
+
+
+@pytest.mark.gen_test
+def test_sequential_by_default():
+    processor = SleepingProcessor(batch_concurrency=1)
+    responses = yield processor.process_jsonrpc(make_batch([0.01] * 3))
+
+    assert [r.id for r in responses] == [0, 1, 2]
+    assert processor.max_running == 1
+
+
+@pytest.mark.gen_test
+def test_concurrent_batch_keeps_request_order():
+    processor = SleepingProcessor(batch_concurrency=None)
+    start = time.monotonic()
+    responses = yield processor.process_jsonrpc(make_batch([0.05, 0.01, 0.03] * 4))
+    elapsed = time.monotonic() - start
+
+    assert [r.id for r in responses] == list(range(12))
+    assert [r.result for r in responses] == [0.05, 0.01, 0.03] * 4
+    assert processor.max_running == 12
+    assert elapsed < 0.3
+
+
+@pytest.mark.gen_test
+def test_concurrency_limit_is_respected():
+    processor = SleepingProcessor(batch_concurrency=3)
+    responses = yield processor.process_jsonrpc(make_batch([0.01] * 10))
+
+    assert len(responses) == 10
+    assert processor.max_running == 3
+
+
+@pytest.mark.gen_test
+def test_concurrent_batch_drops_notifications():
+    processor = SleepingProcessor(batch_concurrency=4)
+    responses = yield processor.process_jsonrpc(make_batch([0.01] * 5, notify={1, 3}))
+
+    assert [r.id for r in responses] == [0, 2, 4]
+
+
+@pytest.mark.gen_test
+def test_concurrent_batch_with_invalid_member():
+    processor = SleepingProcessor(batch_concurrency=None)
+    batch = json.loads(make_batch([0.01, 0.01]))
+    batch.insert(1, 1)
+    responses = yield processor.process_jsonrpc(json.dumps(batch))
+
+    assert len(responses) == 3
+    assert responses[1].error.code == -32600
@@ -0,0 +1,250 @@
+"""
+Tests for the MessagePack and CBOR codecs and their negotiation.
+"""
+
+import json
+
+import pytest
+import tornado.web
+from tornado.websocket import websocket_connect
+
+from json_rpc.client import HTTPClient, WebSocketClient
+from json_rpc.codec import BINARY_CODECS, get_codec
+from json_rpc.dispacher import Dispatcher
+from json_rpc.eventbus import MemoryBackend
+from json_rpc.events import DeliveryPolicy
+from json_rpc.exceptions import InvalidRequest, ParseError
+from json_rpc.cache import CachePolicy
+from json_rpc.jsonrpc import EncodedResult, JSONRPCResponse, decode, encode
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS, StreamingJSONRPCHandler
+
+msgpack = pytest.importorskip("msgpack")
+
+BLOB = bytes(range(256))
+
+
+@pytest.fixture(params=sorted(BINARY_CODECS))
+def codec(request):
+    return get_codec(request.param)
+
+
+def call(method, params, id=1):
+    return {"jsonrpc": "2.0", "method": method, "params": params, "id": id}
+
+
+def test_envelope_rules_do_not_depend_on_the_codec(codec):
+    request = decode(codec.encode(call("echo", [BLOB, 1.5])), codec=codec)
+    assert (request.method, request.params, request.id) == ("echo", [BLOB, 1.5], 1)
+
+    assert isinstance(decode(codec.encode({"jsonrpc": "2.0", "id": 1}), codec=codec), InvalidRequest)
+    assert isinstance(decode(codec.encode({"jsonrpc": "3.0", "method": "m"}), codec=codec), InvalidRequest)
+    with pytest.raises(ParseError):
+        decode(codec.encode(call("echo", []))[:-3], codec=codec)
+
+    data = encode([JSONRPCResponse("2.0", id=1, result=BLOB),
+                   JSONRPCResponse("1.0", id=2, exception=InvalidRequest("nope"))], codec=codec)
+    assert codec.decode(data) == [
+        {"jsonrpc": "2.0", "id": 1, "result": BLOB},
+        {"id": 2, "result": None, "error": {"code": -32600, "message": "Invalid Request: nope"}},
+    ]
+
+
+def test_encoded_results_are_spliced(codec):
+    result = EncodedResult({"blob": BLOB})
+    data = encode([JSONRPCResponse("2.0", id=1, result=result), JSONRPCResponse("1.0", id="a", result=result)],
+                  codec=codec)
+    assert codec.decode(data) == [{"jsonrpc": "2.0", "id": 1, "result": {"blob": BLOB}},
+                                  {"id": "a", "result": {"blob": BLOB}, "error": None}]
+    assert list(result.encodings) == [codec]
+
+
+def test_maps_with_other_keys_than_strings(codec):
+    for request in ({"jsonrpc": "2.0", b"method": "echo", "id": 1}, {3: "echo", "jsonrpc": "2.0", "id": 1},
+                    call("echo", {1: "one"})):
+        assert isinstance(decode(codec.encode(request), codec=codec), InvalidRequest)
+
+
+def test_join(codec):
+    for size in (0, 3, 30, 300, 70000):
+        values = list(range(size))
+        assert codec.decode(codec.join([codec.encode(value) for value in values])) == values
+
+
+class Transport:
+    def __init__(self, codec):
+        self.codec = get_codec(codec)
+        self.messages = []
+
+    def emit_message(self, data):
+        self.messages.append(self.codec.decode(data))
+
+
+@pytest.mark.gen_test
+def test_events_are_encoded_again_for_binary_subscribers():
+    bus = MemoryBackend()
+    first, second = Dispatcher(bus=bus), Dispatcher(bus=bus)
+    for dispatcher in (first, second):
+        dispatcher.register_event("blobs")
+    local, relayed, relayed_json = Transport("msgpack"), Transport("msgpack"), Transport("json")
+    yield first.method_subscribe(local, "blobs")
+    yield second.method_subscribe(relayed, "blobs")
+    yield second.method_subscribe(relayed_json, "blobs")
+
+    yield first.emit_event("blobs", "text")
+    event = {"jsonrpc": "2.0", "notification": "blobs", "params": ["text"]}
+    assert local.messages == relayed.messages == relayed_json.messages == [event]
+
+
+class Backend:
+    async def echo(self, *params):
+        return list(params)
+
+    async def checksum(self, blob):
+        return sum(blob)
+
+    async def blob(self, size):
+        return BLOB[:size]
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    backend = Backend()
+    dispatcher.register_method(backend.echo)
+    dispatcher.register_method(backend.checksum)
+    dispatcher.register_method(backend.blob, cache=CachePolicy(max_bytes=1000))
+    dispatcher.register_event("blobs", DeliveryPolicy(batch=True, interval=0.01))
+    return dispatcher
+
+
+@pytest.fixture
+def app(dispatcher):
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch, "version": "2.0"}),
+        (r"/batches", JSONRPCHandler, {"response_creator": dispatch, "version": "2.0",
+                                       "batch_concurrency": None, "stream_response": True}),
+        (r"/streaming", StreamingJSONRPCHandler, {"response_creator": dispatch, "version": "2.0"}),
+        (r"/json-only", JSONRPCHandler, {"response_creator": dispatch, "version": "2.0", "codecs": []}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ])
+
+
+def post(http_client, base_url, path, body, **headers):
+    return http_client.fetch(base_url + path, method="POST", body=body, headers=headers,
+                             raise_error=False)
+
+
+@pytest.mark.gen_test
+def test_content_type_selects_the_codec(http_client, base_url, codec):
+    for path in ("/jsonrpc", "/streaming"):
+        response = yield post(http_client, base_url, path, codec.encode(call("echo", [BLOB, [1, 2]])),
+                              **{"Content-Type": codec.content_type})
+        assert response.headers["Content-Type"] == codec.content_type
+        assert codec.decode(response.body) == {"jsonrpc": "2.0", "id": 1, "result": [BLOB, [1, 2]]}
+
+        response = yield post(http_client, base_url, path, b"\xc1", **{"Content-Type": codec.content_type})
+        assert codec.decode(response.body)["error"]["code"] == -32700
+
+
+@pytest.mark.gen_test
+def test_invalid_members_are_answered(http_client, base_url, codec):
+    invalid = {"jsonrpc": "2.0", b"method": "echo", "id": 2}
+    response = yield post(http_client, base_url, "/jsonrpc", codec.encode(invalid),
+                          **{"Content-Type": codec.content_type})
+    assert codec.decode(response.body)["error"]["code"] == -32600
+
+    response = yield post(http_client, base_url, "/jsonrpc", codec.encode([call("echo", [1]), invalid]),
+                          **{"Content-Type": codec.content_type})
+    assert [item.get("result") for item in codec.decode(response.body)] == [[1], None]
+    assert codec.decode(response.body)[1]["error"]["code"] == -32600
+
+
+@pytest.mark.gen_test
+def test_accept_selects_the_response_codec(http_client, base_url, codec):
+    body = json.dumps(call("checksum", [[1, 2, 3]]))
+    response = yield post(http_client, base_url, "/jsonrpc", body,
+                          Accept="application/json;q=0.5, %s" % codec.content_type)
+    assert response.headers["Content-Type"] == codec.content_type
+    assert codec.decode(response.body)["result"] == 6
+
+    response = yield post(http_client, base_url, "/jsonrpc", codec.encode(call("checksum", [BLOB])),
+                          **{"Content-Type": codec.content_type, "Accept": "application/json"})
+    assert response.headers["Content-Type"] == "application/json"
+    assert json.loads(response.body)["result"] == sum(BLOB)
+
+    # Codecs that are not offered are not negotiated.
+    response = yield post(http_client, base_url, "/json-only", codec.encode(call("echo", [])),
+                          **{"Content-Type": codec.content_type, "Accept": codec.content_type})
+    assert response.headers["Content-Type"] == "application/json"
+    assert json.loads(response.body)["error"]["code"] == -32700
+
+
+@pytest.mark.gen_test
+def test_streamed_batch_is_written_whole(http_client, base_url, codec):
+    body = codec.encode([call("echo", [n], id=n) for n in range(3)])
+    response = yield post(http_client, base_url, "/batches", body, **{"Content-Type": codec.content_type})
+    assert [item["result"] for item in codec.decode(response.body)] == [[0], [1], [2]]
+
+
+@pytest.fixture
+def ws_url(http_server, base_url):
+    return base_url.replace("http", "ws") + "/ws"
+
+
+@pytest.mark.gen_test
+def test_websocket_subprotocol(ws_url, dispatcher, codec):
+    connection = yield websocket_connect(ws_url, subprotocols=["unknown", codec.subprotocol])
+    assert connection.selected_subprotocol == codec.subprotocol
+
+    connection.write_message(codec.encode(call("rpc.on", ["blobs"])), binary=True)
+    message = yield connection.read_message()
+    assert isinstance(message, bytes)
+    assert codec.decode(message)["result"] == {"blobs": "ok"}
+
+    yield dispatcher.emit_event("blobs", BLOB)
+    yield dispatcher.emit_event("blobs", 2)
+    # Batched by the delivery policy into one array.
+    message = yield connection.read_message()
+    assert [event["params"] for event in codec.decode(message)] == [[BLOB], [2]]
+    connection.close()
+
+
+@pytest.mark.gen_test
+def test_cached_bytes(http_client, base_url, ws_url, dispatcher, codec):
+    # Not encodable in JSON, the size of the entry is unknown: answered but not cached.
+    for _ in range(2):
+        response = yield post(http_client, base_url, "/jsonrpc", codec.encode(call("blob", [4])),
+                              **{"Content-Type": codec.content_type})
+        assert codec.decode(response.body)["result"] == BLOB[:4]
+    assert dispatcher.cache_stats()["blob"]["entries"] == 0
+
+    # Measured and spliced in the encoding of the connection.
+    connection = yield websocket_connect(ws_url, subprotocols=[codec.subprotocol])
+    for id in (1, 2):
+        connection.write_message(codec.encode(call("blob", [8], id=id)), binary=True)
+        message = yield connection.read_message()
+        assert codec.decode(message) == {"jsonrpc": "2.0", "id": id, "result": BLOB[:8]}
+    stats = dispatcher.cache_stats()["blob"]
+    assert (stats["entries"], stats["hits"], stats["bytes"]) == (1, 1, len(codec.encode(BLOB[:8])))
+    connection.close()
+
+
+@pytest.mark.gen_test
+def test_websocket_defaults_to_json(ws_url):
+    connection = yield websocket_connect(ws_url, subprotocols=["unknown"])
+    assert connection.selected_subprotocol is None
+    connection.write_message(json.dumps(call("echo", [1])))
+    message = yield connection.read_message()
+    assert json.loads(message)["result"] == [1]
+    connection.close()
+
+
+@pytest.mark.gen_test
+def test_clients(http_server, base_url, ws_url, codec):
+    for client in (HTTPClient(base_url + "/jsonrpc", codec=codec.name), WebSocketClient(ws_url, codec=codec)):
+        result = yield client.call("echo", BLOB)
+        assert result == [BLOB]
+        yield client.close()
@@ -0,0 +1,112 @@
+"""
+Tests for the per-method concurrency limits and load shedding.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from json_rpc.dispacher import Bulkhead, Dispatcher
+from json_rpc.exceptions import ServerOverloaded
+from json_rpc.jsonrpc import process_request
+from json_rpc.processor import BasicJSONRPCProcessor
+
+
+class Backend:
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def slow(self):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.02)
+        self.running -= 1
+        return "slow"
+
+    async def fast(self):
+        return "fast"
+
+
+def call(method, id=1):
+    return process_request({"jsonrpc": "2.0", "method": method, "id": id})
+
+
+def make_dispatcher(**options):
+    backend = Backend()
+    dispatcher = Dispatcher()
+    dispatcher.register_method(backend, name="backend", **options)
+    return dispatcher, backend
+
+
+@pytest.mark.gen_test
+def test_concurrency_is_capped():
+    dispatcher, backend = make_dispatcher(max_concurrency=2)
+
+    results = yield asyncio.gather(*[dispatcher.dispatch(None, call("backend.slow")) for _ in range(5)])
+
+    assert results == ["slow"] * 5
+    assert backend.peak == 2
+    assert dispatcher.bulkhead_stats()["backend.slow"] == {"running": 0, "queued": 0, "rejected": 0}
+
+
+@pytest.mark.gen_test
+def test_calls_beyond_the_queue_are_rejected():
+    dispatcher, backend = make_dispatcher(max_concurrency=1, max_queue=1)
+
+    results = yield asyncio.gather(*[dispatcher.dispatch(None, call("backend.slow")) for _ in range(4)],
+                                   dispatcher.dispatch(None, call("backend.fast")),
+                                   return_exceptions=True)
+
+    assert results[:2] == ["slow", "slow"]
+    assert all(isinstance(result, ServerOverloaded) for result in results[2:4])
+    # Every method has its own limits.
+    assert results[4] == "fast"
+    assert dispatcher.bulkhead_stats()["backend.slow"]["rejected"] == 2
+
+
+@pytest.mark.gen_test
+def test_cancelled_waiter_leaves_the_queue():
+    dispatcher, backend = make_dispatcher(max_concurrency=1)
+
+    first = asyncio.ensure_future(dispatcher.dispatch(None, call("backend.slow")))
+    second = asyncio.ensure_future(dispatcher.dispatch(None, call("backend.slow")))
+    yield asyncio.sleep(0)
+    assert dispatcher.bulkhead_stats()["backend.slow"]["queued"] == 1
+    second.cancel()
+
+    assert "slow" == (yield first)
+    assert dispatcher.bulkhead_stats()["backend.slow"] == {"running": 0, "queued": 0, "rejected": 0}
+
+
+@pytest.mark.gen_test
+def test_waiter_cancelled_while_the_slot_is_released():
+    bulkhead = Bulkhead(1, 10)
+    yield bulkhead.acquire("m")
+    waiting = asyncio.ensure_future(bulkhead.acquire("m"))
+    yield asyncio.sleep(0)
+
+    waiting.cancel()
+    bulkhead.release()
+    results = yield asyncio.gather(waiting, return_exceptions=True)
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert bulkhead.stats() == {"running": 0, "queued": 0, "rejected": 0}
+
+
+@pytest.mark.gen_test
+def test_overloaded_error_response():
+    dispatcher, backend = make_dispatcher(max_concurrency=1, max_queue=0)
+
+    class Processor(BasicJSONRPCProcessor):
+        version = "2.0"
+        batch_concurrency = None
+
+        async def compute_result(self, request):
+            return await dispatcher.dispatch(None, request)
+
+    body = json.dumps([{"jsonrpc": "2.0", "method": "backend.slow", "id": id} for id in (1, 2)])
+    responses = yield Processor().process_jsonrpc(body)
+
+    assert responses[0].result == "slow"
+    assert responses[1].error.code == -32004
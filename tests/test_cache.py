@@ -0,0 +1,124 @@
+"""
+Tests for caching the results of idempotent methods.
+"""
+
+import json
+import time
+
+import pytest
+
+from json_rpc.cache import CachePolicy
+from json_rpc.dispacher import Dispatcher
+from json_rpc.jsonrpc import EncodedResult, JSONRPCResponse, encode, process_request
+
+
+class Backend:
+    def __init__(self):
+        self.calls = 0
+
+    def lookup(self, key, other=None):
+        self.calls += 1
+        return {"key": key, "value": [self.calls] * 3}
+
+
+def call(method, params):
+    return process_request({"jsonrpc": "2.0", "method": method, "params": params, "id": 1})
+
+
+def make_dispatcher(**policy):
+    backend = Backend()
+    dispatcher = Dispatcher()
+    dispatcher.register_method(backend.lookup, cache=CachePolicy(**policy))
+    return dispatcher, backend
+
+
+@pytest.mark.gen_test
+def test_hits_are_served_without_calling():
+    dispatcher, backend = make_dispatcher()
+
+    first = yield dispatcher.dispatch(None, call("lookup", {"key": "a", "other": 1}))
+    second = yield dispatcher.dispatch(None, call("lookup", {"other": 1, "key": "a"}))
+    yield dispatcher.dispatch(None, call("lookup", ["b"]))
+
+    assert first is second
+    assert first.value == {"key": "a", "value": [1, 1, 1]}
+    assert backend.calls == 2
+    assert dispatcher.cache_stats()["lookup"] == {
+        "entries": 2, "bytes": 0, "hits": 1, "misses": 2, "evictions": 0, "expirations": 0}
+
+
+@pytest.mark.gen_test
+def test_ttl_expires_entries():
+    dispatcher, backend = make_dispatcher(ttl=0.05)
+
+    yield dispatcher.dispatch(None, call("lookup", ["a"]))
+    yield dispatcher.dispatch(None, call("lookup", ["a"]))
+    time.sleep(0.06)
+    yield dispatcher.dispatch(None, call("lookup", ["a"]))
+
+    assert backend.calls == 2
+    assert dispatcher.cache_stats()["lookup"]["expirations"] == 1
+
+
+@pytest.mark.gen_test
+def test_least_recently_used_entries_are_evicted():
+    dispatcher, backend = make_dispatcher(max_entries=2)
+
+    for key in ["a", "b", "a", "c", "a", "b"]:
+        yield dispatcher.dispatch(None, call("lookup", [key]))
+
+    # "b" was evicted by "c", "a" stayed because it was used.
+    assert backend.calls == 4
+    stats = dispatcher.cache_stats()["lookup"]
+    assert (stats["entries"], stats["hits"], stats["evictions"]) == (2, 2, 2)
+
+
+@pytest.mark.gen_test
+def test_max_bytes():
+    dispatcher, backend = make_dispatcher(max_entries=None, max_bytes=100)
+
+    for key in ["a", "b", "c", "d"]:
+        yield dispatcher.dispatch(None, call("lookup", [key]))
+
+    stats = dispatcher.cache_stats()["lookup"]
+    assert stats["bytes"] <= 100
+    assert stats["evictions"] == 4 - stats["entries"]
+
+
+@pytest.mark.gen_test
+def test_invalidation():
+    dispatcher, backend = make_dispatcher()
+
+    for key in ["a", "b"]:
+        yield dispatcher.dispatch(None, call("lookup", [key]))
+
+    dispatcher.invalidate_cache(prefix='lookup:["a"')
+    assert dispatcher.cache_stats()["lookup"]["entries"] == 1
+    dispatcher.invalidate_cache("lookup")
+    assert dispatcher.cache_stats()["lookup"]["entries"] == 0
+
+
+@pytest.mark.gen_test
+def test_unkeyable_params_are_not_cached():
+    dispatcher, backend = make_dispatcher()
+
+    yield dispatcher.dispatch(None, call("lookup", [{1, 2}]))
+    yield dispatcher.dispatch(None, call("lookup", [{1, 2}]))
+    assert backend.calls == 2
+
+
+def test_encoded_result_is_spliced_into_responses():
+    result = EncodedResult({"a": [1, "</b>"]})
+    responses = [JSONRPCResponse("2.0", id=1, result=result),
+                 JSONRPCResponse("1.0", id="x", result=result),
+                 JSONRPCResponse("2.0", id=2, result=3)]
+
+    assert json.loads(encode(responses, "json")) == [
+        {"jsonrpc": "2.0", "id": 1, "result": {"a": [1, "</b>"]}},
+        {"id": "x", "result": {"a": [1, "</b>"]}, "error": None},
+        {"jsonrpc": "2.0", "id": 2, "result": 3},
+    ]
+    # Encoded once per codec, reused afterwards.
+    data = result.encoded("json")
+    encode(responses[0], "json")
+    assert result.encoded("json") is data
@@ -0,0 +1,236 @@
+"""
+Tests for the HTTP and WebSocket clients.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+from tornado.websocket import WebSocketClosedError
+
+from json_rpc.client import HTTPClient, WebSocketClient, error_to_exception
+from json_rpc.dispacher import Dispatcher
+from json_rpc.exceptions import InvalidParams, InvalidResponse, JSONRPCError, MethodNotFound
+from json_rpc.jsonrpc import encode, process_response
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS
+
+
+class Backend:
+    def __init__(self):
+        self.bodies = []
+
+    async def add(self, a, b):
+        return a + b
+
+    async def echo(self, **kwargs):
+        return kwargs
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+        return delay
+
+
+class RecordingHandler(JSONRPCHandler):
+    def prepare(self):
+        self.application.settings["bodies"].append(self.request.body)
+
+
+@pytest.fixture
+def backend():
+    return Backend()
+
+
+@pytest.fixture
+def dispatcher(backend):
+    dispatcher = Dispatcher()
+    dispatcher.register_method(backend.add)
+    dispatcher.register_method(backend.echo)
+    dispatcher.register_method(backend.sleep)
+    dispatcher.register_event("ticks.#")
+    return dispatcher
+
+
+@pytest.fixture
+def app(dispatcher, backend):
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", RecordingHandler, {"response_creator": dispatch, "version": "2.0",
+                                          "batch_concurrency": None}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ], bodies=backend.bodies)
+
+
+@pytest.fixture
+def http_url(http_server, base_url):
+    return base_url + "/jsonrpc"
+
+
+@pytest.fixture
+def ws_url(http_server, base_url):
+    return base_url.replace("http", "ws") + "/ws"
+
+
+def test_requests_are_encoded():
+    client = HTTPClient("http://localhost/jsonrpc")
+    assert json.loads(encode(client.build_request("add", (1, 2), {}))) == {
+        "jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}
+    assert json.loads(encode(client.build_request("ping", (), {}, is_notification=True))) == {
+        "jsonrpc": "2.0", "method": "ping"}
+
+    client = HTTPClient("http://localhost/jsonrpc", version="1.0")
+    assert json.loads(encode(client.build_request("ping", (), {}, is_notification=True))) == {
+        "method": "ping", "params": [], "id": None}
+    with pytest.raises(ValueError):
+        client.build_request("add", (), {"a": 1})
+
+
+def test_process_response():
+    response = process_response({"jsonrpc": "2.0", "id": 1, "error": {"code": -32601, "message": "x"}})
+    assert isinstance(error_to_exception(response.error), MethodNotFound)
+    assert process_response({"jsonrpc": "2.0", "id": 1, "result": None}).result is None
+    assert isinstance(process_response({"jsonrpc": "2.0", "id": 1}), InvalidResponse)
+    assert isinstance(process_response([]), InvalidResponse)
+
+
+@pytest.mark.gen_test
+def test_http_call(http_url):
+    client = HTTPClient(http_url)
+    assert (yield client.call("add", 1, 2)) == 3
+    assert (yield client.call("echo", x=1)) == {"x": 1}
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_http_errors(http_url):
+    client = HTTPClient(http_url)
+    with pytest.raises(MethodNotFound):
+        yield client.call("missing")
+    with pytest.raises(InvalidParams):
+        yield client.call("add", 1)
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_http_connections_are_reused(http_url):
+    client = HTTPClient(http_url, max_connections=2)
+    for i in range(5):
+        assert (yield client.call("add", i, 1)) == i + 1
+    assert client.opened == 1
+
+    results = yield [client.call("sleep", 0.05) for _ in range(6)]
+    assert results == [0.05] * 6
+    assert client.opened == 2
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_http_auto_batching(http_url, backend):
+    client = HTTPClient(http_url, batch_window=0)
+    results = yield [client.call("add", i, i) for i in range(4)]
+
+    assert results == [0, 2, 4, 6]
+    assert len(backend.bodies) == 1
+    assert backend.bodies[0].startswith(b"[")
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_http_batch_with_errors_and_notifications(http_url, backend):
+    client = HTTPClient(http_url, batch_window=0.01)
+    calls = [client.call("add", 1, 1), client.call("missing"), client.notify("add", 2, 2)]
+    results = yield asyncio.gather(*calls, return_exceptions=True)
+
+    assert results[0] == 2
+    assert isinstance(results[1], MethodNotFound)
+    assert results[2] is None
+    assert len(backend.bodies) == 1
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_http_max_batch(http_url, backend):
+    client = HTTPClient(http_url, batch_window=10, max_batch=2)
+    results = yield [client.call("add", i, 0) for i in range(4)]
+
+    assert results == [0, 1, 2, 3]
+    assert len(backend.bodies) == 2
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_calls_are_multiplexed(ws_url):
+    client = WebSocketClient(ws_url)
+    results = yield [client.call("sleep", 0.05), client.call("add", 1, 2)]
+
+    assert results == [0.05, 3]
+    with pytest.raises(MethodNotFound):
+        yield client.call("missing")
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_auto_batching(ws_url):
+    client = WebSocketClient(ws_url, batch_window=0)
+    results = yield [client.call("add", i, 1) for i in range(3)]
+    assert results == [1, 2, 3]
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_subscriptions(ws_url, dispatcher):
+    client = WebSocketClient(ws_url)
+    received = []
+    yield client.subscribe("ticks.*", lambda topic, params: received.append((topic, params)))
+
+    yield dispatcher.emit_event("ticks.eur", {"price": 1})
+    yield dispatcher.emit_event("ticks.eur.bid", {"price": 2})
+    yield asyncio.sleep(0.05)
+    assert received == [("ticks.eur", [{"price": 1}])]
+
+    yield client.unsubscribe("ticks.*")
+    yield dispatcher.emit_event("ticks.eur", {"price": 3})
+    yield asyncio.sleep(0.05)
+    assert received == [("ticks.eur", [{"price": 1}])]
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_subscriptions_survive_reconnection(ws_url, dispatcher):
+    client = WebSocketClient(ws_url)
+    received = []
+    yield client.subscribe("ticks.#", lambda topic, params: received.append(topic))
+    client.connection.close()
+    yield asyncio.sleep(0.05)
+
+    yield client.connect()
+    yield asyncio.sleep(0.05)
+    yield dispatcher.emit_event("ticks.eur.bid", 1)
+    yield asyncio.sleep(0.05)
+    assert received == ["ticks.eur.bid"]
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_subscribe_unknown_event(ws_url):
+    client = WebSocketClient(ws_url)
+    with pytest.raises(JSONRPCError):
+        yield client.subscribe("missing", lambda topic, params: None)
+    assert not client.subscriptions.patterns
+    yield client.close()
+
+
+@pytest.mark.gen_test
+def test_ws_pending_calls_fail_when_closed(ws_url):
+    client = WebSocketClient(ws_url)
+    yield client.connect()
+    call = asyncio.ensure_future(client.call("sleep", 1))
+    yield asyncio.sleep(0.01)
+    client.connection.close()
+
+    with pytest.raises(WebSocketClosedError):
+        yield call
+    assert (yield client.call("add", 1, 1)) == 2
+    yield client.close()
@@ -0,0 +1,85 @@
+"""
+Tests for sharing one execution between identical calls.
+"""
+
+import asyncio
+
+import pytest
+
+from json_rpc.cache import CachePolicy
+from json_rpc.dispacher import Dispatcher
+from json_rpc.jsonrpc import process_request
+
+
+class Backend:
+    def __init__(self):
+        self.calls = 0
+
+    async def expensive(self, key):
+        self.calls += 1
+        number = self.calls
+        await asyncio.sleep(0.02)
+        if key == "fail":
+            raise ValueError("backend down")
+        return [key, number]
+
+
+def call(params):
+    return process_request({"jsonrpc": "2.0", "method": "expensive", "params": params, "id": 1})
+
+
+def make_dispatcher(**options):
+    backend = Backend()
+    dispatcher = Dispatcher()
+    dispatcher.register_method(backend.expensive, coalesce=True, **options)
+    return dispatcher, backend
+
+
+@pytest.mark.gen_test
+def test_identical_calls_share_the_execution():
+    dispatcher, backend = make_dispatcher()
+
+    results = yield asyncio.gather(*[dispatcher.dispatch(None, call(["a"])) for _ in range(10)],
+                                   dispatcher.dispatch(None, call(["b"])))
+
+    assert results == [["a", 1]] * 10 + [["b", 2]]
+    assert backend.calls == 2
+    assert dispatcher.coalesce_stats() == {"expensive": 9}
+
+    # Once finished the next call runs again.
+    assert ["a", 3] == (yield dispatcher.dispatch(None, call(["a"])))
+
+
+@pytest.mark.gen_test
+def test_errors_are_shared():
+    dispatcher, backend = make_dispatcher()
+
+    results = yield asyncio.gather(*[dispatcher.dispatch(None, call(["fail"])) for _ in range(3)],
+                                   return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert backend.calls == 1
+
+
+@pytest.mark.gen_test
+def test_cancelled_waiter_does_not_cancel_the_call():
+    dispatcher, backend = make_dispatcher()
+
+    first = asyncio.ensure_future(dispatcher.dispatch(None, call(["a"])))
+    second = asyncio.ensure_future(dispatcher.dispatch(None, call(["a"])))
+    yield asyncio.sleep(0)
+    first.cancel()
+
+    assert ["a", 1] == (yield second)
+
+
+@pytest.mark.gen_test
+def test_coalescing_with_cache():
+    dispatcher, backend = make_dispatcher(cache=CachePolicy(ttl=60))
+
+    results = yield asyncio.gather(*[dispatcher.dispatch(None, call(["a"])) for _ in range(5)])
+    cached = yield dispatcher.dispatch(None, call(["a"]))
+
+    assert all(result.value == ["a", 1] for result in results)
+    assert cached is results[0]
+    assert backend.calls == 1
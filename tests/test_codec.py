@@ -0,0 +1,84 @@
+"""
+Tests for the pluggable codecs.
+"""
+
+import json
+
+import pytest
+import tornado.web
+
+from json_rpc.codec import CODECS, StdlibCodec, get_codec
+from json_rpc.exceptions import InvalidRequest, ParseError
+from json_rpc.jsonrpc import JSONRPCEvent, JSONRPCResponse, decode, encode
+from json_rpc.tornado_handler import JSONRPCHandler
+
+
+@pytest.fixture(params=sorted(CODECS))
+def codec(request):
+    return get_codec(request.param)
+
+
+def test_auto_selection_returns_a_registered_codec():
+    assert get_codec().name in CODECS
+    assert get_codec("json") is get_codec("json")
+
+    custom = StdlibCodec()
+    assert get_codec(custom) is custom
+
+    with pytest.raises(ValueError):
+        get_codec("nope")
+
+
+def test_encode_response_objects(codec):
+    responses = [
+        JSONRPCResponse("2.0", id=1, result=[1, "</script>", None]),
+        JSONRPCResponse("1.0", id=2, exception=InvalidRequest("nope")),
+    ]
+    data = encode(responses, codec=codec)
+
+    assert isinstance(data, bytes)
+    assert json.loads(data) == [
+        {"jsonrpc": "2.0", "id": 1, "result": [1, "</script>", None]},
+        {"id": 2, "result": None, "error": {"code": -32600, "message": "Invalid Request: nope"}},
+    ]
+
+
+def test_encode_event_and_foreign_objects(codec):
+    class Point:
+        def toJson(self):
+            return {"x": 1}
+
+    data = encode(JSONRPCEvent("moved", params=(Point(), "ü")), codec=codec)
+    assert json.loads(data) == {"jsonrpc": "2.0", "notification": "moved", "params": [{"x": 1}, "ü"]}
+
+
+def test_decode_bytes(codec):
+    request = decode(b'{"jsonrpc": "2.0", "method": "sum", "params": [1, 2], "id": 3}', codec=codec)
+    assert (request.method, request.params, request.id) == ("sum", [1, 2], 3)
+
+    with pytest.raises(ParseError):
+        decode(b'{"jsonrpc": "2.0", "method"', codec=codec)
+
+    with pytest.raises(ParseError):
+        decode(b'"\xff"', codec=codec)
+
+
+@pytest.fixture
+def app():
+    async def echo(request):
+        return request.params
+
+    return tornado.web.Application([
+        (r"/jsonrpc/" + name, JSONRPCHandler, {"response_creator": echo, "codec": name})
+        for name in CODECS
+    ])
+
+
+@pytest.mark.gen_test
+def test_handler_uses_configured_codec(http_client, base_url):
+    for name in CODECS:
+        response = yield http_client.fetch(
+            base_url + "/jsonrpc/" + name, method="POST",
+            body=json.dumps({"jsonrpc": "2.0", "method": "echo", "params": ["</b>"], "id": 1}))
+
+        assert json.loads(response.body) == {"jsonrpc": "2.0", "id": 1, "result": ["</b>"]}
@@ -0,0 +1,178 @@
+"""
+Tests for the call timeouts, client deadlines and cancellation.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+from tornado.websocket import websocket_connect
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.exceptions import DeadlineExceeded
+from json_rpc.jsonrpc import process_request
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS
+
+
+class Processor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.cancelled = []
+
+    async def compute_result(self, request):
+        try:
+            await asyncio.sleep(request.params[0])
+        except asyncio.CancelledError:
+            self.cancelled.append(request.id)
+            raise
+        return "done"
+
+
+def call(method, params=(), id=1, **members):
+    return dict({"jsonrpc": "2.0", "method": method, "params": list(params), "id": id}, **members)
+
+
+def body(*calls):
+    return json.dumps(calls[0] if len(calls) == 1 else list(calls)).encode()
+
+
+@pytest.mark.gen_test
+def test_default_timeout():
+    processor = Processor(timeout=0.05)
+    responses = yield processor.process_jsonrpc(body(call("sleep", [1], 1), call("sleep", [0], 2)))
+
+    assert responses[0].error.code == -32002
+    assert responses[1].result == "done"
+    assert processor.cancelled == [1]
+
+
+@pytest.mark.gen_test
+def test_client_timeout_is_the_shorter_one():
+    processor = Processor(timeout=10)
+    response = yield processor.process_jsonrpc(body(call("sleep", [1], timeout=0.05)))
+    assert response.error.code == -32002
+
+    processor = Processor(timeout=0.05)
+    response = yield processor.process_jsonrpc(body(call("sleep", [1], timeout=10)))
+    assert response.error.code == -32002
+
+
+@pytest.mark.gen_test
+def test_passed_deadline():
+    processor = Processor()
+    processor.deadline = asyncio.get_event_loop().time() - 1
+    response = yield processor.process_jsonrpc(body(call("sleep", [0])))
+    assert response.error.code == -32002
+    assert not processor.cancelled
+
+
+def test_invalid_timeout_member():
+    for timeout in (0, -1, "1", True):
+        assert process_request(call("m", timeout=timeout)).error_code == -32600
+    assert process_request(call("m", timeout=1.5)).timeout == 1.5
+    assert process_request(call("m")).toJson() == call("m")
+    assert process_request(call("m", timeout=2)).toJson() == call("m", timeout=2)
+
+
+@pytest.mark.gen_test
+def test_cancel_call():
+    processor = Processor()
+    processor.running_calls = {}
+    pending = asyncio.ensure_future(processor.process_jsonrpc(body(call("sleep", [1], id="a"))))
+    yield asyncio.sleep(0.01)
+
+    assert list(processor.running_calls) == ["a"]
+    assert processor.cancel_call("a")
+    response = yield pending
+    assert response.error.code == -32003
+    assert processor.cancelled == ["a"]
+    assert not processor.cancel_call("a")
+    assert not processor.running_calls
+
+
+@pytest.mark.gen_test
+def test_unhashable_ids_are_not_tracked():
+    processor = Processor()
+    processor.running_calls = {}
+    response = yield processor.process_jsonrpc(body(call("sleep", [0], id=[1])))
+    assert (response.id, response.result) == ([1], "done")
+    assert not processor.running_calls
+    assert not processor.cancel_call({"id": 1})
+
+
+@pytest.mark.gen_test
+def test_method_timeout():
+    async def slow():
+        await asyncio.sleep(1)
+
+    dispatcher = Dispatcher()
+    dispatcher.register_method(slow, timeout=0.05)
+    request = process_request(call("slow"))
+    with pytest.raises(DeadlineExceeded):
+        yield dispatcher.dispatch(None, request)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.finished = []
+
+    async def sleep(seconds):
+        await asyncio.sleep(seconds)
+        dispatcher.finished.append(seconds)
+        return seconds
+
+    dispatcher.register_method(sleep)
+    return dispatcher
+
+
+@pytest.fixture
+def app(dispatcher):
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ])
+
+
+@pytest.mark.gen_test
+def test_timeout_header(http_client, base_url):
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST", body=body(call("sleep", [1])),
+                                       headers={"X-Request-Timeout": "0.05"})
+    assert json.loads(response.body)["error"]["code"] == -32002
+
+
+@pytest.mark.gen_test
+def test_rpc_cancel(http_server, base_url):
+    client = yield websocket_connect(base_url.replace("http", "ws") + "/ws")
+    client.write_message(body(call("sleep", [1], id=1)))
+    client.write_message(body(call("rpc.cancel", [1], id=2)))
+
+    responses = {}
+    for _ in range(2):
+        response = json.loads((yield client.read_message()))
+        responses[response["id"]] = response
+    assert responses[2]["result"] is True
+    assert responses[1]["error"]["code"] == -32003
+
+    client.write_message(body(call("rpc.cancel", [1], id=3)))
+    assert json.loads((yield client.read_message()))["result"] is False
+    client.close()
+
+
+@pytest.mark.gen_test
+def test_close_cancels_the_calls(http_server, base_url, dispatcher):
+    client = yield websocket_connect(base_url.replace("http", "ws") + "/ws")
+    client.write_message(body(call("sleep", [0.2], id=1)))
+    client.write_message(body(call("sleep", [0], id=2)))
+    yield client.read_message()
+    client.close()
+
+    yield asyncio.sleep(0.3)
+    assert dispatcher.finished == [0]
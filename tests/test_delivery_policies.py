@@ -0,0 +1,113 @@
+"""
+Tests for conflating and batching the notifications of busy topics.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.events import DeliveryPolicy, SendQueue
+
+
+class Socket:
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(data)
+
+
+@pytest.mark.gen_test
+def test_conflation_keeps_the_latest_message_per_topic():
+    socket = Socket()
+    queue = SendQueue(socket.send)
+    policy = DeliveryPolicy(conflate=True, interval=0.01)
+
+    for price in range(100):
+        queue.put_later(b"eur-%d" % price, "prices.eur", policy)
+        queue.put_later(b"usd-%d" % price, "prices.usd", policy)
+    yield asyncio.sleep(0.03)
+
+    assert socket.frames == [b"eur-99", b"usd-99"]
+    assert queue.conflated == 198
+
+
+@pytest.mark.gen_test
+def test_batching_sends_arrays():
+    socket = Socket()
+    queue = SendQueue(socket.send)
+    policy = DeliveryPolicy(batch=True, interval=0.01, max_batch=4)
+
+    for number in range(10):
+        queue.put_later(b"%d" % number, "progress", policy)
+    yield asyncio.sleep(0.03)
+
+    assert [json.loads(frame) for frame in socket.frames] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+
+@pytest.mark.gen_test
+def test_every_interval_is_flushed_on_its_own():
+    socket = Socket()
+    queue = SendQueue(socket.send)
+    queue.put_later(b"slow", "reports", DeliveryPolicy(conflate=True, interval=0.2))
+    queue.put_later(b"fast", "prices", DeliveryPolicy(conflate=True, interval=0.01))
+    yield asyncio.sleep(0.05)
+    assert socket.frames == [b"fast"]
+
+    # Conflated until its own interval is over.
+    queue.put_later(b"slower", "reports", DeliveryPolicy(conflate=True, interval=0.2))
+    yield asyncio.sleep(0.2)
+    assert socket.frames == [b"fast", b"slower"]
+    assert queue.conflated == 1
+
+
+@pytest.mark.gen_test
+def test_closed_queue_drops_held_messages():
+    socket = Socket()
+    queue = SendQueue(socket.send)
+    queue.put_later(b"1", "progress", DeliveryPolicy(interval=0.01))
+    queue.close()
+    yield asyncio.sleep(0.02)
+
+    assert socket.frames == []
+
+
+class Transport:
+    codec = None
+
+    def __init__(self):
+        self.queue = SendQueue(self.send)
+        self.frames = []
+
+    async def send(self, data):
+        self.frames.append(json.loads(data))
+
+    def emit_message(self, data):
+        self.queue.put(data)
+
+    def emit_message_later(self, data, topic, policy):
+        self.queue.put_later(data, topic, policy)
+
+
+@pytest.mark.gen_test
+def test_dispatcher_applies_the_most_specific_policy():
+    dispatcher = Dispatcher()
+    dispatcher.register_event("orders.#")
+    dispatcher.register_event("prices.#", policy=DeliveryPolicy(batch=True, interval=0.01))
+    dispatcher.register_event("prices.eur", policy=DeliveryPolicy(conflate=True, batch=True, interval=0.01))
+    transport = Transport()
+    yield dispatcher.method_subscribe(transport, "orders.#")
+    yield dispatcher.method_subscribe(transport, "prices.*")
+
+    for tick in range(3):
+        yield dispatcher.emit_event("prices.eur", tick)
+        yield dispatcher.emit_event("prices.usd", tick)
+    yield dispatcher.emit_event("orders.1", "new")
+    yield asyncio.sleep(0.03)
+
+    first, second = transport.frames
+    assert first == {"jsonrpc": "2.0", "notification": "orders.1", "params": ["new"]}
+    assert [(n["notification"], n["params"]) for n in second] == [
+        ("prices.usd", [0]), ("prices.usd", [1]), ("prices.eur", [2]), ("prices.usd", [2])]
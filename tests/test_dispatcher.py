@@ -0,0 +1,94 @@
+"""
+Tests for calling registered methods through the Dispatcher.
+"""
+
+import pytest
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.exceptions import InvalidParams, MethodNotFound
+from json_rpc.jsonrpc import process_request
+
+
+class Backend:
+    def subtract(self, minuend, subtrahend):
+        return minuend - subtrahend
+
+    async def greet(self, name, greeting="Hello"):
+        return "%s %s" % (greeting, name)
+
+    def _hidden(self):
+        pass
+
+
+def collect(*values, **named):
+    return [list(values), named]
+
+
+def only_named(*, key):
+    return key
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.register_method(Backend())
+    dispatcher.register_method(collect)
+    dispatcher.register_method(only_named)
+    return dispatcher
+
+
+def call(method, params=None):
+    request = {"jsonrpc": "2.0", "method": method, "id": 1}
+    if params is not None:
+        request["params"] = params
+    return process_request(request)
+
+
+@pytest.mark.gen_test
+def test_sync_and_async_methods(dispatcher):
+    assert 4 == (yield dispatcher.dispatch(None, call("Backend.subtract", [5, 1])))
+    assert 4 == (yield dispatcher.dispatch(None, call("Backend.subtract", {"minuend": 5, "subtrahend": 1})))
+    assert "Hello Bob" == (yield dispatcher.dispatch(None, call("Backend.greet", ["Bob"])))
+    assert "Hi Bob" == (yield dispatcher.dispatch(None, call("Backend.greet", {"name": "Bob", "greeting": "Hi"})))
+
+
+@pytest.mark.gen_test
+def test_variable_params(dispatcher):
+    result = yield dispatcher.dispatch(None, call("collect", [1, 2, 3]))
+    assert [[1, 2, 3], {}] == result
+    result = yield dispatcher.dispatch(None, call("collect", {"a": 1}))
+    assert [[], {"a": 1}] == result
+    result = yield dispatcher.dispatch(None, call("collect"))
+    assert [[], {}] == result
+
+
+@pytest.mark.gen_test
+def test_unknown_method(dispatcher):
+    with pytest.raises(MethodNotFound):
+        yield dispatcher.dispatch(None, call("Backend._hidden"))
+    with pytest.raises(MethodNotFound):
+        dispatcher.get_method("nope")
+
+
+@pytest.mark.parametrize("method, params", [
+    ("Backend.subtract", [1]),
+    ("Backend.subtract", [1, 2, 3]),
+    ("Backend.subtract", None),
+    ("Backend.subtract", {"minuend": 1}),
+    ("Backend.subtract", {"minuend": 1, "subtrahend": 2, "other": 3}),
+    ("Backend.greet", []),
+    ("only_named", [1]),
+    ("only_named", {}),
+])
+@pytest.mark.gen_test
+def test_invalid_params(dispatcher, method, params):
+    with pytest.raises(InvalidParams):
+        yield dispatcher.dispatch(None, call(method, params))
+
+
+def test_call_plan_is_computed_at_registration(dispatcher):
+    plan = dispatcher.get_call_plan("Backend.greet")
+    assert plan.is_async
+    assert (plan.min_positional, plan.max_positional) == (1, 2)
+    assert plan.keywords == {"name", "greeting"}
+    assert not dispatcher.get_call_plan("Backend.subtract").is_async
@@ -0,0 +1,125 @@
+"""
+Tests for delivering events to the subscribers.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+from tornado.websocket import websocket_connect
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.events import DISCONNECT, DROP_NEWEST, DROP_OLDEST, SendQueue
+from json_rpc.tornado_handler import JSONRPCHandlerWS
+
+
+class Transport:
+    codec = None
+
+    def __init__(self):
+        self.messages = []
+
+    def emit_message(self, data):
+        self.messages.append(data)
+
+
+@pytest.mark.gen_test
+def test_event_is_encoded_once():
+    dispatcher = Dispatcher()
+    dispatcher.register_event("tick")
+    transports = [Transport() for _ in range(3)]
+    for transport in transports:
+        yield dispatcher.method_subscribe(transport, "tick")
+
+    yield dispatcher.emit_event("tick", 1, "a")
+
+    data = transports[0].messages[0]
+    assert all(transport.messages[0] is data for transport in transports)
+    assert json.loads(data) == {"jsonrpc": "2.0", "notification": "tick", "params": [1, "a"]}
+
+
+class SlowSocket:
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+        self.disconnected = False
+
+    async def send(self, data):
+        await self.release.wait()
+        self.sent.append(data)
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.mark.parametrize("policy, expected", [
+    (DROP_OLDEST, [0, 3, 4]),
+    (DROP_NEWEST, [0, 1, 2]),
+])
+@pytest.mark.gen_test
+def test_full_queue_drops_messages(policy, expected):
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, max_size=2, policy=policy)
+
+    # The first message is being sent, the others wait in the queue.
+    queue.put(0)
+    yield asyncio.sleep(0)
+    for number in range(1, 5):
+        queue.put(number)
+    assert queue.dropped == 2
+
+    socket.release.set()
+    yield asyncio.sleep(0.01)
+    assert socket.sent == expected
+
+
+@pytest.mark.gen_test
+def test_full_queue_disconnects_slow_consumer():
+    socket = SlowSocket()
+    queue = SendQueue(socket.send, max_size=2, policy=DISCONNECT, disconnect=socket.disconnect)
+
+    assert queue.put(0)
+    yield asyncio.sleep(0)
+    assert queue.put(1) and queue.put(2)
+    assert not queue.put(3)
+    assert socket.disconnected
+    assert not queue.put(4)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = Dispatcher()
+    dispatcher.register_event("tick")
+    return dispatcher
+
+
+@pytest.fixture
+def app(dispatcher):
+    return tornado.web.Application([
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ])
+
+
+@pytest.mark.gen_test
+def test_websocket_subscribers_receive_events(http_server, base_url, dispatcher):
+    url = base_url.replace("http", "ws") + "/ws"
+    clients = []
+    for _ in range(2):
+        client = yield websocket_connect(url)
+        client.write_message(json.dumps({"jsonrpc": "2.0", "method": "rpc.on", "params": ["tick"], "id": 1}))
+        clients.append(client)
+
+    for _ in range(20):
+        if len(dispatcher.EVENTS.get("tick", ())) == 2:
+            break
+        yield asyncio.sleep(0.01)
+
+    yield dispatcher.emit_event("tick", 42)
+
+    for client in clients:
+        subscribed = yield client.read_message()
+        assert json.loads(subscribed) == {"jsonrpc": "2.0", "id": 1, "result": {"tick": "ok"}}
+        message = yield client.read_message()
+        assert json.loads(message) == {"jsonrpc": "2.0", "notification": "tick", "params": [42]}
+        client.close()
@@ -0,0 +1,73 @@
+"""
+Tests for running synchronous methods in thread pools.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.exceptions import InvalidParams
+from json_rpc.jsonrpc import process_request
+
+
+def current_thread(delay=0):
+    time.sleep(delay)
+    return threading.current_thread().name
+
+
+def call(method, params=None):
+    return process_request({"jsonrpc": "2.0", "method": method, "params": params or [], "id": 1})
+
+
+@pytest.mark.gen_test
+def test_sync_methods_are_inline_by_default():
+    dispatcher = Dispatcher()
+    dispatcher.register_method(current_thread)
+
+    assert threading.current_thread().name == (yield dispatcher.dispatch(None, call("current_thread")))
+    assert dispatcher.executor_stats() == {}
+
+
+@pytest.mark.gen_test
+def test_method_registered_in_thread_pool():
+    dispatcher = Dispatcher(thread_pool_size=2)
+    dispatcher.register_method(current_thread, executor="threads")
+    dispatcher.register_method(current_thread, name="inline", executor="inline")
+
+    name = yield dispatcher.dispatch(None, call("current_thread"))
+    assert name.startswith("jsonrpc-threads")
+    assert threading.current_thread().name == (yield dispatcher.dispatch(None, call("inline")))
+
+    with pytest.raises(InvalidParams):
+        yield dispatcher.dispatch(None, call("current_thread", [1, 2]))
+
+    dispatcher.shutdown_executors()
+
+
+@pytest.mark.gen_test
+def test_default_executor_and_queue_stats():
+    dispatcher = Dispatcher(executor="db")
+    dispatcher.add_executor("db", max_workers=2)
+    dispatcher.register_method(current_thread)
+
+    start = time.monotonic()
+    names = yield asyncio.gather(*[dispatcher.dispatch(None, call("current_thread", [0.05]))
+                                   for _ in range(6)])
+    elapsed = time.monotonic() - start
+
+    assert all(name.startswith("jsonrpc-db") for name in names)
+    assert 0.15 <= elapsed < 0.5
+    stats = dispatcher.executor_stats()["db"]
+    assert stats.pop("max_queued") >= 4
+    assert stats == {"workers": 2, "queued": 0, "running": 0, "completed": 6}
+
+    dispatcher.shutdown_executors()
+
+
+def test_unknown_executor():
+    dispatcher = Dispatcher()
+    with pytest.raises(ValueError):
+        dispatcher.register_method(current_thread, executor="nope")
@@ -0,0 +1,152 @@
+"""
+Tests for the metrics of the calls, batches and subscriptions.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.metrics import UNKNOWN_METHOD, Histogram, Metrics
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.tornado_handler import JSONRPCHandler, MetricsHandler
+
+
+async def add(a, b):
+    return a + b
+
+
+async def fail():
+    raise RuntimeError("boom")
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+@pytest.fixture
+def dispatcher(metrics):
+    dispatcher = Dispatcher(metrics=metrics)
+    dispatcher.register_method(add)
+    dispatcher.register_method(fail)
+    dispatcher.register_event("ticks.#")
+    return dispatcher
+
+
+@pytest.fixture
+def app(dispatcher, metrics):
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch, "version": "2.0", "metrics": metrics}),
+        (r"/metrics", MetricsHandler, {"metrics": metrics}),
+    ])
+
+
+def call(method, params, id=1):
+    return {"jsonrpc": "2.0", "method": method, "params": params, "id": id}
+
+
+def post(http_client, base_url, body):
+    return http_client.fetch(base_url + "/jsonrpc", method="POST", body=json.dumps(body))
+
+
+def test_histogram_buckets():
+    histogram = Histogram((1, 5, 10))
+    for value in (0.5, 1, 3, 10, 50):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1, 1]
+    assert list(histogram.cumulative()) == [("1", 2), ("5", 3), ("10", 4), ("+Inf", 5)]
+    assert (histogram.count, histogram.sum) == (5, 64.5)
+
+
+def test_unknown_methods_share_a_series(metrics):
+    for name in ("nope", "other"):
+        start = metrics.call_started(name)
+        metrics.call_finished(name, start, -32601)
+
+    assert list(metrics.methods) == [UNKNOWN_METHOD]
+    assert metrics.methods[UNKNOWN_METHOD].calls == 2
+    assert metrics.methods[UNKNOWN_METHOD].errors == {-32601: 2}
+
+
+def test_failing_unknown_names_get_no_series(metrics):
+    # Rejected by a rate limiter, timed out...
+    for name in ("made", "up", "names"):
+        start = metrics.call_started(name)
+        metrics.call_finished(name, start, -32001)
+    assert list(metrics.methods) == [UNKNOWN_METHOD]
+    assert metrics.methods[UNKNOWN_METHOD].errors == {-32001: 3}
+    assert metrics.methods[UNKNOWN_METHOD].in_flight == 0
+
+    # Known once a call succeeded.
+    for error_code in (None, -32001):
+        start = metrics.call_started("made")
+        metrics.call_finished("made", start, error_code)
+    assert metrics.methods["made"].calls == 2
+    assert metrics.methods["made"].errors == {-32001: 1}
+
+
+@pytest.mark.gen_test
+def test_calls_are_recorded(http_client, base_url, metrics):
+    yield post(http_client, base_url, call("add", [1, 2]))
+    yield post(http_client, base_url, [call("add", [1], 1), call("fail", [], 2), call("nope", [], 3),
+                                       {"jsonrpc": "2.0", "id": 4}])
+
+    add_stats = metrics.methods["add"]
+    assert (add_stats.calls, add_stats.in_flight, add_stats.errors) == (2, 0, {-32602: 1})
+    assert add_stats.latency.count == 2
+    assert metrics.methods["fail"].errors == {-32603: 1}
+    assert metrics.methods[UNKNOWN_METHOD].calls == 1
+    assert metrics.rejected == {-32600: 1}
+    assert metrics.batch_sizes.count == 1 and metrics.batch_sizes.sum == 4
+
+
+@pytest.mark.gen_test
+def test_in_flight_gauge(metrics):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await release.wait()
+
+    dispatcher = Dispatcher(metrics=metrics)
+    dispatcher.register_method(slow)
+
+    class Processor(BasicJSONRPCProcessor):
+        async def compute_result(self, request):
+            return await dispatcher.dispatch(None, request)
+
+    processor = Processor()
+    processor.metrics = metrics
+    pending = asyncio.ensure_future(processor.process_jsonrpc(json.dumps(call("slow", []))))
+    yield started.wait()
+    assert metrics.methods["slow"].in_flight == 1
+
+    release.set()
+    yield pending
+    assert metrics.methods["slow"].in_flight == 0
+
+
+@pytest.mark.gen_test
+def test_prometheus_exposition(http_client, base_url, dispatcher):
+    yield post(http_client, base_url, call("add", [1, 2]))
+    yield dispatcher.method_subscribe(object(), "ticks.*")
+    yield dispatcher.emit_event("ticks.eur", 1)
+
+    response = yield http_client.fetch(base_url + "/metrics")
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.body.decode()
+    assert 'jsonrpc_calls_total{method="add"} 1' in text
+    assert 'jsonrpc_call_duration_seconds_bucket{method="add",le="+Inf"} 1' in text
+    assert 'jsonrpc_call_duration_seconds_count{method="add"} 1' in text
+    assert 'jsonrpc_calls_in_flight{method="add"} 0' in text
+    assert 'jsonrpc_subscribers{topic="ticks.*"} 1' in text
+    assert "jsonrpc_events_total 1" in text
+    assert "# TYPE jsonrpc_batch_size histogram" in text
@@ -0,0 +1,218 @@
+"""
+Tests for the middleware chain and the sampled profiling.
+"""
+
+import asyncio
+import json
+import os
+import pstats
+
+import pytest
+
+from json_rpc.cache import CachePolicy
+from json_rpc.dispacher import Dispatcher
+from json_rpc.exceptions import InvalidParams, MethodNotFound
+from json_rpc.jsonrpc import EncodedResult
+from json_rpc.middleware import Middleware, MiddlewareChain
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.profiling import STACK_SAMPLER, ProfilingMiddleware, StackSampler
+
+
+class Processor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+
+    async def compute_result(self, request):
+        if request.method == "fail":
+            raise ValueError("boom")
+        if request.method == "busy":
+            total = 0
+            for i in range(200000):
+                total += i
+            await asyncio.sleep(0.02)
+            return total
+        return request.params
+
+
+class Recorder(Middleware):
+    def __init__(self, name, events):
+        self.name = name
+        self.events = events
+
+    async def before_dispatch(self, processor, request):
+        self.events.append((self.name, "before", request.method))
+
+    async def after_dispatch(self, processor, request, result):
+        self.events.append((self.name, "after", request.method))
+        return result + [self.name]
+
+    async def on_error(self, processor, request, error):
+        self.events.append((self.name, "error", repr(error)))
+
+
+class Guard(Middleware):
+    async def before_dispatch(self, processor, request):
+        if request.params == ["forbidden"]:
+            raise InvalidParams("forbidden")
+
+
+class Upper(Middleware):
+    def before_decode(self, processor, body):
+        return body.replace(b"echo", b"ECHO")
+
+
+def call(method, params=(), id=1):
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": list(params), "id": id}).encode()
+
+
+@pytest.mark.gen_test
+def test_hooks_run_in_order():
+    events = []
+    processor = Processor(MiddlewareChain([Recorder("outer", events), Recorder("inner", events)]))
+
+    response = yield processor.process_jsonrpc(call("echo", [1]))
+    assert response.result == [1, "inner", "outer"]
+    assert events == [("outer", "before", "echo"), ("inner", "before", "echo"),
+                      ("inner", "after", "echo"), ("outer", "after", "echo")]
+
+
+@pytest.mark.gen_test
+def test_on_error_sees_the_error():
+    events = []
+    processor = Processor(MiddlewareChain([Recorder("outer", events)]))
+
+    response = yield processor.process_jsonrpc(call("fail"))
+    assert response.error.code == -32603
+    assert events[-1] == ("outer", "error", "ValueError('boom')")
+
+
+@pytest.mark.gen_test
+def test_before_dispatch_can_refuse():
+    processor = Processor(MiddlewareChain([Guard()]))
+
+    response = yield processor.process_jsonrpc(call("echo", ["forbidden"]))
+    assert response.error.code == -32602
+    response = yield processor.process_jsonrpc(call("echo", ["ok"]))
+    assert response.result == ["ok"]
+
+
+@pytest.mark.gen_test
+def test_before_decode():
+    chain = MiddlewareChain([Upper()])
+    response = yield Processor(chain).process_jsonrpc(call("echo", ["echo"]))
+    assert response.result == ["ECHO"]
+
+
+@pytest.mark.gen_test
+def test_after_dispatch_sees_cached_values():
+    dispatcher = Dispatcher()
+    dispatcher.register_method(lambda key: {"key": key}, name="lookup", cache=CachePolicy())
+    seen = []
+
+    class Seen(Middleware):
+        async def after_dispatch(self, processor, request, result):
+            seen.append(result)
+            return result
+
+    class Dispatching(Processor):
+        async def compute_result(self, request):
+            return await dispatcher.dispatch(None, request)
+
+    processor = Dispatching(MiddlewareChain([Seen()]))
+    for _ in range(2):
+        response = yield processor.process_jsonrpc(call("lookup", ["a"]))
+    assert seen == [{"key": "a"}] * 2
+    # Returned unchanged, the hit is still answered with the encoded result.
+    assert isinstance(response.result, EncodedResult)
+
+
+def test_chain_is_compiled():
+    chain = MiddlewareChain()
+    assert chain.before_decode is None
+    assert chain.call.__name__ == "_compute"
+
+    # Middlewares without dispatch hooks add no layer.
+    chain.add(Upper())
+    assert chain.call.__name__ == "_compute"
+    assert chain.before_decode is not None
+
+    chain.add(Guard())
+    assert chain.call.__name__ == "call"
+    chain.remove(chain.middlewares[-1])
+    assert chain.call.__name__ == "_compute"
+
+
+@pytest.mark.gen_test
+def test_profiling_samples(tmpdir):
+    profiler = ProfilingMiddleware(sample_rate=1.0)
+    processor = Processor(MiddlewareChain([profiler]))
+
+    yield processor.process_jsonrpc(call("busy"))
+    yield processor.process_jsonrpc(call("busy"))
+    yield processor.process_jsonrpc(call("echo", [1]))
+
+    assert profiler.samples == {"busy": 2, "echo": 1}
+    assert isinstance(profiler.profiles["busy"], pstats.Stats)
+    paths = profiler.save(str(tmpdir))
+    assert sorted(os.path.basename(path) for path in paths) == ["busy.prof", "echo.prof"]
+
+
+@pytest.mark.gen_test
+def test_profiling_skips_unknown_methods(tmpdir):
+    class Dispatching(Processor):
+        async def compute_result(self, request):
+            if request.method not in ("echo", "a/b", "a:b", "a\\b", "../up"):
+                raise MethodNotFound(request.method)
+            return request.params
+
+    for kind in (None, STACK_SAMPLER):
+        options = {} if kind is None else {"profiler": kind}
+        profiler = ProfilingMiddleware(sample_rate=1.0, **options)
+        processor = Dispatching(MiddlewareChain([profiler]))
+        for method in ("made", "up", "echo"):
+            response = yield processor.process_jsonrpc(call(method))
+        assert response.result == []
+        assert profiler.samples == {"echo": 1}
+
+    for method in ("a/b", "a:b", "../up", "a\\b"):
+        yield processor.process_jsonrpc(call(method))
+    paths = profiler.save(str(tmpdir))
+    assert sorted(os.path.basename(path) for path in paths) == [
+        "_up.folded", "a_b-2.folded", "a_b-3.folded", "a_b.folded", "echo.folded"]
+
+
+@pytest.mark.gen_test
+def test_profiling_filters():
+    profiler = ProfilingMiddleware(sample_rate=1.0, methods=["busy"])
+    processor = Processor(MiddlewareChain([profiler]))
+    yield processor.process_jsonrpc(call("echo", [1]))
+    assert not profiler.samples
+
+    profiler.sample_rate = 0
+    yield processor.process_jsonrpc(call("busy"))
+    assert not profiler.samples
+
+
+@pytest.mark.gen_test
+def test_stack_sampler_profiles(tmpdir):
+    profiler = ProfilingMiddleware(sample_rate=1.0, profiler=STACK_SAMPLER, interval=0.001)
+    processor = Processor(MiddlewareChain([profiler]))
+
+    yield processor.process_jsonrpc(call("busy"))
+    assert profiler.samples == {"busy": 1}
+    paths = profiler.save(str(tmpdir))
+    assert [os.path.basename(path) for path in paths] == ["busy.folded"]
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    total = 0
+    for i in range(2000000):
+        total += i
+    stacks = sampler.stop()
+
+    assert sum(stacks.values()) > 0
+    assert any("test_stack_sampler" in stack for stack in stacks)
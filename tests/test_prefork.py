@@ -0,0 +1,166 @@
+"""
+Tests for the event bus between worker processes.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import textwrap
+
+import pytest
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.prefork import EventBroker, EventBus
+
+
+class Transport:
+    def __init__(self, codec=None):
+        self.codec = codec
+        self.messages = []
+
+    def emit_message(self, data):
+        self.messages.append(data)
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def make_worker(path):
+    bus = EventBus(path, reconnect_interval=0.01)
+    dispatcher = Dispatcher(bus=bus)
+    dispatcher.register_event("ticks.#")
+    transport = Transport()
+    dispatcher.SUBSCRIPTIONS.add("ticks.#", transport)
+    return dispatcher, bus, transport
+
+
+@pytest.mark.gen_test
+def test_events_reach_the_other_workers(tmpdir):
+    path = str(tmpdir.join("bus.sock"))
+    workers = [make_worker(path) for _ in range(3)]
+    # The workers wait for the broker.
+    connecting = [asyncio.ensure_future(bus.connect()) for _, bus, _ in workers]
+    yield asyncio.sleep(0.02)
+    broker = EventBroker(path)
+    broker.listen()
+    yield asyncio.gather(*connecting)
+    yield wait_for(lambda: len(broker.streams) == 3)
+
+    first, second, third = workers
+    yield first[0].emit_event("ticks.eur", 1.5)
+    yield wait_for(lambda: second[2].messages and third[2].messages)
+
+    data = first[2].messages[0]
+    assert json.loads(data) == {"jsonrpc": "2.0", "notification": "ticks.eur", "params": [1.5]}
+    # The same bytes everywhere, the emitting worker gets it once.
+    assert [transport.messages for _, _, transport in workers] == [[data]] * 3
+    assert first[1].published == 1 and second[1].received == 1
+
+    for _, bus, _ in workers:
+        bus.close()
+    broker.stop()
+
+
+@pytest.mark.gen_test
+def test_bus_reconnects(tmpdir):
+    path = str(tmpdir.join("bus.sock"))
+    broker = EventBroker(path)
+    broker.listen()
+    (sender, sender_bus, _), (receiver, receiver_bus, transport) = make_worker(path), make_worker(path)
+    yield sender_bus.connect()
+    yield receiver_bus.connect()
+
+    for stream in broker.streams:
+        stream.close()
+    yield wait_for(lambda: len(broker.streams) == 2 and sender_bus.stream and receiver_bus.stream)
+
+    yield sender.emit_event("ticks.usd", 2)
+    yield wait_for(lambda: transport.messages)
+    sender_bus.close()
+    receiver_bus.close()
+    broker.stop()
+
+
+SERVER = """
+import sys
+from json_rpc.dispacher import Dispatcher
+from json_rpc.prefork import serve
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS
+import tornado.web
+
+
+def make_app(bus):
+    dispatcher = Dispatcher(bus=bus)
+    dispatcher.register_event("ticks.#")
+
+    async def emit(topic):
+        await dispatcher.emit_event(topic, 1)
+        return "ok"
+
+    dispatcher.register_method(emit)
+
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher}),
+    ])
+
+
+serve(make_app, int(sys.argv[1]), "127.0.0.1", workers=2, bus_path=sys.argv[2])
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+@pytest.mark.gen_test(timeout=20)
+def test_serve(tmpdir):
+    script = tmpdir.join("server.py")
+    script.write(textwrap.dedent(SERVER))
+    port = free_port()
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    server = subprocess.Popen([sys.executable, str(script), str(port), str(tmpdir.join("bus.sock"))],
+                              env=env, start_new_session=True)
+    try:
+        clients = []
+        for _ in range(50):
+            try:
+                clients.append((yield websocket_connect("ws://127.0.0.1:%d/ws" % port)))
+                break
+            except OSError:
+                yield asyncio.sleep(0.1)
+        # Some of the connections land on each worker.
+        for _ in range(7):
+            clients.append((yield websocket_connect("ws://127.0.0.1:%d/ws" % port)))
+        for client in clients:
+            client.write_message(json.dumps({"jsonrpc": "2.0", "method": "rpc.on", "params": ["ticks.#"],
+                                             "id": 1}))
+            yield client.read_message()
+        # The workers retry connecting to the broker once a second.
+        yield asyncio.sleep(1.2)
+
+        body = json.dumps({"jsonrpc": "2.0", "method": "emit", "params": ["ticks.eur"], "id": 1})
+        yield AsyncHTTPClient().fetch("http://127.0.0.1:%d/jsonrpc" % port, method="POST", body=body)
+        for client in clients:
+            message = yield asyncio.wait_for(client.read_message(), 5)
+            assert json.loads(message)["notification"] == "ticks.eur"
+            client.close()
+    finally:
+        os.killpg(server.pid, 15)
+        server.wait()
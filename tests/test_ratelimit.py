@@ -0,0 +1,123 @@
+"""
+Tests for the per-client rate limiting.
+"""
+
+import json
+
+import pytest
+import tornado.web
+
+from json_rpc.exceptions import RateLimitExceeded
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.ratelimit import RateLimiter, header
+from json_rpc.tornado_handler import JSONRPCHandler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_limiter(clock, **kwargs):
+    limiter = RateLimiter(**kwargs)
+    limiter.clock = clock
+    return limiter
+
+
+class Processor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, rate_limiter):
+        self.rate_limiter = rate_limiter
+        self.calls = 0
+
+    async def compute_result(self, request):
+        self.calls += 1
+        return "ok"
+
+
+def test_bucket_refills(clock):
+    limiter = make_limiter(clock, rate=2, burst=4)
+    assert [limiter.acquire("a") for _ in range(5)] == [True] * 4 + [False]
+
+    clock.now += 0.5
+    assert limiter.acquire("a")
+    assert not limiter.acquire("a")
+    assert limiter.acquire("b")
+    assert limiter.rejected == 2
+
+
+def test_rate_must_be_positive():
+    for rate in (0, -1):
+        with pytest.raises(ValueError):
+            RateLimiter(rate)
+
+
+def test_costs(clock):
+    limiter = make_limiter(clock, rate=1, burst=10, identify=lambda processor: "a", costs={"report": 6})
+    limiter.check(None, "report")
+    with pytest.raises(RateLimitExceeded):
+        limiter.check(None, "report")
+    limiter.check(None, "cheap")
+
+
+def test_idle_clients_are_evicted(clock):
+    limiter = make_limiter(clock, rate=1, burst=5)
+    limiter.acquire("a")
+    clock.now += 3
+    limiter.acquire("b")
+    assert list(limiter.buckets) == ["a", "b"]
+
+    clock.now += 2.5
+    limiter.acquire("b")
+    assert list(limiter.buckets) == ["b"]
+
+
+def test_max_clients(clock):
+    limiter = make_limiter(clock, rate=1, burst=5, max_clients=2)
+    for client in "abc":
+        limiter.acquire(client)
+    limiter.acquire("b")
+    limiter.acquire("d")
+    assert list(limiter.buckets) == ["b", "d"]
+
+
+@pytest.mark.gen_test
+def test_rejected_before_the_method_runs(clock):
+    processor = Processor(make_limiter(clock, rate=1, burst=2, identify=lambda processor: "a"))
+    body = json.dumps([{"jsonrpc": "2.0", "method": "m", "id": id} for id in range(3)])
+    responses = yield processor.process_jsonrpc(body)
+
+    assert [response.error for response in responses[:2]] == [None, None]
+    assert responses[2].error.code == -32001
+    assert processor.calls == 2
+
+
+@pytest.fixture
+def app():
+    async def respond(request):
+        return "ok"
+
+    limiter = RateLimiter(rate=0.001, burst=1, identify=header("X-Token"))
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": respond, "rate_limiter": limiter}),
+    ])
+
+
+@pytest.mark.gen_test
+def test_clients_are_identified_by_the_handler(http_client, base_url):
+    def post(token):
+        return http_client.fetch(base_url + "/jsonrpc", method="POST", headers={"X-Token": token},
+                                 body=json.dumps({"jsonrpc": "2.0", "method": "m", "id": 1}))
+
+    assert "result" in json.loads((yield post("a")).body)
+    assert json.loads((yield post("a")).body)["error"]["code"] == -32001
+    assert "result" in json.loads((yield post("b")).body)
@@ -0,0 +1,228 @@
+"""
+Tests for the event backends, the Redis one against a local stand-in server.
+"""
+
+import asyncio
+import json
+from fnmatch import fnmatchcase
+
+import pytest
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
+from tornado.tcpserver import TCPServer
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.eventbus import MemoryBackend
+from json_rpc.redisbus import MESSAGE_HEADER, RedisBackend, encode_command, read_reply, topic_glob
+
+
+class StandInRedis(TCPServer):
+    """The pub/sub commands of Redis, sending a copy per matching subscription like it does."""
+
+    def __init__(self):
+        super().__init__()
+        self.channels = {}  # stream -> set of channels
+        self.patterns = {}  # stream -> set of globs
+        self.commands = []
+        self.forwarded = 0
+
+    async def handle_stream(self, stream, address):
+        self.channels[stream] = set()
+        self.patterns[stream] = set()
+        try:
+            while True:
+                command = await read_reply(stream)
+                name, args = command[0].decode().upper(), command[1:]
+                self.commands.append((name, args))
+                if name in ("SUBSCRIBE", "PSUBSCRIBE"):
+                    subscriptions = self.channels if name == "SUBSCRIBE" else self.patterns
+                    for arg in args:
+                        subscriptions[stream].add(arg)
+                        stream.write(encode_command(name.lower(), arg))
+                elif name in ("UNSUBSCRIBE", "PUNSUBSCRIBE"):
+                    subscriptions = self.channels if name == "UNSUBSCRIBE" else self.patterns
+                    for arg in args:
+                        subscriptions[stream].discard(arg)
+                elif name == "PUBLISH":
+                    stream.write(b":%d\r\n" % self.publish(*args))
+                else:
+                    stream.write(b"-ERR unknown command\r\n")
+        except StreamClosedError:
+            pass
+        finally:
+            del self.channels[stream], self.patterns[stream]
+
+    def publish(self, channel, message):
+        receivers = 0
+        for stream, channels in list(self.channels.items()):
+            if channel in channels:
+                stream.write(encode_command("message", channel, message))
+                receivers += 1
+        for stream, patterns in list(self.patterns.items()):
+            for pattern in patterns:
+                if fnmatchcase(channel.decode(), pattern.decode().replace("\\", "")):
+                    stream.write(encode_command("pmessage", pattern, channel, message))
+                    receivers += 1
+        self.forwarded += receivers
+        return receivers
+
+
+class Transport:
+    def __init__(self):
+        self.codec = None
+        self.messages = []
+
+    def emit_message(self, data):
+        self.messages.append(json.loads(data))
+
+
+async def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def make_node(bus):
+    dispatcher = Dispatcher(bus=bus)
+    dispatcher.register_event("ticks.#")
+    return dispatcher
+
+
+def topics(transport):
+    return [message["notification"] for message in transport.messages]
+
+
+@pytest.fixture
+def server(io_loop):
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = StandInRedis()
+    server.add_sockets(sockets)
+    server.port = sockets[0].getsockname()[1]
+    yield server
+    server.stop()
+
+
+def test_topic_glob():
+    assert topic_glob("ticks.eur") is None
+    assert topic_glob("ticks.*.bid") == "ticks.*.bid"
+    assert topic_glob("ticks.#") == "ticks*"
+    assert topic_glob("#") == "*"
+    assert topic_glob("a[1].*") == "a\\[1\\].*"
+
+
+@pytest.mark.gen_test
+def test_memory_backend_counts_the_subscriptions():
+    bus = MemoryBackend()
+    first, second = make_node(bus), make_node(bus)
+    transport, other = Transport(), Transport()
+
+    yield second.method_subscribe(transport, "ticks.#")
+    yield second.method_subscribe(other, "ticks.#")
+    assert bus.interest == {"ticks.#": 2}
+
+    yield first.emit_event("ticks.eur", 1)
+    assert topics(transport) == topics(other) == ["ticks.eur"]
+
+    yield second.method_unsubscribe(transport, "ticks.#")
+    second.unsubscribe_all(other)
+    assert bus.interest == {}
+
+
+@pytest.mark.gen_test
+def test_events_follow_the_subscriptions(server):
+    nodes = []
+    for _ in range(3):
+        bus = RedisBackend("127.0.0.1", server.port, reconnect_interval=0.01)
+        yield bus.connect()
+        nodes.append((make_node(bus), bus))
+    (first, first_bus), (second, second_bus), (third, third_bus) = nodes
+
+    eur, everything, local = Transport(), Transport(), Transport()
+    yield second.method_subscribe(eur, "ticks.eur")
+    yield second.method_subscribe(everything, "ticks.#")
+    yield first.method_subscribe(local, "ticks.#")
+    yield wait_for(lambda: len(server.commands) == 3)
+    assert sorted(server.commands) == [("PSUBSCRIBE", [b"jsonrpc:ticks*"])] * 2 + [
+        ("SUBSCRIBE", [b"jsonrpc:ticks.eur"])]
+
+    # Matches the glob of "ticks.#" but not the pattern.
+    first.register_event("ticksusd")
+    yield first.emit_event("ticks.eur", 1)
+    yield first.emit_event("ticksusd", 2)
+    yield third.emit_event("ticks.usd", 3)
+    yield wait_for(lambda: second_bus.received == 3 and first_bus.received == 1)
+
+    # The copies of every subscription and the node's own events are dropped.
+    assert topics(eur) == ["ticks.eur"]
+    assert topics(everything) == ["ticks.eur", "ticks.usd"]
+    assert topics(local) == ["ticks.eur", "ticks.usd"]
+    # The third node has no subscribers, nothing is sent to it.
+    assert third_bus.received == 0
+    assert server.forwarded == 7
+
+    second.unsubscribe_all(eur)
+    second.unsubscribe_all(everything)
+    yield wait_for(lambda: len(server.commands) == 8)
+    assert server.commands[-2:] == [("UNSUBSCRIBE", [b"jsonrpc:ticks.eur"]),
+                                    ("PUNSUBSCRIBE", [b"jsonrpc:ticks*"])]
+
+    for _, bus in nodes:
+        bus.close()
+
+
+@pytest.mark.gen_test
+def test_resubscribes_after_reconnecting(server):
+    bus = RedisBackend("127.0.0.1", server.port, reconnect_interval=0.01)
+    node = make_node(bus)
+    transport = Transport()
+    # Subscriptions made before connecting are sent once connected.
+    yield node.method_subscribe(transport, "ticks.eur")
+    yield bus.connect()
+    yield wait_for(lambda: len(server.commands) == 1)
+
+    for stream in list(server.channels):
+        stream.close()
+    yield wait_for(lambda: len(server.commands) == 2 and bus.publisher is not None)
+    assert server.commands[-1] == ("SUBSCRIBE", [b"jsonrpc:ticks.eur"])
+
+    other = RedisBackend("127.0.0.1", server.port)
+    yield other.connect()
+    yield make_node(other).emit_event("ticks.eur", 1)
+    yield wait_for(lambda: transport.messages)
+    bus.close()
+    other.close()
+
+
+@pytest.mark.gen_test
+def test_reconnects_after_an_invalid_reply(server):
+    bus = RedisBackend("127.0.0.1", server.port, reconnect_interval=0.01)
+    node = make_node(bus)
+    transport = Transport()
+    yield node.method_subscribe(transport, "ticks.eur")
+    yield bus.connect()
+    yield wait_for(lambda: len(server.commands) == 1)
+
+    subscriber = bus.subscriber
+    for stream, channels in list(server.channels.items()):
+        if channels:
+            stream.write(b"$not a size\r\n")
+    yield wait_for(lambda: len(server.commands) == 2 and bus.subscriber not in (None, subscriber))
+    assert server.commands[-1] == ("SUBSCRIBE", [b"jsonrpc:ticks.eur"])
+
+    other = RedisBackend("127.0.0.1", server.port)
+    yield other.connect()
+    yield make_node(other).emit_event("ticks.eur", 1)
+    yield wait_for(lambda: transport.messages)
+    bus.close()
+    other.close()
+
+
+def test_forgets_the_oldest_nodes():
+    bus = RedisBackend()
+    bus.max_nodes = 2
+    for node_id, sequence in ((b"a", 1), (b"b", 1), (b"a", 2), (b"a", 2), (b"c", 1)):
+        bus._received(b"jsonrpc:ticks", MESSAGE_HEADER.pack(node_id * 16, sequence) + b"{}")
+    assert bus.last_seen == {b"a" * 16: 2, b"c" * 16: 1}
+    assert bus.received == 4
@@ -0,0 +1,53 @@
+"""
+Tests for building request objects from decoded calls.
+"""
+
+import pytest
+
+from json_rpc.exceptions import InvalidRequest
+from json_rpc.jsonrpc import (JSONRPC1Request, JSONRPC2Request, JSONRPCResponse,
+                              process_request)
+
+
+def test_valid_requests():
+    request = process_request({"jsonrpc": "2.0", "method": "sum", "params": [1, 2], "id": 4})
+    assert isinstance(request, JSONRPC2Request)
+    assert (request.method, request.params, request.id, request.is_notification) == ("sum", [1, 2], 4, False)
+
+    request = process_request({"method": "sum", "params": [1], "id": None})
+    assert isinstance(request, JSONRPC1Request)
+    assert request.version == "1.0"
+    assert request.is_notification
+
+
+def test_missing_params_raise_attribute_error():
+    request = process_request({"jsonrpc": "2.0", "method": "ping"})
+    assert request.is_notification
+    with pytest.raises(AttributeError):
+        request.params
+
+
+def test_requests_have_no_dict():
+    request = process_request({"jsonrpc": "2.0", "method": "ping", "id": 1})
+    with pytest.raises(AttributeError):
+        request.other = 1
+
+
+@pytest.mark.parametrize("call, version, message", [
+    (1, None, "Invalid type for request, expected an object"),
+    ({"jsonrpc": "2.0", "id": 1}, None, "Missing member 'method'"),
+    ({"method": "foo", "params": []}, None, 'Missing member "id"'),
+    ({"method": "foo", "id": 1}, None, 'Invalid type for "params"!'),
+    ({"jsonrpc": "2.0", "method": "foo", "params": "no", "id": 1}, None, 'Invalid type for "params"!'),
+    ({"jsonrpc": "2.0", "method": 5, "id": 1}, None, '"method" must be a string!'),
+    ({"jsonrpc": "3000", "method": "foo", "id": 1}, None, "Unsupported JSONRPC version!"),
+    ({"jsonrpc": "3000", "method": "foo", "id": 1}, "2.0", "Refusing to handle version 3000"),
+])
+def test_invalid_requests_are_returned(call, version, message):
+    error = process_request(call, version=version)
+    assert isinstance(error, InvalidRequest)
+    assert str(error.args[0]) == message
+
+    response = JSONRPCResponse("2.0", exception=error)
+    assert response.error.code == -32600
+    assert response.id == (call.get("id") if isinstance(call, dict) else None)
@@ -0,0 +1,129 @@
+"""
+Tests for the weighted fair scheduling of the calls.
+"""
+
+import asyncio
+import gc
+import json
+import warnings
+
+import pytest
+
+from json_rpc.jsonrpc import process_request
+from json_rpc.metrics import Metrics
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.scheduling import FairScheduler, TrafficClass
+
+
+class Processor(BasicJSONRPCProcessor):
+    version = "2.0"
+    batch_concurrency = None
+
+    def __init__(self, scheduler, metrics=None):
+        self.scheduler = scheduler
+        self.metrics = metrics
+        self.started = []
+
+    async def compute_result(self, request):
+        self.started.append(request.id)
+        await asyncio.sleep(request.params[0] if request.params else 0)
+        return request.id
+
+
+def call(method, id, params=(), **members):
+    return dict({"jsonrpc": "2.0", "method": method, "params": list(params), "id": id}, **members)
+
+
+def body(calls):
+    return json.dumps(calls).encode()
+
+
+@pytest.mark.gen_test
+def test_classes_share_by_weight():
+    scheduler = FairScheduler(1, classes={"interactive": TrafficClass(weight=4), "bulk": TrafficClass(weight=1)},
+                              methods={"fast": "interactive", "report": "bulk"})
+    processor = Processor(scheduler)
+    calls = [call("report", "r%d" % i) for i in range(6)] + [call("fast", "f%d" % i) for i in range(4)]
+    responses = yield processor.process_jsonrpc(body(calls))
+
+    assert sorted(response.result for response in responses) == sorted(c["id"] for c in calls)
+    # The interactive calls do not wait for the bulk backlog.
+    assert processor.started[:6] == ["r0", "f0", "f1", "f2", "f3", "r1"]
+    assert scheduler.running == 0
+
+
+@pytest.mark.gen_test
+def test_class_concurrency():
+    scheduler = FairScheduler(4, classes={"bulk": TrafficClass(max_concurrency=1)}, methods={"report": "bulk"})
+    processor = Processor(scheduler)
+    pending = asyncio.ensure_future(processor.process_jsonrpc(body(
+        [call("report", 1, [0.05]), call("report", 2, [0.05]), call("fast", 3, [0.05])])))
+    yield asyncio.sleep(0.01)
+
+    assert processor.started == [1, 3]
+    assert scheduler.stats() == {"bulk": {"running": 1, "queued": 1},
+                                 "default": {"running": 1, "queued": 0}}
+    yield pending
+    assert processor.started == [1, 3, 2]
+
+
+def test_classify_by_client():
+    scheduler = FairScheduler(1, classes={"vip": TrafficClass(weight=10), "bulk": TrafficClass()},
+                              methods={"report": "bulk"},
+                              classify=lambda processor, request: "vip" if processor == "vip" else None)
+    assert scheduler.class_of("vip", process_request(call("report", 1))).name == "vip"
+    assert scheduler.class_of("other", process_request(call("report", 1))).name == "bulk"
+    assert scheduler.class_of("other", process_request(call("m", 1))).name == "default"
+
+
+@pytest.mark.gen_test
+def test_queue_wait_counts_against_the_timeout():
+    metrics = Metrics()
+    processor = Processor(FairScheduler(1), metrics)
+    responses = yield processor.process_jsonrpc(body([call("m", 1, [0.1]), call("m", 2, [0], timeout=0.02)]))
+
+    assert responses[0].result == 1
+    assert responses[1].error.code == -32002
+    assert processor.started == [1]
+    assert processor.scheduler.stats() == {"default": {"running": 0, "queued": 0}}
+
+    waits = metrics.queue_waits["default"]
+    assert waits.count == 1
+    assert 'jsonrpc_queue_wait_seconds_count{class="default"} 1' in metrics.render()
+
+
+@pytest.mark.gen_test
+def test_passed_deadline_starts_no_call():
+    processor = Processor(FairScheduler(1))
+    processor.deadline = asyncio.get_event_loop().time() - 1
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        response = yield processor.process_jsonrpc(body(call("m", 1)))
+        gc.collect()
+
+    assert response.error.code == -32002
+    assert processor.started == []
+    assert processor.scheduler.stats() == {"default": {"running": 0, "queued": 0}}
+    # No coroutine was left unawaited.
+    assert [str(warning.message) for warning in caught] == []
+
+
+@pytest.mark.gen_test
+def test_cancelling_running_and_queued_calls_together():
+    scheduler = FairScheduler(1)
+    processor = Processor(scheduler)
+    tasks = [asyncio.ensure_future(processor.process_jsonrpc(body(call("sleep", id, [1]))))
+             for id in range(3)]
+    yield asyncio.sleep(0.01)
+    assert scheduler.stats() == {"default": {"running": 1, "queued": 2}}
+
+    # Like the calls of a closed WebSocket, in the same iteration of the loop.
+    for task in tasks:
+        task.cancel()
+    results = yield asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert scheduler.running == 0
+    assert scheduler.stats() == {"default": {"running": 0, "queued": 0}}
+
+    response = yield processor.process_jsonrpc(body(call("sleep", 4)))
+    assert response.result == 4
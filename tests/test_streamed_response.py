@@ -0,0 +1,74 @@
+"""
+Tests for writing batch responses while the calls complete.
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+import tornado.web
+
+from json_rpc.tornado_handler import JSONRPCHandler, StreamingJSONRPCHandler
+
+
+async def sleep(request):
+    await asyncio.sleep(request.params[0])
+    return request.params[0]
+
+
+@pytest.fixture
+def app():
+    options = {"response_creator": sleep, "batch_concurrency": None, "stream_response": True}
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, options),
+        (r"/streaming", StreamingJSONRPCHandler, options),
+    ])
+
+
+def batch(*delays, notifications=False):
+    calls = []
+    for index, delay in enumerate(delays):
+        call = {"jsonrpc": "2.0", "method": "sleep", "params": [delay]}
+        if not notifications:
+            call["id"] = index
+        calls.append(call)
+    return json.dumps(calls)
+
+
+@pytest.mark.parametrize("path", ["/jsonrpc", "/streaming"])
+@pytest.mark.gen_test
+def test_responses_are_written_as_completed(http_client, base_url, path):
+    chunks = []
+    start = time.monotonic()
+
+    def on_chunk(chunk):
+        chunks.append((time.monotonic() - start, chunk))
+
+    response = yield http_client.fetch(base_url + path, method="POST",
+                                       body=batch(0.3, 0.01, 0.1),
+                                       streaming_callback=on_chunk)
+
+    assert response.headers.get("Transfer-Encoding") == "chunked"
+    body = json.loads(b"".join(chunk for _, chunk in chunks))
+    assert [r["id"] for r in body] == [1, 2, 0]
+    # The fast call reached the client long before the slow one finished.
+    assert chunks[0][0] < 0.2
+
+
+@pytest.mark.gen_test
+def test_batch_of_notifications_writes_nothing(http_client, base_url):
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST",
+                                       body=batch(0.01, 0.01, notifications=True))
+    assert response.body == b""
+
+
+@pytest.mark.gen_test
+def test_single_request_and_errors_are_not_streamed(http_client, base_url):
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST",
+                                       body=json.dumps({"jsonrpc": "2.0", "method": "sleep",
+                                                        "params": [0], "id": 1}))
+    assert json.loads(response.body) == {"jsonrpc": "2.0", "id": 1, "result": 0}
+
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST", body=b"[")
+    assert json.loads(response.body)["error"]["code"] == -32700
@@ -0,0 +1,125 @@
+"""
+Tests for decoding request bodies while they are received.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+
+from json_rpc.exceptions import EmptyBatchRequest, ParseError
+from json_rpc.jsonrpc import IncrementalDecoder
+from json_rpc.tornado_handler import StreamingJSONRPCHandler
+
+
+def make_batch(count):
+    return [{"jsonrpc": "2.0", "method": 'tricky"]}[,\\', "params": [i, {"x": "]"}], "id": i}
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 100000])
+def test_decoder_splits_batch(chunk_size):
+    body = json.dumps(make_batch(5) + [1, []]).encode()
+    decoder = IncrementalDecoder()
+
+    requests = []
+    for pos in range(0, len(body), chunk_size):
+        requests.extend(decoder.feed(body[pos:pos + chunk_size]))
+
+    assert decoder.finish() is None
+    assert [r.id for r in requests[:5]] == list(range(5))
+    assert requests[0].method == 'tricky"]}[,\\'
+    assert requests[0].params == [0, {"x": "]"}]
+    assert all(isinstance(r, Exception) for r in requests[5:])
+
+
+def test_decoder_buffers_single_request():
+    decoder = IncrementalDecoder()
+    assert decoder.feed(b'  {"method": "foo", ') == []
+    assert decoder.feed(b'"id": 1}') == []
+    assert decoder.finish() == b'  {"method": "foo", "id": 1}'
+
+
+@pytest.mark.parametrize("body", [b'[{"id": 1}', b'[1,]', b'[1,,2]', b'[1}', b'[1] 2', b'[{"a": 1]}'])
+def test_decoder_invalid_batch(body):
+    decoder = IncrementalDecoder()
+    with pytest.raises(ParseError):
+        decoder.feed(body)
+        decoder.finish()
+
+
+def test_decoder_empty_batch():
+    decoder = IncrementalDecoder()
+    assert decoder.feed(b" [ ] ") == []
+    with pytest.raises(EmptyBatchRequest):
+        decoder.finish()
+
+
+class Backend:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.started = None
+
+    async def __call__(self, request):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        if not self.started.done():
+            self.started.set_result(True)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return request.params[0]
+
+
+@pytest.fixture
+def backend():
+    return Backend()
+
+
+@pytest.fixture
+def app(backend):
+    return tornado.web.Application([
+        (r"/jsonrpc", StreamingJSONRPCHandler, {"response_creator": backend, "batch_concurrency": 3}),
+    ])
+
+
+def producer(body, started=None):
+    async def produce(write):
+        half = len(body) // 2
+        await write(body[:half])
+        if started is not None:
+            # The first calls are dispatched before the body is complete.
+            await started
+        await write(body[half:])
+    return produce
+
+
+@pytest.mark.gen_test
+def test_batch_is_dispatched_while_streaming(http_client, base_url, backend):
+    backend.started = asyncio.get_event_loop().create_future()
+    body = json.dumps(make_batch(20)).encode()
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST",
+                                       body_producer=producer(body, backend.started))
+
+    responses = json.loads(response.body)
+    assert [r["id"] for r in responses] == list(range(20))
+    assert [r["result"] for r in responses] == list(range(20))
+    assert backend.max_running == 3
+
+
+@pytest.mark.gen_test
+def test_single_request(http_client, base_url, backend):
+    backend.started = asyncio.get_event_loop().create_future()
+    body = json.dumps(make_batch(1)[0]).encode()
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST", body_producer=producer(body))
+
+    assert json.loads(response.body) == {"jsonrpc": "2.0", "id": 0, "result": 0}
+
+
+@pytest.mark.gen_test
+def test_invalid_body(http_client, base_url, backend):
+    backend.started = asyncio.get_event_loop().create_future()
+    response = yield http_client.fetch(base_url + "/jsonrpc", method="POST", body=b'[{"id": 1},')
+
+    assert json.loads(response.body)["error"]["code"] == -32700
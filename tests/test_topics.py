@@ -0,0 +1,120 @@
+"""
+Tests for hierarchical topics and wildcard subscriptions.
+"""
+
+import pytest
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.events import TopicTrie, split_topic
+from json_rpc.exceptions import InvalidEvent, InvalidParams
+
+
+@pytest.mark.parametrize("topic", ["", "a..b", "a.#.b", "a.b*", "a.#x"])
+def test_invalid_patterns(topic):
+    with pytest.raises(ValueError):
+        split_topic(topic)
+
+
+def test_concrete_topics_have_no_wildcards():
+    assert split_topic("orders.eu.1", pattern=False) == ["orders", "eu", "1"]
+    with pytest.raises(ValueError):
+        split_topic("orders.*", pattern=False)
+
+
+@pytest.mark.parametrize("topic, expected", [
+    ("orders.eu.1", {"exact", "one", "any", "region", "all", "middle"}),
+    ("orders.eu.2", {"one", "any", "region", "all", "middle"}),
+    ("orders.us.1", {"one", "any", "all"}),
+    ("orders.eu", {"any", "region", "all"}),
+    ("orders", {"any", "all"}),
+    ("orders.eu.1.items", {"any", "region", "all"}),
+    ("prices.eu.1", {"all", "middle"}),
+    ("prices", {"all"}),
+])
+def test_matching(topic, expected):
+    trie = TopicTrie()
+    trie.add("orders.eu.1", "exact")
+    trie.add("orders.*.*", "one")
+    trie.add("orders.#", "any")
+    trie.add("orders.eu.#", "region")
+    trie.add("#", "all")
+    trie.add("*.eu.*", "middle")
+
+    assert trie.match(topic) == expected
+
+
+def test_removing_prunes_the_trie():
+    trie = TopicTrie()
+    trie.add("a.b.c", 1)
+    trie.add("a.b.c", 2)
+    trie.add("a.*", 1)
+
+    assert trie.remove("a.b.c", 1)
+    assert not trie.remove("a.b.c", 1)
+    trie.remove_subscriber(1)
+    assert trie.patterns == {"a.b.c": {2}}
+    assert list(trie.root.children["a"].children) == ["b"]
+
+    trie.remove("a.b.c", 2)
+    assert trie.root.children == {}
+    assert trie.by_subscriber == {}
+
+
+@pytest.mark.parametrize("pattern, covered", [
+    ("orders.eu.1", True),
+    ("orders.eu.*", True),
+    ("orders.#", True),
+    ("prices.eu", True),
+    ("prices.*", True),
+    ("prices.eu.1", False),
+    ("prices.#", False),
+    ("users", False),
+])
+def test_covers(pattern, covered):
+    trie = TopicTrie()
+    trie.add("orders.#", True)
+    trie.add("prices.*", True)
+
+    assert trie.covers(pattern) == covered
+
+
+class Transport:
+    codec = None
+
+    def __init__(self):
+        self.messages = []
+
+    def emit_message(self, data):
+        self.messages.append(data)
+
+
+@pytest.mark.gen_test
+def test_dispatcher_wildcard_subscriptions():
+    dispatcher = Dispatcher()
+    dispatcher.register_event(["orders.#", "status"])
+    region, order, status = Transport(), Transport(), Transport()
+
+    yield dispatcher.method_subscribe(region, "orders.eu.*")
+    yield dispatcher.method_subscribe(order, "orders.eu.7")
+    yield dispatcher.method_subscribe(status, "status")
+    with pytest.raises(InvalidEvent):
+        yield dispatcher.method_subscribe(status, "users.*")
+
+    yield dispatcher.emit_event("orders.eu.7", "shipped")
+    yield dispatcher.emit_event("orders.eu.8", "paid")
+    yield dispatcher.emit_event("orders.us.1", "paid")
+    with pytest.raises(InvalidEvent):
+        yield dispatcher.emit_event("users.1")
+    with pytest.raises(InvalidEvent):
+        yield dispatcher.emit_event("orders.*")
+
+    assert (len(region.messages), len(order.messages), len(status.messages)) == (2, 1, 0)
+
+    yield dispatcher.method_unsubscribe(region, "orders.eu.*")
+    with pytest.raises(InvalidEvent):
+        yield dispatcher.method_unsubscribe(region, "orders.eu.*")
+    for topic in (["status"], {"status": 1}, None, "orders..eu"):
+        with pytest.raises(InvalidParams):
+            yield dispatcher.method_unsubscribe(status, topic)
+    dispatcher.unsubscribe_all(order)
+    assert dispatcher.EVENTS == {"status": {status}}
@@ -0,0 +1,166 @@
+"""
+Tests for the sampled tracing of the requests.
+"""
+
+import json
+import logging
+
+import pytest
+import tornado.web
+from tornado.websocket import websocket_connect
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.processor import BasicJSONRPCProcessor
+from json_rpc.tornado_handler import JSONRPCHandler, JSONRPCHandlerWS
+from json_rpc.tracing import FileExporter, RingBufferExporter, Tracer
+
+
+async def add(a, b):
+    return a + b
+
+
+class Processor(BasicJSONRPCProcessor):
+    version = "2.0"
+
+    def __init__(self, tracer=None):
+        self.tracer = tracer
+        self.dispatcher = Dispatcher()
+        self.dispatcher.register_method(add)
+
+    async def compute_result(self, request):
+        return await self.dispatcher.dispatch(None, request)
+
+
+@pytest.fixture
+def exporter():
+    return RingBufferExporter()
+
+
+@pytest.fixture
+def app(exporter):
+    dispatcher = Dispatcher()
+    dispatcher.register_method(add)
+    tracer = Tracer(exporter)
+
+    async def dispatch(request):
+        return await dispatcher.dispatch(None, request)
+
+    return tornado.web.Application([
+        (r"/jsonrpc", JSONRPCHandler, {"response_creator": dispatch, "tracer": tracer}),
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher, "tracer": tracer}),
+    ])
+
+
+def call(method, params, id=1):
+    return {"jsonrpc": "2.0", "method": method, "params": params, "id": id}
+
+
+def names(spans):
+    return [span.name for span in spans]
+
+
+@pytest.mark.gen_test
+def test_spans_of_a_batch(exporter):
+    processor = Processor(Tracer(exporter))
+    trace = processor.start_trace("test")
+    body = json.dumps([call("add", [1, 2], 1), call("nope", [], 2)]).encode()
+    responses = yield processor.process_jsonrpc(body, trace)
+    processor.encode_response(responses, trace)
+    trace.finish()
+
+    spans = exporter.spans()
+    assert names(spans) == ["jsonrpc.request", "jsonrpc.decode", "jsonrpc.validate",
+                            "jsonrpc.dispatch", "jsonrpc.dispatch", "jsonrpc.encode"]
+    root, decode, validate, first, second, encode = spans
+    assert {span.trace_id for span in spans} == {root.trace_id}
+    assert all(span.parent is root for span in spans[1:])
+    assert decode.attributes == {"size": len(body)}
+    assert validate.attributes == {"calls": 2}
+    assert first.attributes == {"method": "add", "id": 1}
+    assert second.attributes["error.code"] == -32601
+    assert encode.attributes["size"] > 0
+    assert all(span.end >= span.start for span in spans)
+
+
+@pytest.mark.gen_test
+def test_parse_errors_are_recorded(exporter):
+    processor = Processor(Tracer(exporter))
+    trace = processor.start_trace("test")
+    response = yield processor.process_jsonrpc(b"{", trace)
+    trace.finish()
+
+    assert response.error.code == -32700
+    decode = exporter.spans()[1]
+    assert decode.error is not None
+    assert decode.toJson()["status"]["code"] == 2
+
+
+@pytest.mark.gen_test
+def test_not_sampled(exporter, caplog):
+    processor = Processor(Tracer(exporter, sample_rate=0))
+    assert processor.start_trace("test") is None
+
+    with caplog.at_level(logging.DEBUG, logger="jsonrpc"):
+        yield processor.process_jsonrpc(json.dumps(call("add", [1, 2])).encode())
+    assert not exporter.spans()
+    assert not caplog.records
+
+
+def test_sample_rate():
+    tracer = Tracer(RingBufferExporter(), sample_rate=0.5)
+    sampled = sum(tracer.start_trace() is not None for _ in range(2000))
+    assert 800 < sampled < 1200
+
+
+def test_ring_buffer_size():
+    exporter = RingBufferExporter(size=3)
+    tracer = Tracer(exporter)
+    for _ in range(3):
+        trace = tracer.start_trace()
+        trace.child("jsonrpc.decode").finish()
+        trace.finish()
+    assert len(exporter.spans()) == 3
+
+
+def test_file_exporter(tmpdir):
+    path = str(tmpdir.join("traces.jsonl"))
+    exporter = FileExporter(path)
+    trace = Tracer(exporter).start_trace(transport="http")
+    with trace.child("jsonrpc.dispatch", method="add", id=1):
+        pass
+    trace.finish()
+    exporter.close()
+
+    with open(path) as traces:
+        lines = traces.readlines()
+    assert len(lines) == 1
+    spans = json.loads(lines[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+    assert child["parentSpanId"] == root["spanId"]
+    assert child["attributes"] == [{"key": "method", "value": {"stringValue": "add"}},
+                                   {"key": "id", "value": {"intValue": "1"}}]
+    assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
+
+
+@pytest.mark.gen_test
+def test_http_request_is_traced(http_client, base_url, exporter):
+    yield http_client.fetch(base_url + "/jsonrpc", method="POST", body=json.dumps(call("add", [1, 2])))
+
+    spans = exporter.spans()
+    assert names(spans) == ["jsonrpc.request", "jsonrpc.decode", "jsonrpc.validate",
+                            "jsonrpc.dispatch", "jsonrpc.encode", "jsonrpc.write"]
+    assert spans[0].attributes == {"transport": "http", "http.status_code": 200}
+
+
+@pytest.mark.gen_test
+def test_websocket_message_is_traced(http_server, base_url, exporter):
+    client = yield websocket_connect(base_url.replace("http", "ws") + "/ws")
+    client.write_message(json.dumps(call("add", [1, 2])))
+    yield client.read_message()
+    client.close()
+
+    spans = exporter.spans()
+    assert names(spans) == ["jsonrpc.request", "jsonrpc.decode", "jsonrpc.validate",
+                            "jsonrpc.dispatch", "jsonrpc.encode", "jsonrpc.write"]
+    assert spans[0].attributes == {"transport": "websocket"}
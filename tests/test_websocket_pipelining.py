@@ -0,0 +1,89 @@
+"""
+Tests for processing the messages of a WebSocket connection concurrently.
+"""
+
+import asyncio
+import json
+
+import pytest
+import tornado.web
+from tornado.websocket import websocket_connect
+
+from json_rpc.dispacher import Dispatcher
+from json_rpc.tornado_handler import JSONRPCHandlerWS
+
+
+class Backend:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    async def sleep(self, delay):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(delay)
+        self.running -= 1
+        return delay
+
+
+@pytest.fixture
+def backend():
+    return Backend()
+
+
+@pytest.fixture
+def app(backend):
+    dispatcher = Dispatcher()
+    dispatcher.register_method(backend.sleep)
+    return tornado.web.Application([
+        (r"/ws", JSONRPCHandlerWS, {"dispatcher": dispatcher, "max_in_flight": 2}),
+    ])
+
+
+@pytest.fixture
+def ws_url(http_server, base_url):
+    return base_url.replace("http", "ws") + "/ws"
+
+
+def call(id, delay):
+    return json.dumps({"jsonrpc": "2.0", "method": "sleep", "params": [delay], "id": id})
+
+
+@pytest.mark.gen_test
+def test_responses_are_written_when_ready(ws_url):
+    client = yield websocket_connect(ws_url)
+    client.write_message(call(1, 0.2))
+    client.write_message(call(2, 0.01))
+
+    first = json.loads((yield client.read_message()))
+    second = json.loads((yield client.read_message()))
+    assert (first["id"], second["id"]) == (2, 1)
+    assert second == {"jsonrpc": "2.0", "id": 1, "result": 0.2}
+    client.close()
+
+
+@pytest.mark.gen_test
+def test_in_flight_limit(ws_url, backend):
+    client = yield websocket_connect(ws_url)
+    for id in range(6):
+        client.write_message(call(id, 0.02))
+
+    ids = set()
+    for _ in range(6):
+        ids.add(json.loads((yield client.read_message()))["id"])
+
+    assert ids == set(range(6))
+    assert backend.max_running == 2
+    client.close()
+
+
+@pytest.mark.gen_test
+def test_notifications_and_errors(ws_url):
+    client = yield websocket_connect(ws_url)
+    client.write_message(json.dumps({"jsonrpc": "2.0", "method": "sleep", "params": [0]}))
+    client.write_message(json.dumps({"jsonrpc": "2.0", "method": "nope", "id": 7}))
+
+    response = json.loads((yield client.read_message()))
+    assert response["id"] == 7
+    assert response["error"]["code"] == -32601
+    client.close()